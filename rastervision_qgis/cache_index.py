@@ -0,0 +1,220 @@
+import os
+import glob
+import json
+import time
+import threading
+from collections import Counter
+
+from .settings import Settings
+from .log import Log
+
+REVALIDATE_ALWAYS = 'always'
+REVALIDATE_TTL = 'ttl'
+REVALIDATE_OFFLINE = 'offline'
+
+REVALIDATION_POLICIES = [REVALIDATE_ALWAYS, REVALIDATE_TTL, REVALIDATE_OFFLINE]
+
+class CacheIndex:
+    """JSON backed index of the remote files that have been copied into a working directory.
+
+    Each entry records the URI, the remote version (ETag, or last modified time for
+    file systems without ETags), the size and the local path of the copy, along with
+    when it was last validated against the remote file. This lets get_local_path decide
+    whether a cached file can be used without a round trip to the remote file system.
+    """
+    FILE_NAME = 'cache-index.json'
+
+    # Minimum number of seconds between writes of the index file while loading.
+    SAVE_INTERVAL = 2
+
+    def __init__(self, working_dir, policy=REVALIDATE_TTL, ttl=3600):
+        self.path = os.path.join(working_dir, CacheIndex.FILE_NAME)
+        self.policy = policy
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.dirty = False
+        self.last_save = 0
+
+        # URIs that must not be evicted, e.g. the files of the loaded experiment.
+        self.pinned = set()
+        # Numbers of users of URIs that are being read, e.g. exports being predicted.
+        self.in_use = Counter()
+
+        # Hit and miss counts of get_local_path for this session.
+        self.hits = 0
+        self.misses = 0
+
+        self._read()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)['entries']
+        except (ValueError, KeyError, OSError) as e:
+            Log.log_warning('Ignoring unreadable cache index {}: {}'.format(self.path, e))
+            self.entries = {}
+
+    def get(self, uri):
+        with self.lock:
+            entry = self.entries.get(uri)
+            if entry:
+                return dict(entry)
+            return None
+
+    def is_cached(self, uri, local_path):
+        """Returns True if the index has a complete local copy of the URI at local_path."""
+        entry = self.get(uri)
+        return (entry is not None and
+                entry['local_path'] == local_path and
+                os.path.exists(local_path) and
+                os.path.getsize(local_path) == entry['size'])
+
+    def needs_revalidation(self, uri):
+        if self.policy == REVALIDATE_OFFLINE:
+            return False
+        if self.policy == REVALIDATE_TTL:
+            entry = self.get(uri)
+            return entry is None or time.time() - entry['validated'] > self.ttl
+        return True
+
+    def put(self, uri, local_path, version, size):
+        now = time.time()
+        with self.lock:
+            self.entries[uri] = {'local_path': local_path,
+                                 'version': version,
+                                 'size': size,
+                                 'validated': now,
+                                 'accessed': now}
+            self._changed()
+
+    def mark_validated(self, uri):
+        with self.lock:
+            entry = self.entries.get(uri)
+            if entry:
+                entry['validated'] = time.time()
+                entry['accessed'] = entry['validated']
+                self._changed()
+
+    def record_hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def set_pinned(self, uris):
+        with self.lock:
+            self.pinned = set(uris)
+
+    def acquire(self, uris):
+        """Keeps the URIs from being evicted until they are released as many times."""
+        with self.lock:
+            self.in_use.update(uris)
+
+    def release(self, uris):
+        with self.lock:
+            self.in_use.subtract(uris)
+            # Drop the URIs that are no longer used.
+            self.in_use += Counter()
+
+    def is_pinned(self, uri):
+        with self.lock:
+            return uri in self.pinned or uri in self.in_use
+
+    def get_or_build(self, cache_key, cache_path, version, build, cache_keys=None):
+        """Returns cache_path for a file derived from downloads, such as a label cache
+        or VRT, that is tracked in the index under cache_key, building it if needed.
+
+        build(tmp_path) writes the file to a temporary path next to cache_path and
+        returns True on success; the file is then moved into place and recorded with
+        the given version. If build fails, by returning False or raising, nothing is
+        left behind and None is returned or the error raised. cache_key is added to
+        the set cache_keys, if given, so that the caller can pin or acquire it.
+        """
+        if cache_keys is not None:
+            cache_keys.add(cache_key)
+        if self.is_cached(cache_key, cache_path):
+            self.touch(cache_key)
+            return cache_path
+
+        root, ext = os.path.splitext(cache_path)
+        tmp_path = '{}.{}.part{}'.format(root, threading.get_ident(), ext)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        built = False
+        try:
+            built = build(tmp_path) and os.path.exists(tmp_path)
+            if built:
+                os.replace(tmp_path, cache_path)
+        finally:
+            if not built:
+                # Along with sidecar files GDAL may have written, like journals.
+                for path in glob.glob(glob.escape(tmp_path) + '*'):
+                    os.remove(path)
+        if not built:
+            return None
+
+        self.put(cache_key, cache_path, version, os.path.getsize(cache_path))
+        return cache_path
+
+    def items(self):
+        """Returns a snapshot of (uri, entry) pairs."""
+        with self.lock:
+            return [(uri, dict(entry)) for uri, entry in self.entries.items()]
+
+    def touch(self, uri):
+        with self.lock:
+            entry = self.entries.get(uri)
+            if entry:
+                entry['accessed'] = time.time()
+                self._changed()
+
+    def remove(self, uri):
+        with self.lock:
+            if self.entries.pop(uri, None):
+                self._changed()
+
+    def _changed(self):
+        self.dirty = True
+        if time.time() - self.last_save > CacheIndex.SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = '{}.tmp'.format(self.path)
+            with open(tmp_path, 'w') as f:
+                json.dump({'entries': self.entries}, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+            self.last_save = time.time()
+
+
+class CacheIndexInstance:
+    """Holds one CacheIndex per working directory."""
+    indexes = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def get(working_dir):
+        with CacheIndexInstance.lock:
+            index = CacheIndexInstance.indexes.get(working_dir)
+            if index is None:
+                settings = Settings()
+                index = CacheIndex(working_dir,
+                                   settings.get_cache_revalidation(),
+                                   settings.get_cache_ttl())
+                CacheIndexInstance.indexes[working_dir] = index
+            return index
+
+    @staticmethod
+    def reset():
+        """Saves and drops all indexes, so that they are reloaded with current settings."""
+        with CacheIndexInstance.lock:
+            for index in CacheIndexInstance.indexes.values():
+                index.save()
+            CacheIndexInstance.indexes = {}
@@ -0,0 +1,88 @@
+import os
+import glob
+import shutil
+
+from .cache_index import CacheIndexInstance
+from .settings import Settings
+from .log import Log
+
+MB = 1024 * 1024
+
+class CacheManager:
+    """Keeps the downloads in a working directory within the disk budget set in
+    the config dialog, evicting the least recently accessed files first.
+
+    Files pinned on the cache index (the files of the currently loaded experiment)
+    and files acquired on it (such as exports being predicted) are never evicted.
+    """
+
+    def __init__(self, working_dir, max_size_mb=None):
+        if max_size_mb is None:
+            max_size_mb = Settings().get_cache_size_limit()
+        self.index = CacheIndexInstance.get(working_dir)
+        self.max_size = max_size_mb * MB
+
+    def usage(self):
+        """Returns the number of bytes taken by indexed downloads."""
+        return sum(entry['size'] for _, entry in self.index.items())
+
+    def hit_rate(self):
+        total = self.index.hits + self.index.misses
+        if total == 0:
+            return None
+        return self.index.hits / total
+
+    def describe(self):
+        """Returns a human readable summary of usage and hit rate."""
+        usage = 'Cache usage: {:.1f} MB'.format(self.usage() / MB)
+        if self.max_size:
+            usage += ' of {:.0f} MB'.format(self.max_size / MB)
+        hit_rate = self.hit_rate()
+        if hit_rate is None:
+            return usage
+        return '{}, hit rate {:.0%} ({} hits, {} misses)'.format(
+            usage, hit_rate, self.index.hits, self.index.misses)
+
+    def pin(self, uris):
+        self.index.set_pinned(uris)
+
+    @staticmethod
+    def remove_files(local_path):
+        """Removes a cached file along with its sidecar files (e.g. .aux.xml), or a
+        cached directory such as an unpacked predict package."""
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path)
+            return
+        for path in [local_path] + glob.glob(glob.escape(local_path) + '.*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Evicts least recently accessed files until usage is within the budget.
+        A budget of 0 means the cache is unbounded. Returns the number of bytes freed.
+        """
+        if not self.max_size:
+            return 0
+
+        entries = self.index.items()
+        usage = sum(entry['size'] for _, entry in entries)
+        freed = 0
+        for uri, entry in sorted(entries, key=lambda e: e[1]['accessed']):
+            if usage - freed <= self.max_size:
+                break
+            if self.index.is_pinned(uri):
+                continue
+            try:
+                CacheManager.remove_files(entry['local_path'])
+            except OSError as e:
+                Log.log_warning('Unable to evict {}: {}'.format(entry['local_path'], e))
+                continue
+            self.index.remove(uri)
+            freed += entry['size']
+
+        if freed:
+            Log.log_info('Evicted {:.1f} MB from the download cache.'.format(freed / MB))
+        self.index.save()
+        return freed
@@ -16,6 +16,13 @@ from PyQt5 import uic
 from PyQt5 import QtWidgets
 
 from .settings import Settings
+from .cache_manager import CacheManager
+from .vector_cache import VECTOR_CACHE_FORMATS
+from .predict_package_cache import PredictPackageCache
+from .prediction_cache import PredictionCache
+from .predictor_pool import PredictorPoolInstance
+from .raster_util import EXPORT_COMPRESSIONS
+from .cache_index import (CacheIndexInstance, REVALIDATION_POLICIES, REVALIDATE_TTL)
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'config_dialog_base.ui'))
@@ -29,6 +36,21 @@ class ConfigDialog(QtWidgets.QDialog, FORM_CLASS):
 
         self.working_dir_file_select_button.clicked.connect(self.select_working_dir)
 
+        # Display names, in the order of REVALIDATION_POLICIES
+        self.cache_revalidation_combobox.addItems(['Always', 'After TTL', 'Never (Offline)'])
+        self.cache_revalidation_combobox.currentIndexChanged.connect(self.revalidation_changed)
+
+        self.vector_cache_formats = [''] + sorted(VECTOR_CACHE_FORMATS)
+        self.vector_cache_format_combobox.addItems(
+            ['None (use GeoJSON)'] + sorted(VECTOR_CACHE_FORMATS))
+
+        # Display names, in the order of EXPORT_COMPRESSIONS
+        self.export_compression_combobox.addItems(['None', 'LZW', 'Deflate', 'Zstd'])
+        self.export_tiled_checkbox.toggled.connect(self.export_block_size_spinbox.setEnabled)
+
+    def revalidation_changed(self, i):
+        self.cache_ttl_spinbox.setEnabled(i == REVALIDATION_POLICIES.index(REVALIDATE_TTL))
+
     def select_working_dir(self):
         path = QtWidgets.QFileDialog.getExistingDirectory()
         if path:
@@ -38,6 +60,30 @@ class ConfigDialog(QtWidgets.QDialog, FORM_CLASS):
 class ConfigDialogController(object):
     def __init__(self):
         self.dlg = ConfigDialog()
+        self.dlg.clear_predict_packages_button.clicked.connect(self.clear_predict_packages)
+        self.dlg.clear_predictions_button.clicked.connect(self.clear_predictions)
+
+    def update_predict_package_label(self):
+        packages = PredictPackageCache(Settings().get_working_dir()).list()
+        size = sum(s for _, s in packages) / (1024 * 1024)
+        self.dlg.predict_package_cache_label.setText(
+            'Predict packages: {} cached ({:.1f} MB)'.format(len(packages), size))
+        self.dlg.clear_predict_packages_button.setEnabled(len(packages) > 0)
+
+    def clear_predict_packages(self):
+        PredictorPoolInstance.get().clear()
+        PredictPackageCache(Settings().get_working_dir()).clear()
+        self.update_predict_package_label()
+        self.update_prediction_cache_label()
+
+    def update_prediction_cache_label(self):
+        count = PredictionCache(Settings().get_working_dir()).count()
+        self.dlg.prediction_cache_label.setText('Predictions: {} cached'.format(count))
+        self.dlg.clear_predictions_button.setEnabled(count > 0)
+
+    def clear_predictions(self):
+        PredictionCache(Settings().get_working_dir()).clear()
+        self.update_prediction_cache_label()
 
     def run(self):
         settings = Settings()
@@ -45,9 +91,72 @@ class ConfigDialogController(object):
         self.dlg.show()
 
         self.dlg.working_dir_edit.setText(settings.get_working_dir())
+        self.dlg.download_threads_spinbox.setValue(settings.get_download_threads())
+
+        policy = settings.get_cache_revalidation()
+        if policy not in REVALIDATION_POLICIES:
+            policy = REVALIDATE_TTL
+        self.dlg.cache_revalidation_combobox.setCurrentIndex(REVALIDATION_POLICIES.index(policy))
+        self.dlg.revalidation_changed(REVALIDATION_POLICIES.index(policy))
+        self.dlg.cache_ttl_spinbox.setValue(settings.get_cache_ttl() // 60)
+
+        self.dlg.cache_size_limit_spinbox.setValue(settings.get_cache_size_limit())
+
+        vector_cache_format = settings.get_vector_cache_format()
+        if vector_cache_format in self.dlg.vector_cache_formats:
+            self.dlg.vector_cache_format_combobox.setCurrentIndex(
+                self.dlg.vector_cache_formats.index(vector_cache_format))
+        else:
+            self.dlg.vector_cache_format_combobox.setCurrentIndex(0)
+
+        self.dlg.build_overviews_checkbox.setChecked(settings.get_build_overviews())
+        self.dlg.overview_processes_spinbox.setValue(settings.get_overview_processes())
+
+        self.dlg.cache_usage_label.setText(
+            CacheManager(settings.get_working_dir()).describe())
+        self.update_predict_package_label()
+        self.update_prediction_cache_label()
+
+        compression = settings.get_export_compression()
+        if compression not in EXPORT_COMPRESSIONS:
+            compression = 'NONE'
+        self.dlg.export_compression_combobox.setCurrentIndex(
+            EXPORT_COMPRESSIONS.index(compression))
+        self.dlg.export_tiled_checkbox.setChecked(settings.get_export_tiled())
+        self.dlg.export_block_size_spinbox.setValue(settings.get_export_block_size())
+        self.dlg.export_block_size_spinbox.setEnabled(settings.get_export_tiled())
+        self.dlg.export_threads_spinbox.setValue(settings.get_export_threads())
+
+        self.dlg.predictor_pool_size_spinbox.setValue(settings.get_predictor_pool_size())
+        self.dlg.predictor_memory_limit_spinbox.setValue(settings.get_predictor_memory_limit())
+        self.dlg.worker_python_edit.setText(settings.get_worker_python())
+        self.dlg.docker_executable_edit.setText(settings.get_docker_executable())
 
         # Run the dialog event loop
         result = self.dlg.exec_()
 
         if result:
             settings.set_working_dir(self.dlg.working_dir_edit.text())
+            settings.set_download_threads(self.dlg.download_threads_spinbox.value())
+            settings.set_cache_revalidation(
+                REVALIDATION_POLICIES[self.dlg.cache_revalidation_combobox.currentIndex()])
+            settings.set_cache_ttl(self.dlg.cache_ttl_spinbox.value() * 60)
+            settings.set_cache_size_limit(self.dlg.cache_size_limit_spinbox.value())
+            settings.set_vector_cache_format(
+                self.dlg.vector_cache_formats[self.dlg.vector_cache_format_combobox.currentIndex()])
+            settings.set_build_overviews(self.dlg.build_overviews_checkbox.isChecked())
+            settings.set_overview_processes(self.dlg.overview_processes_spinbox.value())
+            settings.set_export_compression(
+                EXPORT_COMPRESSIONS[self.dlg.export_compression_combobox.currentIndex()])
+            settings.set_export_tiled(self.dlg.export_tiled_checkbox.isChecked())
+            settings.set_export_block_size(self.dlg.export_block_size_spinbox.value())
+            settings.set_export_threads(self.dlg.export_threads_spinbox.value())
+            settings.set_predictor_pool_size(self.dlg.predictor_pool_size_spinbox.value())
+            settings.set_predictor_memory_limit(self.dlg.predictor_memory_limit_spinbox.value())
+            settings.set_worker_python(self.dlg.worker_python_edit.text())
+            settings.set_docker_executable(self.dlg.docker_executable_edit.text() or 'docker')
+
+            # Pick up the new revalidation settings on the next load.
+            CacheIndexInstance.reset()
+
+            CacheManager(settings.get_working_dir()).evict()
@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache_index import CacheIndexInstance
+from .utils import get_local_path
+
+class DownloadManager:
+    """Fetches URIs into the working directory using a pool of threads.
+
+    Each URI is only fetched once per manager: requesting a URI that is already
+    downloading (or downloaded) returns the same future, so files shared between
+    scenes, like a common AOI, are not transferred twice.
+    """
+
+    def __init__(self, working_dir, num_threads=4):
+        self.working_dir = working_dir
+        self.executor = ThreadPoolExecutor(max_workers=max(1, num_threads))
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, uri):
+        """Starts fetching the URI, returning a future for its local path."""
+        with self.lock:
+            future = self.futures.get(uri)
+            if future is None:
+                future = self.executor.submit(get_local_path, uri, self.working_dir)
+                self.futures[uri] = future
+            return future
+
+    def fetch_all(self, uris):
+        return [self.fetch(uri) for uri in uris]
+
+    def get_local_path(self, uri):
+        """Blocks until the URI has been fetched, and returns the local path."""
+        return self.fetch(uri).result()
+
+    def shutdown(self, cancel=False):
+        """Shuts down the thread pool. If cancel is True, downloads that have
+        not started yet are dropped and this does not wait on running ones.
+        """
+        if cancel:
+            with self.lock:
+                for future in self.futures.values():
+                    future.cancel()
+        self.executor.shutdown(wait=not cancel)
+        CacheIndexInstance.get(self.working_dir).save()
@@ -17,13 +17,18 @@ from PyQt5 import (QtWidgets, QtCore)
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtCore import Qt
 
-from qgis.core import (Qgis, QgsProject)
+from qgis.core import (Qgis, QgsApplication, QgsProject)
 
 from .settings import Settings, StyleProfile
-from .experiment_loader import (ExperimentLoader,
+from .experiment_loader import (FOOTPRINTS_LAYER,
+                                ExperimentLoader,
+                                ExperimentLoadTask,
                                 ExperimentLoadOptions,
                                 SceneLoadOptions,
                                 LoadContext)
+from .download_manager import DownloadManager
+from .footprints import FootprintTask
+from .lazy_loader import LazySceneLoader
 from .log import Log
 
 import rastervision as rv
@@ -48,6 +53,9 @@ class ExperimentDialog(QtWidgets.QDialog, FORM_CLASS):
         self.iface = iface
 
         self.load_button.clicked.connect(self.load_experiment_clicked)
+        self.footprints_button.clicked.connect(self.show_footprints_clicked)
+        self.footprints_button.setEnabled(False)
+        self.footprint_task = None
 
         def select_all(check_state_fn, target_list):
             def f():
@@ -91,6 +99,7 @@ class ExperimentDialog(QtWidgets.QDialog, FORM_CLASS):
 
         experiment = rv.ExperimentConfig.from_proto(msg)
         self.experiment = experiment
+        self.footprints_button.setEnabled(True)
         ds = experiment.dataset
 
         self.train_scene_list.clear()
@@ -118,10 +127,58 @@ class ExperimentDialog(QtWidgets.QDialog, FORM_CLASS):
             self.test_scene_list.addItem(item)
 
 
+    def show_footprints_clicked(self):
+        """Adds a layer with the footprint of every scene of the experiment to the
+        project, to help pick scenes without loading them."""
+        if self.footprint_task is not None:
+            return
+        ds = self.experiment.dataset
+        scenes = [('train-', s, None) for s in ds.train_scenes] + \
+                 [('val-', s, None) for s in ds.validation_scenes] + \
+                 [('test-', s, None) for s in ds.test_scenes]
+        settings = Settings()
+        task = FootprintTask(scenes, settings.get_working_dir(), self.footprints_loaded,
+                             settings.get_download_threads())
+        # Keep a reference to the task, otherwise it will be garbage collected.
+        self.footprint_task = task
+        self.footprints_button.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+
+    def footprints_loaded(self, task, result):
+        self.footprint_task = None
+        self.footprints_button.setEnabled(True)
+        if not result:
+            return
+        ExperimentLoader.remove_layers(
+            [l for key, layers in ExperimentLoader.get_owned_layers().items()
+             if key[3] == FOOTPRINTS_LAYER for l in layers])
+        ExperimentLoader.set_layer_key(task.layer, (self.experiment.id, '', '', FOOTPRINTS_LAYER))
+        QgsProject.instance().addMapLayer(task.layer)
+        self.iface.setActiveLayer(task.layer)
+        self.iface.zoomToActiveLayer()
+        if task.failures:
+            Log.log_warning('No footprint for scenes: {}'.format(', '.join(task.failures)))
+
+
 class ExperimentDialogController(object):
     def __init__(self, iface):
         self.dlg = ExperimentDialog(iface)
         self.iface = iface
+        self.load_task = None
+        self.footprint_task = None
+        self.lazy_loader = None
+
+    def stop(self):
+        """Cancels running loads and stops lazy loading, e.g. when the plugin unloads."""
+        if self.load_task is not None:
+            self.load_task.cancel()
+            self.load_task = None
+        if self.footprint_task is not None:
+            self.footprint_task.cancel()
+            self.footprint_task = None
+        if self.lazy_loader is not None:
+            self.lazy_loader.stop()
+            self.lazy_loader = None
 
     def showLogs(self):
         # TODO
@@ -133,6 +190,10 @@ class ExperimentDialogController(object):
         settings = Settings()
 
         self.dlg.experiment_uri_line_edit.setText(settings.get_experiment_uri())
+        self.dlg.stream_rasters_checkbox.setChecked(settings.get_stream_rasters())
+        self.dlg.mosaic_rasters_checkbox.setChecked(settings.get_mosaic_rasters())
+        self.dlg.lazy_load_checkbox.setChecked(settings.get_lazy_load())
+        self.dlg.lazy_scene_budget_spinbox.setValue(settings.get_lazy_scene_budget())
 
         profiles = settings.get_style_profiles()
         profiles.insert(0, StyleProfile.EMPTY())
@@ -154,6 +215,17 @@ class ExperimentDialogController(object):
             experiment_uri = self.dlg.experiment_uri_line_edit.text()
             settings.set_experiment_uri(experiment_uri)
 
+            stream_rasters = self.dlg.stream_rasters_checkbox.isChecked()
+            settings.set_stream_rasters(stream_rasters)
+
+            mosaic_rasters = self.dlg.mosaic_rasters_checkbox.isChecked()
+            settings.set_mosaic_rasters(mosaic_rasters)
+
+            lazy_load = self.dlg.lazy_load_checkbox.isChecked()
+            settings.set_lazy_load(lazy_load)
+            lazy_scene_budget = self.dlg.lazy_scene_budget_spinbox.value()
+            settings.set_lazy_scene_budget(lazy_scene_budget)
+
             style_profile = None
             if not style_profile_index == 0:
                 style_profile = profiles[style_profile_index]
@@ -165,18 +237,6 @@ class ExperimentDialogController(object):
             load_predictions = self.dlg.predictions_checkbox.checkState()
             load_aoi = self.dlg.aoi_checkbox.checkState()
 
-            # Check that we really want to clear the project if there
-            # are existing layers.
-            project = QgsProject.instance()
-            layers = list(project.mapLayers().values())
-
-            if len(layers) > 0:
-                reply = QMessageBox.question(self.iface.mainWindow(), 'Continue?',
-                                             ('There are existing layers that will be cleared '
-                                              'from this project. Continue?'), QMessageBox.Yes, QMessageBox.No)
-                if reply == QMessageBox.No:
-                    return
-
             train_scenes = []
             for n in range(0, self.dlg.train_scene_list.count()):
                 item = self.dlg.train_scene_list.item(n)
@@ -213,14 +273,94 @@ class ExperimentDialogController(object):
                 test_scenes=test_scenes
             )
 
-            ctx = LoadContext(task=experiment.task,
-                              iface=self.iface,
-                              style_profile=style_profile,
-                              working_dir=settings.get_working_dir())
+            # Check that we really want to remove the layers of a previous load
+            # that these options don't call for. Other layers are left alone.
+            if lazy_load:
+                stale_layers = [l for layers in ExperimentLoader.get_owned_layers().values()
+                                for l in layers]
+            else:
+                _, stale_layers = ExperimentLoader.reconcile(experiment, opts)
 
-            errors = ExperimentLoader.load(experiment, opts, ctx)
+            if len(stale_layers) > 0:
+                reply = QMessageBox.question(self.iface.mainWindow(), 'Continue?',
+                                             ('{} layers of a previous load will be removed '
+                                              'from this project. Continue?'.format(
+                                                  len(stale_layers))),
+                                             QMessageBox.Yes, QMessageBox.No)
+                if reply == QMessageBox.No:
+                    return
+
+            working_dir = settings.get_working_dir()
+            overview_processes = 0
+            if settings.get_build_overviews():
+                overview_processes = settings.get_overview_processes()
+            download_threads = settings.get_download_threads()
+            vector_cache_format = settings.get_vector_cache_format()
+
+            def make_context():
+                return LoadContext(task=experiment.task,
+                                   iface=self.iface,
+                                   style_profile=style_profile,
+                                   working_dir=working_dir,
+                                   downloads=DownloadManager(working_dir, download_threads),
+                                   stream_rasters=stream_rasters,
+                                   vector_cache_format=vector_cache_format,
+                                   mosaic_rasters=mosaic_rasters,
+                                   overview_processes=overview_processes)
+
+            self.stop()
+
+            if lazy_load:
+                scenes = ExperimentLoader.get_scenes_to_load(experiment, opts)
+                task = FootprintTask(scenes, working_dir,
+                                     lambda t, result: self.footprints_loaded(
+                                         t, result, experiment, working_dir, make_context,
+                                         lazy_scene_budget),
+                                     download_threads)
+                self.footprint_task = task
+                QgsApplication.taskManager().addTask(task)
+                return
+
+            # Keep a reference to the task, otherwise it will be garbage collected
+            # while it is running.
+            task = ExperimentLoadTask(experiment, opts, make_context())
+            task.taskCompleted.connect(lambda: self.load_task_completed(task))
+            task.taskTerminated.connect(lambda: self.load_task_completed(task))
+            self.load_task = task
+            QgsApplication.taskManager().addTask(task)
+
+    def footprints_loaded(self, task, result, experiment, working_dir, make_context,
+                          max_scenes):
+        """Shows the footprint layer of a lazy load, and starts loading the scenes
+        in view."""
+        if task is not self.footprint_task:
+            return
+        self.footprint_task = None
+        if not result:
+            return
 
-            if errors:
-                msg = "Some Files Not Loaded. Check Logs for details."
-                widget = self.iface.messageBar().createMessage("Raster Vision", msg)
-                self.iface.messageBar().pushWidget(widget, Qgis.Warning)
+        ExperimentLoader.clear_layers()
+        ExperimentLoader.set_layer_key(task.layer, (experiment.id, '', '', FOOTPRINTS_LAYER))
+        QgsProject.instance().addMapLayer(task.layer)
+        self.iface.setActiveLayer(task.layer)
+        self.iface.zoomToActiveLayer()
+
+        if task.failures:
+            msg = "No footprint for {} of {} scenes; they will not be loaded. " \
+                  "Check Logs for details.".format(len(task.failures), len(task.scenes))
+            widget = self.iface.messageBar().createMessage("Raster Vision", msg)
+            self.iface.messageBar().pushWidget(widget, Qgis.Warning)
+
+        self.lazy_loader = LazySceneLoader(self.iface, experiment, task.scenes, task.layer,
+                                           working_dir, make_context, max_scenes)
+        self.lazy_loader.update()
+
+    def load_task_completed(self, task):
+        if task is self.load_task:
+            self.load_task = None
+
+        if task.failures:
+            msg = "{} of {} scenes not fully loaded. Check Logs for details.".format(
+                len(task.failures), len(task.scenes))
+            widget = self.iface.messageBar().createMessage("Raster Vision", msg)
+            self.iface.messageBar().pushWidget(widget, Qgis.Warning)
@@ -1,6 +1,8 @@
 import os
 import json
+from concurrent.futures import (wait, FIRST_COMPLETED)
 
+from PyQt5.QtCore import QCoreApplication
 from PyQt5.QtGui import QColor
 
 from qgis.core import *
@@ -9,14 +11,82 @@ from .registry import RegistryInstance
 from .log import Log
 from .raster_util import get_raster_layers
 from .label_loader import GeoJSONLoader
+from .utils import get_local_path
+from .cache_manager import CacheManager
+from .overviews import OverviewBuilder
+from .style_cache import StyleCacheInstance
+
+# Custom property holding the key of the layers the plugin creates for experiments.
+LAYER_KEY_PROPERTY = 'rastervision/layer_key'
+
+# Custom property marking the split and scene layer tree groups the plugin creates.
+GROUP_PROPERTY = 'rastervision/group'
+
+# Kinds of layers loaded for a scene, as the last part of a layer key.
+IMAGE_LAYER = 'image'
+GROUND_TRUTH_LAYER = 'ground_truth'
+PREDICTIONS_LAYER = 'predictions'
+AOI_LAYER = 'aoi'
+FOOTPRINTS_LAYER = 'footprints'
+
+class LayerLoadError(Exception):
+    pass
 
 class LoadContext:
-    def __init__(self, task, iface, style_profile, working_dir):
+    def __init__(self, task, iface, style_profile, working_dir,
+                 downloads=None, stream_rasters=False, vector_cache_format=None,
+                 mosaic_rasters=False, overview_processes=0):
         self.task = task
         self.iface = iface
         self.style_profile = style_profile
         self.working_dir = working_dir
+        self.downloads = downloads
+        self.stream_rasters = stream_rasters
+        self.vector_cache_format = vector_cache_format
+        self.mosaic_rasters = mosaic_rasters
+        self.overview_processes = overview_processes
         self.registry = RegistryInstance.get()
+        self.layers = []
+        # Cache index keys of the files derived from downloads (label caches, VRT
+        # mosaics) that the loaded layers read, so that they can be pinned.
+        self.cache_keys = set()
+
+        # Key given to the layers added next, see ExperimentLoader.get_layer_key.
+        self.experiment_id = None
+        self.layer_key = None
+
+    def get_local_path(self, uri):
+        """Returns the local path for the URI, going through the download manager
+        if there is one so that in-flight downloads are shared.
+        """
+        if self.downloads:
+            return self.downloads.get_local_path(uri)
+        return get_local_path(uri, self.working_dir)
+
+    def add_layer(self, layer):
+        """Collects a layer built by a loader. Layers are not added to the
+        project here, as loaders may be running on a worker thread; see take_layers.
+        """
+        if not layer.isValid():
+            raise LayerLoadError('Unable to load layer {} from {}'.format(
+                layer.name(), layer.source()))
+        if self.layer_key is not None:
+            ExperimentLoader.set_layer_key(layer, self.layer_key)
+        self.layers.append(layer)
+        return layer
+
+    def take_layers(self):
+        """Returns the collected layers, handing them over to the main thread so that
+        they can be added to the project there, by ExperimentLoader.update_project
+        for experiments (see ExperimentLoadTask.finished) or ExperimentLoader.add_layers
+        for predictions. Must be called from the thread that ran the loaders.
+        """
+        layers = self.layers
+        self.layers = []
+        main_thread = QCoreApplication.instance().thread()
+        for layer in layers:
+            layer.moveToThread(main_thread)
+        return layers
 
 class SceneLoadOptions:
     def __init__(self,
@@ -60,11 +130,150 @@ class ExperimentLoadOptions:
         self.test_scenes = dict(map(lambda s: (s.scene_id, s), test_scenes))
 
 class ExperimentLoader:
+    @staticmethod
+    def set_layer_key(layer, key):
+        """Marks a layer as created by the plugin for (experiment id, split, scene id,
+        kind), so that later loads can tell which layers they own."""
+        layer.setCustomProperty(LAYER_KEY_PROPERTY, json.dumps(list(key)))
+
+    @staticmethod
+    def get_layer_key(layer):
+        """Returns the key set with set_layer_key, or None for layers the plugin
+        doesn't own."""
+        value = layer.customProperty(LAYER_KEY_PROPERTY)
+        if not value:
+            return None
+        return tuple(json.loads(value))
+
+    @staticmethod
+    def get_owned_layers():
+        """Returns {key: [layers]} for the layers of the project the plugin owns."""
+        result = {}
+        for layer in QgsProject.instance().mapLayers().values():
+            key = ExperimentLoader.get_layer_key(layer)
+            if key is not None:
+                result.setdefault(key, []).append(layer)
+        return result
+
+    @staticmethod
+    def remove_layers(layers):
+        if layers:
+            QgsProject.instance().removeMapLayers([layer.id() for layer in layers])
+            ExperimentLoader.prune_groups()
+
+    @staticmethod
+    def get_group(parent, name):
+        """Returns the plugin's child group of parent with the given name, creating it
+        if needed. Groups the user made with the same name are not used."""
+        for child in parent.children():
+            if QgsLayerTree.isGroup(child) and child.name() == name and \
+               child.customProperty(GROUP_PROPERTY):
+                return child
+        group = parent.addGroup(name)
+        group.setCustomProperty(GROUP_PROPERTY, True)
+        return group
+
+    @staticmethod
+    def prune_groups(parent=None):
+        """Removes the plugin's split and scene groups that have become empty."""
+        if parent is None:
+            parent = QgsProject.instance().layerTreeRoot()
+        for child in list(parent.children()):
+            if QgsLayerTree.isGroup(child) and child.customProperty(GROUP_PROPERTY):
+                ExperimentLoader.prune_groups(child)
+                if not child.children():
+                    parent.removeChildNode(child)
+
+    @staticmethod
+    def update_project(iface, layers, remove_layer_ids=()):
+        """
+        Removes and adds layers as one batch: the canvas is frozen, the layers are
+        registered with a single addMapLayers call, placed in split and scene groups
+        according to their keys, and the canvas is refreshed once at the end.
+        Layers without a key are put at the top of the layer tree.
+        """
+        project = QgsProject.instance()
+        canvas = iface.mapCanvas()
+        view = iface.layerTreeView()
+        canvas.freeze(True)
+        view.setUpdatesEnabled(False)
+        try:
+            remove_layer_ids = [i for i in remove_layer_ids if project.mapLayer(i)]
+            if remove_layer_ids:
+                project.removeMapLayers(remove_layer_ids)
+
+            root = project.layerTreeRoot()
+            project.addMapLayers(layers, False)
+            for layer in layers:
+                key = ExperimentLoader.get_layer_key(layer)
+                if key is None or not key[1]:
+                    root.insertLayer(0, layer)
+                    continue
+                _, split, scene_id, _ = key
+                group = ExperimentLoader.get_group(ExperimentLoader.get_group(root, split),
+                                                   scene_id)
+                # Later layers of a scene (labels, AOI) go above its imagery.
+                group.insertLayer(0, layer)
+
+            ExperimentLoader.prune_groups()
+        finally:
+            view.setUpdatesEnabled(True)
+            canvas.freeze(False)
+            canvas.refresh()
+
     @staticmethod
     def clear_layers():
-        layer_ids = QgsProject.instance().mapLayers().keys()
-        for layer_id in layer_ids:
-            QgsProject.instance().removeMapLayer(layer_id)
+        """Removes the layers the plugin created, leaving the user's own layers."""
+        ExperimentLoader.remove_layers(
+            [layer for layers in ExperimentLoader.get_owned_layers().values()
+             for layer in layers])
+
+    @staticmethod
+    def get_scene_layer_keys(experiment_id, layer_prefix, scene, opts):
+        """Returns the keys of the layers that loading the scene with opts creates."""
+        split = layer_prefix.rstrip('-')
+        kinds = []
+        if opts.load_image:
+            kinds.append(IMAGE_LAYER)
+        if opts.load_ground_truth and scene.label_source:
+            kinds.append(GROUND_TRUTH_LAYER)
+        if opts.load_predictions and scene.label_store:
+            kinds.append(PREDICTIONS_LAYER)
+        if opts.load_aoi and scene.aoi_uri:
+            kinds.append(AOI_LAYER)
+        return [(experiment_id, split, scene.id, kind) for kind in kinds]
+
+    @staticmethod
+    def reconcile(experiment, options):
+        """
+        Compares the layers the options call for with the plugin's layers in the
+        project. Returns (scenes, layers): the (layer_prefix, scene, opts) to load,
+        with opts narrowed to the layers that are missing, and the layers to remove
+        because they are no longer wanted. Layers that are already loaded are left
+        as they are, with their styling and providers.
+        """
+        owned = ExperimentLoader.get_owned_layers()
+        wanted = set()
+        scenes = []
+        for layer_prefix, scene, opts in ExperimentLoader.get_scenes_to_load(experiment,
+                                                                             options):
+            keys = ExperimentLoader.get_scene_layer_keys(experiment.id, layer_prefix,
+                                                         scene, opts)
+            wanted.update(keys)
+            missing = set(key[3] for key in keys if key not in owned)
+            if missing:
+                scenes.append((layer_prefix, scene, SceneLoadOptions(
+                    scene.id,
+                    load_image=IMAGE_LAYER in missing,
+                    load_ground_truth=GROUND_TRUTH_LAYER in missing,
+                    load_predictions=PREDICTIONS_LAYER in missing,
+                    load_aoi=AOI_LAYER in missing)))
+
+        # Footprint layers are kept, as they are not part of the options.
+        layers = [layer for key, key_layers in owned.items()
+                  if key not in wanted and key[3] != FOOTPRINTS_LAYER
+                  for layer in key_layers]
+        return scenes, layers
 
     @staticmethod
     def zoom_to_layer(ctx):
@@ -81,10 +290,42 @@ class ExperimentLoader:
                 ctx.iface.setActiveLayer(layer)
                 ctx.iface.zoomToActiveLayer()
 
+    @staticmethod
+    def get_scene_uris(scene, opts, ctx):
+        """Returns the URIs of all files needed to load the scene with the given options."""
+        uris = []
+        if opts.load_image:
+            config = scene.raster_source
+            loader = ctx.registry.get_raster_source_loader(config.source_type)
+            uris.extend(loader.get_uris(config, ctx))
+        if opts.load_ground_truth and scene.label_source:
+            config = scene.label_source
+            loader = ctx.registry.get_label_source_loader(config.source_type)
+            uris.extend(loader.get_uris(config, ctx))
+        if opts.load_predictions and scene.label_store:
+            config = scene.label_store
+            loader = ctx.registry.get_label_store_loader(config.store_type)
+            uris.extend(loader.get_uris(config, ctx))
+        if opts.load_aoi and scene.aoi_uri:
+            uris.append(scene.aoi_uri)
+        return uris
+
     @staticmethod
     def load_scene(layer_prefix, scene, opts, ctx):
+        try:
+            ExperimentLoader._load_scene(layer_prefix, scene, opts, ctx)
+        finally:
+            ctx.layer_key = None
+
+    @staticmethod
+    def _load_scene(layer_prefix, scene, opts, ctx):
         layer_name = "{}{}".format(layer_prefix, scene.id)
+
+        def set_kind(kind):
+            ctx.layer_key = (ctx.experiment_id, layer_prefix.rstrip('-'), scene.id, kind)
+
         if opts.load_image:
+            set_kind(IMAGE_LAYER)
             config = scene.raster_source
             loader = ctx.registry.get_raster_source_loader(config.source_type)
             style_file = None
@@ -92,6 +333,7 @@ class ExperimentLoader:
                 style_file = ctx.style_profile.image_style_file
             loader.load(config, layer_name, ctx, style_file)
         if opts.load_ground_truth and scene.label_source:
+            set_kind(GROUND_TRUTH_LAYER)
             config = scene.label_source
             loader = ctx.registry.get_label_source_loader(config.source_type)
             style_file = None
@@ -100,6 +342,7 @@ class ExperimentLoader:
             gt_layer_name = "{}-ground_truth".format(layer_name)
             loader.load(config, gt_layer_name, ctx, style_file)
         if opts.load_predictions and scene.label_store:
+            set_kind(PREDICTIONS_LAYER)
             config = scene.label_store
             loader = ctx.registry.get_label_store_loader(config.store_type)
             style_file = None
@@ -108,35 +351,193 @@ class ExperimentLoader:
             prediction_layer_name = "{}-predictions".format(layer_name)
             loader.load(config, prediction_layer_name, ctx, style_file)
         if opts.load_aoi and scene.aoi_uri:
+            set_kind(AOI_LAYER)
             style_file = None
             if ctx.style_profile:
                 style_file = ctx.style_profile.aoi_style_file
             GeoJSONLoader.load(scene.aoi_uri, "{}-AOI".format(layer_name), ctx, style_file)
 
     @staticmethod
-    def load(experiment, options, ctx):
-        ExperimentLoader.clear_layers()
-
-        for scene in experiment.dataset.train_scenes:
-            opts = options.train_scenes.get(scene.id)
-            if opts:
-                ExperimentLoader.load_scene("train-", scene, opts, ctx)
+    def add_layers(layers, group=None):
+        """Adds loaded layers to the project, into the layer tree group if one is given.
+        Must be called on the main thread."""
+        project = QgsProject.instance()
+        for layer in layers:
+            if group is None:
+                project.addMapLayer(layer)
+            else:
+                project.addMapLayer(layer, False)
+                group.addLayer(layer)
 
-        for scene in experiment.dataset.validation_scenes:
-            opts = options.validation_scenes.get(scene.id)
-            if opts:
-                ExperimentLoader.load_scene("val-", scene, opts, ctx)
-
-        for scene in experiment.dataset.test_scenes:
-            opts = options.test_scenes.get(scene.id)
-            if opts:
-                ExperimentLoader.load_scene("test-", scene, opts, ctx)
+    @staticmethod
+    def get_scenes_to_load(experiment, options):
+        """Returns (layer_prefix, scene, opts) for every scene selected in the options."""
+        result = []
+        for prefix, scenes, scene_options in [
+                ("train-", experiment.dataset.train_scenes, options.train_scenes),
+                ("val-", experiment.dataset.validation_scenes, options.validation_scenes),
+                ("test-", experiment.dataset.test_scenes, options.test_scenes)]:
+            for scene in scenes:
+                opts = scene_options.get(scene.id)
+                if opts:
+                    result.append((prefix, scene, opts))
+        return result
 
+    @staticmethod
+    def load_evaluators(experiment, ctx):
         # Dump any evaluatoions into the log if they exist
         for evaluator in experiment.evaluators:
             loader = ctx.registry.get_evaluator_loader(evaluator.evaluator_type)
             if loader:
                 loader.load(evaluator, ctx)
 
-        ExperimentLoader.zoom_to_layer(ctx)
-        return False
+
+class ExperimentLoadTask(QgsTask):
+    """Loads an experiment in the background.
+
+    Downloads and layer/data provider construction happen in run() on a worker
+    thread, reporting progress per scene. The layers are only added to the project
+    in finished(), which QGIS calls on the main thread. If the task is canceled,
+    the project is left untouched.
+
+    By default the project is reconciled with the options (see
+    ExperimentLoader.reconcile): only the missing layers are loaded, and the
+    plugin's layers that are no longer wanted are removed when the new ones are
+    added. With clear=False the layers are added to the project as it is, for
+    loading scenes incrementally; scenes can then be given directly as a list of
+    (layer_prefix, scene, opts) instead of through options.
+
+    The files the loaded layers read are pinned in the cache index, along with
+    the URIs in pinned, such as those of scenes loaded before with clear=False.
+    The URIs read by each scene are recorded in scene_uris.
+    """
+
+    def __init__(self, experiment, options, ctx, clear=True, scenes=None, pinned=()):
+        super().__init__('Loading Raster Vision experiment', QgsTask.CanCancel)
+        self.experiment = experiment
+        self.options = options
+        self.ctx = ctx
+        self.ctx.experiment_id = experiment.id
+        self.clear = clear
+        self.pinned = set(pinned)
+        self.stale_layer_ids = []
+        # Files read by the layers that the load keeps, to keep them pinned.
+        self.kept_paths = set()
+        if scenes is None:
+            if clear:
+                # The project is read here, on the main thread.
+                scenes, stale_layers = ExperimentLoader.reconcile(experiment, options)
+                self.stale_layer_ids = [layer.id() for layer in stale_layers]
+                self.kept_paths = set(
+                    layer.source().split('|')[0]
+                    for layers in ExperimentLoader.get_owned_layers().values()
+                    for layer in layers if layer.id() not in self.stale_layer_ids)
+            else:
+                scenes = ExperimentLoader.get_scenes_to_load(experiment, options)
+        self.scenes = scenes
+        # (layer_prefix, scene id) -> layers loaded for the scene
+        self.scene_layers = {}
+        # (layer_prefix, scene id) -> cache index keys of the files the scene reads
+        self.scene_uris = {}
+        self.layers = []
+        self.failures = []
+        self.exception = None
+        # Style cache counters at the start of the load, to report what it saved.
+        self.style_stats = StyleCacheInstance.get().get_stats()
+
+    def run(self):
+        downloads = self.ctx.downloads
+        try:
+            # Start fetching the files of every scene up front, then load each
+            # scene as soon as all of its files have arrived.
+            pending = []
+            for entry in self.scenes:
+                _, scene, opts = entry
+                futures = []
+                if downloads:
+                    futures = downloads.fetch_all(
+                        ExperimentLoader.get_scene_uris(scene, opts, self.ctx))
+                pending.append((entry, futures))
+
+            loaded = 0
+            while pending:
+                if self.isCanceled():
+                    return False
+
+                ready = [p for p in pending if all(f.done() for f in p[1])]
+                if not ready:
+                    waiting = [f for _, futures in pending for f in futures if not f.done()]
+                    wait(waiting, timeout=0.5, return_when=FIRST_COMPLETED)
+                    continue
+
+                for p in ready:
+                    pending.remove(p)
+                    layer_prefix, scene, opts = p[0]
+                    # Collect the label caches and mosaics of this scene only.
+                    self.ctx.cache_keys = set()
+                    try:
+                        ExperimentLoader.load_scene(layer_prefix, scene, opts, self.ctx)
+                    except Exception as e:
+                        Log.log_exception(e)
+                        self.failures.append((scene.id, str(e)))
+                    layers = self.ctx.take_layers()
+                    self.scene_layers[(layer_prefix, scene.id)] = layers
+                    self.scene_uris[(layer_prefix, scene.id)] = self.ctx.cache_keys | set(
+                        ExperimentLoader.get_scene_uris(scene, opts, self.ctx))
+                    self.layers.extend(layers)
+                    loaded += 1
+                    self.setProgress(100.0 * loaded / len(self.scenes))
+
+            if self.isCanceled():
+                return False
+            if self.clear:
+                ExperimentLoader.load_evaluators(self.experiment, self.ctx)
+
+            # Keep the files of this experiment, and make room in the cache.
+            cache = CacheManager(self.ctx.working_dir)
+            scenes = self.scenes
+            if self.options is not None:
+                # Include the scenes that were already loaded.
+                scenes = ExperimentLoader.get_scenes_to_load(self.experiment, self.options)
+            uris = set(uri for _, scene, opts in scenes
+                       for uri in ExperimentLoader.get_scene_uris(scene, opts, self.ctx))
+            uris |= self.pinned
+            # Label caches and mosaics, of the layers loaded now and of those kept.
+            for scene_uris in self.scene_uris.values():
+                uris |= scene_uris
+            uris |= set(uri for uri, entry in cache.index.items()
+                        if entry['local_path'] in self.kept_paths)
+            cache.pin(uris)
+            cache.evict()
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            if downloads:
+                downloads.shutdown(cancel=self.isCanceled())
+
+    def finished(self, result):
+        if result:
+            zoom = False
+            if self.clear:
+                owned = set(layer.id() for layers in ExperimentLoader.get_owned_layers().values()
+                            for layer in layers)
+                zoom = not (owned - set(self.stale_layer_ids))
+            ExperimentLoader.update_project(self.ctx.iface, self.layers, self.stale_layer_ids)
+            if zoom:
+                ExperimentLoader.zoom_to_layer(self.ctx)
+            if self.ctx.overview_processes:
+                OverviewBuilder.build(self.layers, self.ctx.working_dir,
+                                      self.ctx.overview_processes)
+            for scene_id, msg in self.failures:
+                Log.log_warning('Scene {} was not fully loaded: {}'.format(scene_id, msg))
+            hits, saved_time = StyleCacheInstance.get().get_stats()
+            if hits > self.style_stats[0]:
+                Log.log_info('Reused parsed styles {} times, saving {:.2f}s of parsing.'.format(
+                    hits - self.style_stats[0], saved_time - self.style_stats[1]))
+        elif self.exception:
+            Log.log_exception(self.exception)
+        else:
+            Log.log_info('Experiment load canceled.')
+        self.layers = []
@@ -0,0 +1,243 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from qgis.core import (QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
+                       QgsFeature,
+                       QgsField,
+                       QgsGeometry,
+                       QgsProject,
+                       QgsRectangle,
+                       QgsTask,
+                       QgsVectorLayer)
+from PyQt5.QtCore import QVariant
+
+from .utils import (get_local_path, get_vsi_path, streaming_options)
+from .log import Log
+
+FOOTPRINT_LAYER_NAME = 'scene-footprints'
+
+class FootprintCache:
+    """JSON backed cache of raster footprints by URI, in the working directory,
+    so that the headers of a dataset's rasters are only read once."""
+    FILE_NAME = 'footprint-cache.json'
+
+    def __init__(self, working_dir):
+        self.path = os.path.join(working_dir, FootprintCache.FILE_NAME)
+        self.lock = threading.Lock()
+        self.footprints = {}
+        self.dirty = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.footprints = dict((uri, tuple(fp)) for uri, fp in json.load(f).items())
+            except (ValueError, OSError) as e:
+                Log.log_warning('Ignoring unreadable footprint cache {}: {}'.format(
+                    self.path, e))
+
+    def get(self, uri):
+        with self.lock:
+            return self.footprints.get(uri)
+
+    def put(self, uri, footprint):
+        with self.lock:
+            self.footprints[uri] = footprint
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = '{}.part'.format(self.path)
+            with open(tmp_path, 'w') as f:
+                json.dump(self.footprints, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+def get_raster_source_uris(config):
+    """Returns the URIs of the rasters of a raster source config."""
+    uris = getattr(config, 'uris', None) or []
+    if isinstance(uris, str):
+        uris = [uris]
+    return list(uris)
+
+def get_raster_footprint(path):
+    """Returns (x_min, y_min, x_max, y_max, crs wkt) of the raster at path, read from
+    its header, or None if it can't be opened or is not georeferenced."""
+    from osgeo import gdal
+
+    ds = gdal.Open(path)
+    if ds is None or not ds.GetProjection():
+        return None
+    x0, dx, rx, y0, ry, dy = ds.GetGeoTransform()
+    xs = [x0 + dx * col + rx * row
+          for col in [0, ds.RasterXSize] for row in [0, ds.RasterYSize]]
+    ys = [y0 + ry * col + dy * row
+          for col in [0, ds.RasterXSize] for row in [0, ds.RasterYSize]]
+    return (min(xs), min(ys), max(xs), max(ys), ds.GetProjection())
+
+def get_vector_footprint(path):
+    """Returns (x_min, y_min, x_max, y_max, crs wkt) of the vector file at path."""
+    from osgeo import ogr
+
+    ds = ogr.Open(path)
+    if ds is None or ds.GetLayerCount() == 0:
+        return None
+    layer = ds.GetLayer(0)
+    x_min, x_max, y_min, y_max = layer.GetExtent()
+    srs = layer.GetSpatialRef()
+    # GeoJSON without a CRS is WGS 84.
+    wkt = srs.ExportToWkt() if srs else QgsCoordinateReferenceSystem('EPSG:4326').toWkt()
+    return (x_min, y_min, x_max, y_max, wkt)
+
+def get_uri_footprint(uri, working_dir, cache=None, download=True):
+    """
+    Returns the footprint of the raster at uri. Remote GeoTIFFs are read in place
+    through GDAL's virtual file systems with range requests, so that only their
+    headers are fetched, with the streaming options applied to those reads only.
+    Other remote rasters are downloaded only if download is True; otherwise None
+    is returned for them. Footprints are kept in the cache,
+    a FootprintCache, if one is given.
+    """
+    footprint = cache.get(uri) if cache else None
+    if footprint is not None:
+        return footprint
+
+    path = get_vsi_path(uri)
+    if path:
+        with streaming_options():
+            footprint = get_raster_footprint(path)
+    elif '://' not in uri or uri.startswith('file://') or download:
+        footprint = get_raster_footprint(get_local_path(uri, working_dir))
+    else:
+        return None
+
+    if footprint is not None and cache:
+        cache.put(uri, footprint)
+    return footprint
+
+def get_rasters_footprint(uris, working_dir, cache=None, download=True):
+    """Returns the footprint covering all the rasters, or None if one of them
+    can't be read (see get_uri_footprint)."""
+    footprint = None
+    for uri in uris:
+        raster_footprint = get_uri_footprint(uri, working_dir, cache, download)
+        if raster_footprint is None:
+            return None
+        footprint = merge_footprints(footprint, raster_footprint)
+    return footprint
+
+def merge_footprints(footprint, other):
+    """Returns the footprint covering both footprints, in the CRS of the first."""
+    if footprint is None:
+        return other
+    return (min(footprint[0], other[0]),
+            min(footprint[1], other[1]),
+            max(footprint[2], other[2]),
+            max(footprint[3], other[3]),
+            footprint[4])
+
+def get_scene_footprint(scene, working_dir, cache=None):
+    """
+    Returns (x_min, y_min, x_max, y_max, crs wkt) covering the scene's rasters.
+    Rasters are read as described in get_uri_footprint. If a raster can't be
+    read without downloading it, the scene's AOI is used if it has one, and the
+    rasters are only downloaded otherwise. Returns None if the footprint can't be found.
+    """
+    uris = get_raster_source_uris(scene.raster_source)
+    footprint = get_rasters_footprint(uris, working_dir, cache, download=False)
+    if footprint is None and scene.aoi_uri:
+        footprint = get_vector_footprint(get_local_path(scene.aoi_uri, working_dir))
+    if footprint is None:
+        footprint = get_rasters_footprint(uris, working_dir, cache, download=True)
+    return footprint
+
+def build_footprint_layer(footprints, name=FOOTPRINT_LAYER_NAME):
+    """
+    Builds a memory layer with one polygon per scene from a list of
+    (split, scene_id, footprint) where footprint is as returned by
+    get_scene_footprint. Footprints are transformed to the CRS of the first one.
+    """
+    crs = QgsCoordinateReferenceSystem.fromWkt(footprints[0][2][4]) if footprints \
+          else QgsCoordinateReferenceSystem('EPSG:4326')
+    layer = QgsVectorLayer('Polygon?crs={}'.format(crs.authid() or 'EPSG:4326'),
+                           name, 'memory')
+    if not crs.authid():
+        layer.setCrs(crs)
+    provider = layer.dataProvider()
+    provider.addAttributes([QgsField('scene_id', QVariant.String),
+                            QgsField('split', QVariant.String)])
+    layer.updateFields()
+
+    features = []
+    transforms = {}
+    for split, scene_id, (x_min, y_min, x_max, y_max, wkt) in footprints:
+        rect = QgsRectangle(x_min, y_min, x_max, y_max)
+        if wkt not in transforms:
+            transforms[wkt] = QgsCoordinateTransform(
+                QgsCoordinateReferenceSystem.fromWkt(wkt), layer.crs(), QgsProject.instance())
+        rect = transforms[wkt].transformBoundingBox(rect)
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromRect(rect))
+        feature.setAttributes([scene_id, split])
+        features.append(feature)
+    provider.addFeatures(features)
+    layer.updateExtents()
+    return layer
+
+
+class FootprintTask(QgsTask):
+    """Reads the footprints of scenes in the background on a pool of num_threads
+    threads, then calls on_finished(task, result) on the main thread with the
+    footprint layer built from them in task.layer. Footprints are cached by URI
+    in the working directory's FootprintCache.
+
+    scenes is a list of (layer_prefix, scene, opts) as returned by
+    ExperimentLoader.get_scenes_to_load; opts is not used.
+    """
+
+    def __init__(self, scenes, working_dir, on_finished, num_threads=8):
+        super().__init__('Reading Raster Vision scene footprints', QgsTask.CanCancel)
+        self.scenes = scenes
+        self.working_dir = working_dir
+        self.on_finished = on_finished
+        self.num_threads = max(1, num_threads)
+        self.footprints = []
+        self.failures = []
+        self.layer = None
+
+    def get_footprint(self, scene, cache):
+        if self.isCanceled():
+            return None
+        try:
+            return get_scene_footprint(scene, self.working_dir, cache)
+        except Exception as e:
+            Log.log_warning('Unable to read the footprint of scene {}: {}'.format(scene.id, e))
+            return None
+
+    def run(self):
+        cache = FootprintCache(self.working_dir)
+        executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        try:
+            futures = [executor.submit(self.get_footprint, scene, cache)
+                       for _, scene, _ in self.scenes]
+            for i, ((layer_prefix, scene, _), future) in enumerate(zip(self.scenes, futures)):
+                footprint = future.result()
+                if self.isCanceled():
+                    return False
+                if footprint is None:
+                    self.failures.append(scene.id)
+                else:
+                    self.footprints.append((layer_prefix.rstrip('-'), scene.id, footprint))
+                self.setProgress(100.0 * (i + 1) / len(self.scenes))
+            return True
+        finally:
+            executor.shutdown(wait=True)
+            cache.save()
+
+    def finished(self, result):
+        if result:
+            self.layer = build_footprint_layer(self.footprints)
+        self.on_finished(self, result)
@@ -1,24 +1,26 @@
-import json
-
 from PyQt5.QtGui import QColor
-from qgis.core import (QgsSymbol,
+from qgis.core import (QgsRasterLayer,
+                       QgsVectorLayer,
+                       QgsSymbol,
                        QgsSimpleLineSymbolLayer,
                        QgsRendererCategory,
                        QgsCategorizedSymbolRenderer)
 
-from .utils import get_local_path
+from .vector_cache import get_indexed_vector_path
+from .style_cache import StyleCacheInstance
 
 class GeoJSONLoader:
     @staticmethod
-    def _get_class_field(labels_uri):
+    def _get_class_field(layer):
+        """Returns the name of the field holding the class of each feature.
+
+        Uses the field list that OGR already read when opening the layer, instead
+        of parsing the label file again.
+        """
         potentials = ['className', 'class_name', 'label']
-        labels = None
-        with open(labels_uri) as f:
-            labels = json.loads(f.read())
-        feature = labels['features'][0]
-        properties = feature.get('properties', {})
+        field_names = layer.fields().names()
         for field in potentials:
-            if field in properties:
+            if field in field_names:
                 return field
         return potentials[0]
 
@@ -52,27 +54,38 @@ class GeoJSONLoader:
 
     @staticmethod
     def load(uri, layer_name, ctx, style_file=None):
-        path = get_local_path(uri, ctx.working_dir)
-        layer = ctx.iface.addVectorLayer(path, layer_name, 'ogr')
+        path = ctx.get_local_path(uri)
+        if ctx.vector_cache_format:
+            indexed_path = get_indexed_vector_path(uri, path, ctx.working_dir,
+                                                   ctx.vector_cache_format, ctx.cache_keys)
+            if indexed_path:
+                path = indexed_path
+        layer = ctx.add_layer(QgsVectorLayer(path, layer_name, 'ogr'))
         if style_file:
-            if style_file.endswith('.sld'):
-                layer.loadSldStyle(style_file)
-            else:
-                layer.loadNamedStyle(style_file)
+            StyleCacheInstance.get().apply(layer, style_file)
         else:
             class_map = ctx.task.class_map
-            class_field = GeoJSONLoader._get_class_field(path)
+            class_field = GeoJSONLoader._get_class_field(layer)
             renderer = GeoJSONLoader._make_vector_renderer(layer, class_field, class_map)
             layer.setRenderer(renderer)
 
 
 class GeoJSONUriLoader:
+    @staticmethod
+    def get_uris(config, ctx):
+        return [config.uri]
+
     @staticmethod
     def load(config, layer_name, ctx, style_file=None):
         GeoJSONLoader.load(config.uri, layer_name, ctx, style_file)
 
 
 class RasterGroundTruthLoader:
+    @staticmethod
+    def get_uris(config, ctx):
+        loader = ctx.registry.get_raster_source_loader(config.source.source_type)
+        return loader.get_uris(config.source, ctx)
+
     @staticmethod
     def load(config, layer_name, ctx, style_file=None):
         loader = ctx.registry.get_raster_source_loader(config.source.source_type)
@@ -80,15 +93,16 @@ class RasterGroundTruthLoader:
 
 
 class RasterPredictionLoader:
+    @staticmethod
+    def get_uris(config, ctx):
+        return [config.uri]
+
     @staticmethod
     def load(config, layer_name, ctx, style_file=None):
         uri = config.uri
-        path = get_local_path(uri, ctx.working_dir)
-        layer = ctx.iface.addRasterLayer(path, layer_name)
+        path = ctx.get_local_path(uri)
+        layer = ctx.add_layer(QgsRasterLayer(path, layer_name))
         if style_file:
-            if style_file.endswith('.sld'):
-                layer.loadSldStyle(style_file)
-            else:
-                layer.loadNamedStyle(style_file)
+            StyleCacheInstance.get().apply(layer, style_file)
 
         return layer
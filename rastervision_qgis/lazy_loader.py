@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+from PyQt5.QtCore import QTimer
+from qgis.core import (QgsApplication,
+                       QgsCoordinateTransform,
+                       QgsProject,
+                       QgsSpatialIndex)
+
+from .experiment_loader import (ExperimentLoader, ExperimentLoadTask)
+from .cache_manager import CacheManager
+from .log import Log
+
+class LazySceneLoader:
+    """Loads the layers of an experiment's scenes only when the map canvas reaches them.
+
+    Scenes are found through a QgsSpatialIndex over the footprint layer (see
+    footprints.py). When the canvas extent settles, the scenes it intersects that
+    are not loaded yet are loaded by an ExperimentLoadTask that adds to the
+    project without clearing it. Scenes out of view are unloaded, least recently
+    seen first, while more than max_scenes are loaded. The files of the loaded
+    scenes are the ones pinned in the cache index of working_dir.
+
+    make_context is called for each load and returns a new LoadContext. The loader
+    stops when the footprint layer is removed from the project.
+    """
+
+    # Milliseconds the canvas extent must stay put before loading.
+    SETTLE_DELAY = 300
+
+    def __init__(self, iface, experiment, scenes, footprint_layer, working_dir,
+                 make_context, max_scenes=20):
+        self.iface = iface
+        self.experiment = experiment
+        self.scenes = dict(((prefix.rstrip('-'), scene.id), (prefix, scene, opts))
+                           for prefix, scene, opts in scenes)
+        # The layer itself is deleted when the user removes it.
+        self.footprint_layer_id = footprint_layer.id()
+        self.footprint_crs = footprint_layer.crs()
+        self.working_dir = working_dir
+        self.make_context = make_context
+        self.max_scenes = max_scenes
+
+        self.index = QgsSpatialIndex(footprint_layer.getFeatures())
+        self.feature_scenes = {}
+        for feature in footprint_layer.getFeatures():
+            self.feature_scenes[feature.id()] = (feature['split'], feature['scene_id'])
+
+        # (split, scene id) -> ids of the scene's layers, least recently seen first.
+        self.loaded = OrderedDict()
+        # (split, scene id) -> cache index keys of the files the loaded scene reads.
+        self.scene_uris = {}
+        # Scenes the last load failed for, retried when the canvas moves again.
+        self.failed = set()
+        self.task = None
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(LazySceneLoader.SETTLE_DELAY)
+        self.timer.timeout.connect(self.update)
+        self.iface.mapCanvas().extentsChanged.connect(self.timer.start)
+        QgsProject.instance().layerWillBeRemoved.connect(self.layer_removed)
+
+    def stop(self):
+        """Stops following the canvas. Loaded layers are left in the project."""
+        try:
+            self.iface.mapCanvas().extentsChanged.disconnect(self.timer.start)
+        except TypeError:
+            pass
+        try:
+            QgsProject.instance().layerWillBeRemoved.disconnect(self.layer_removed)
+        except TypeError:
+            pass
+        self.timer.stop()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def layer_removed(self, layer_id):
+        if layer_id == self.footprint_layer_id:
+            self.stop()
+
+    def pin(self):
+        """Pins the files of the loaded scenes, and only those."""
+        uris = set()
+        for key in self.loaded:
+            uris |= self.scene_uris.get(key, set())
+        CacheManager(self.working_dir).pin(uris)
+        return uris
+
+    def get_visible_scenes(self):
+        canvas = self.iface.mapCanvas()
+        transform = QgsCoordinateTransform(canvas.mapSettings().destinationCrs(),
+                                           self.footprint_crs,
+                                           QgsProject.instance())
+        extent = transform.transformBoundingBox(canvas.extent())
+        return [self.feature_scenes[fid] for fid in self.index.intersects(extent)
+                if self.feature_scenes[fid] in self.scenes]
+
+    def update(self, retry_failed=True):
+        if self.task is not None:
+            # Checked again when the running load finishes.
+            return
+
+        visible = self.get_visible_scenes()
+        for key in visible:
+            if key in self.loaded:
+                self.loaded.move_to_end(key)
+
+        self.unload(set(visible))
+
+        to_load = [key for key in visible if key not in self.loaded and
+                   (retry_failed or key not in self.failed)]
+        if not to_load:
+            return
+
+        scenes = [self.scenes[key] for key in to_load]
+        task = ExperimentLoadTask(self.experiment, None, self.make_context(),
+                                  clear=False, scenes=scenes, pinned=self.pin())
+        task.taskCompleted.connect(lambda: self.load_finished(task, to_load, True))
+        task.taskTerminated.connect(lambda: self.load_finished(task, to_load, False))
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def load_finished(self, task, keys, completed):
+        """Records the scenes that were loaded. Scenes that produced no layers, or
+        all of them if the task failed or was canceled, are not recorded, so that
+        they are loaded again the next time the canvas moves over them."""
+        if task is not self.task:
+            return
+        self.task = None
+        self.failed = set()
+        for key in keys:
+            split, scene_id = key
+            layers = task.scene_layers.get((split + '-', scene_id)) if completed else None
+            if not layers:
+                self.failed.add(key)
+                continue
+            self.loaded[key] = [layer.id() for layer in layers]
+            self.loaded.move_to_end(key)
+            self.scene_uris[key] = task.scene_uris.get((split + '-', scene_id), set())
+        # The task pinned the files of the scenes that failed too.
+        self.pin()
+        # Catch up with the canvas, without retrying the failures right away.
+        self.update(retry_failed=False)
+
+    def unload(self, visible):
+        """Unloads scenes that are not visible, least recently seen first, until at
+        most max_scenes are loaded, and unpins their files."""
+        project = QgsProject.instance()
+        unloaded = False
+        for key in list(self.loaded):
+            if len(self.loaded) <= self.max_scenes:
+                break
+            if key in visible:
+                continue
+            layer_ids = [i for i in self.loaded.pop(key) if project.mapLayer(i)]
+            self.scene_uris.pop(key, None)
+            project.removeMapLayers(layer_ids)
+            ExperimentLoader.prune_groups()
+            Log.log_info('Unloaded scene {}'.format(key[1]))
+            unloaded = True
+        if unloaded:
+            self.pin()
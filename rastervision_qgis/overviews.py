@@ -0,0 +1,141 @@
+import os
+import shutil
+from collections import deque
+from subprocess import (check_output, CalledProcessError, STDOUT)
+
+from qgis.core import (QgsApplication, QgsProject, QgsRasterLayer, QgsTask)
+
+from .raster_util import get_source_paths
+from .log import Log
+
+# Overviews are built until the smallest level is under this size in pixels.
+MIN_OVERVIEW_SIZE = 256
+
+def get_overview_levels(path):
+    """Returns the overview levels to build for the raster at path, or an empty
+    list if it already has overviews or is too small to need them."""
+    from osgeo import gdal
+
+    ds = gdal.Open(path)
+    if ds is None or ds.RasterCount == 0:
+        return []
+    if ds.GetRasterBand(1).GetOverviewCount() > 0:
+        return []
+
+    levels = []
+    level = 2
+    while max(ds.RasterXSize, ds.RasterYSize) / level >= MIN_OVERVIEW_SIZE:
+        levels.append(level)
+        level *= 2
+    return levels
+
+def is_streamed(path):
+    """Returns True if the raster at path reads remote files, such as a VRT mosaic
+    of streamed rasters. Building overviews for one would read every remote pixel."""
+    return any(p.startswith('/vsi') for p in get_source_paths(path, remote=True))
+
+
+class OverviewTask(QgsTask):
+    """Builds external (.ovr) overviews for a raster layer's file, then reloads the
+    layer so that it reads from them.
+
+    The overviews are built by a gdaladdo process, or in this task's thread if
+    gdaladdo is not on the PATH.
+    """
+
+    def __init__(self, layer_id, path, name):
+        super().__init__('Building overviews for {}'.format(name), QgsTask.CanCancel)
+        self.layer_id = layer_id
+        self.path = path
+        self.built = False
+
+    def run(self):
+        if self.isCanceled():
+            return False
+        try:
+            levels = get_overview_levels(self.path)
+            if not levels:
+                return True
+
+            gdaladdo = shutil.which('gdaladdo')
+            if gdaladdo:
+                cmd = [gdaladdo, '-ro', '-r', 'average',
+                       '--config', 'COMPRESS_OVERVIEW', 'DEFLATE',
+                       self.path] + [str(level) for level in levels]
+                check_output(cmd, stderr=STDOUT)
+            else:
+                from osgeo import gdal
+                # Opening read-only makes GDAL write an external .ovr file.
+                ds = gdal.Open(self.path)
+                ds.BuildOverviews('AVERAGE', levels)
+                ds = None
+            self.built = True
+            return True
+        except CalledProcessError as e:
+            Log.log_warning('Unable to build overviews for {}: {}'.format(
+                self.path, e.output))
+            return False
+        except Exception as e:
+            Log.log_warning('Unable to build overviews for {}: {}'.format(self.path, e))
+            return False
+
+    def finished(self, result):
+        if not self.built:
+            return
+        layer = QgsProject.instance().mapLayer(self.layer_id)
+        if layer:
+            layer.dataProvider().reloadData()
+            layer.triggerRepaint()
+
+
+class OverviewBuilder:
+    """Schedules overview builds for raster files the plugin put in the working directory.
+
+    Overviews are written next to the file, so they are reused on later loads
+    and evicted along with the file. VRTs with streamed sources are skipped.
+    Builds wait in a queue, and at most `processes` of them are handed to the
+    task manager at a time, so that they don't hold the threads QGIS also uses
+    for rendering and other tasks.
+    """
+    # (layer id, path, layer name) of the builds waiting to start.
+    pending = deque()
+    tasks = []
+    processes = 1
+
+    @staticmethod
+    def task_done(task):
+        if task in OverviewBuilder.tasks:
+            OverviewBuilder.tasks.remove(task)
+        OverviewBuilder.start_next()
+
+    @staticmethod
+    def start_next():
+        while OverviewBuilder.pending and \
+              len(OverviewBuilder.tasks) < OverviewBuilder.processes:
+            layer_id, path, name = OverviewBuilder.pending.popleft()
+            if not QgsProject.instance().mapLayer(layer_id):
+                # The layer was removed while waiting.
+                continue
+            task = OverviewTask(layer_id, path, name)
+            # Keep a reference to the task, otherwise it will be garbage collected.
+            OverviewBuilder.tasks.append(task)
+            task.taskCompleted.connect(lambda t=task: OverviewBuilder.task_done(t))
+            task.taskTerminated.connect(lambda t=task: OverviewBuilder.task_done(t))
+            QgsApplication.taskManager().addTask(task)
+
+    @staticmethod
+    def build(layers, working_dir, processes):
+        OverviewBuilder.processes = max(1, processes)
+        working_dir = os.path.join(os.path.abspath(working_dir), '')
+        queued = set(path for _, path, _ in OverviewBuilder.pending) | \
+            set(task.path for task in OverviewBuilder.tasks)
+        for layer in layers:
+            if not isinstance(layer, QgsRasterLayer) or layer.providerType() != 'gdal':
+                continue
+            path = layer.source()
+            if not os.path.abspath(path).startswith(working_dir) or path in queued or \
+               is_streamed(path):
+                continue
+            OverviewBuilder.pending.append((layer.id(), path, layer.name()))
+            queued.add(path)
+        OverviewBuilder.start_next()
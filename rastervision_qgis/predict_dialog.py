@@ -11,22 +11,27 @@
 """
 
 import os
-from tempfile import TemporaryDirectory
-# from subprocess import (Popen, PIPE, CalledProcessError)
-from subprocess import (check_output, CalledProcessError)
+import shutil
+from tempfile import mkdtemp
 
 from PyQt5 import uic
 from PyQt5 import QtWidgets
 
+from qgis.core import (Qgis, QgsProject, QgsRasterLayer)
+
 import rastervision as rv
-from rastervision.predictor import Predictor
-from rastervision.utils.files import (download_if_needed, load_json_config)
+from rastervision.utils.files import load_json_config
 from rastervision.protos.command_pb2 \
     import CommandConfig as CommandConfigMsg
 
 from .registry import RegistryInstance
-from .experiment_loader import  LoadContext
-from .raster_util import (get_raster_layers, export_raster_layer)
+from .cache_index import CacheIndexInstance
+from .experiment_loader import (ExperimentLoader, LoadContext)
+from .raster_util import (get_raster_layers, get_layer_window, get_tile_windows,
+                          get_input_version, parse_band_order)
+from .prediction_cache import PredictionCache
+from .predict_worker import (PredictItem, BatchPredictTask, PredictTaskQueue,
+                             PredictWorkerInstance)
 from .settings import Settings, StyleProfile
 from .log import Log
 
@@ -43,10 +48,48 @@ class PredictDialog(QtWidgets.QDialog, FORM_CLASS):
         self.setupUi(self)
 
 
+# Areas that can be predicted, as (setting value, label)
+PREDICT_AREAS = [('layer', 'Whole Layer'),
+                 ('canvas', 'Visible Extent'),
+                 ('selection', 'Selected Features')]
+
+# Batch modes other than layer tree groups, as (index in the batch combobox, label)
+BATCH_OFF = 0
+BATCH_SELECTED_LAYERS = 1
+
+def get_batch_label_uri(template, layer_name):
+    """Returns the label store URI for a layer of a batch. {layer} in the template is
+    replaced by the layer name; without it, the name is added before the extension."""
+    if '{layer}' in template:
+        return template.replace('{layer}', layer_name)
+    root, ext = os.path.splitext(template)
+    return '{}-{}{}'.format(root, layer_name, ext)
+
 class PredictDialogController(object):
     def __init__(self, iface):
         self.dlg = PredictDialog()
         self.iface = iface
+        self.tasks = []
+        # Prediction layer id -> (working directory, cache index keys of the label
+        # caches it reads), acquired until the layer is removed.
+        self.layer_cache_keys = {}
+        QgsProject.instance().layerWillBeRemoved.connect(self.layer_removed)
+
+    def stop(self):
+        """Cancels queued predictions and releases the label caches of loaded ones,
+        e.g. when the plugin unloads."""
+        PredictTaskQueue.clear()
+        try:
+            QgsProject.instance().layerWillBeRemoved.disconnect(self.layer_removed)
+        except TypeError:
+            pass
+        for layer_id in list(self.layer_cache_keys):
+            self.layer_removed(layer_id)
+
+    def layer_removed(self, layer_id):
+        if layer_id in self.layer_cache_keys:
+            working_dir, cache_keys = self.layer_cache_keys.pop(layer_id)
+            CacheIndexInstance.get(working_dir).release(cache_keys)
 
     def run(self):
         self.dlg.show()
@@ -73,6 +116,27 @@ class PredictDialogController(object):
         self.dlg.use_docker_checkbox.setChecked(settings.get_use_docker())
         self.dlg.docker_image_edit.setText(settings.get_docker_image())
 
+        self.dlg.docker_persistent_checkbox.setChecked(settings.get_docker_persistent())
+        self.dlg.worker_process_checkbox.setChecked(settings.get_use_worker_process())
+
+        self.dlg.predict_area_combobox.clear()
+        self.dlg.predict_area_combobox.addItems([label for _, label in PREDICT_AREAS])
+        area_values = [value for value, _ in PREDICT_AREAS]
+        settings_area = settings.get_predict_area()
+        if settings_area in area_values:
+            self.dlg.predict_area_combobox.setCurrentIndex(area_values.index(settings_area))
+
+        self.dlg.prediction_cache_checkbox.setChecked(settings.get_use_prediction_cache())
+        self.dlg.export_raw_checkbox.setChecked(settings.get_export_raw())
+        self.dlg.band_order_edit.setText(settings.get_band_order())
+        self.dlg.tile_size_spinbox.setValue(settings.get_predict_tile_size())
+        self.dlg.batch_concurrency_spinbox.setValue(settings.get_predict_concurrency())
+
+        self.dlg.batch_combobox.clear()
+        self.dlg.batch_combobox.addItems(['Off', 'Selected Layers'])
+        groups = QgsProject.instance().layerTreeRoot().findGroups()
+        self.dlg.batch_combobox.addItems(['Group: {}'.format(g.name()) for g in groups])
+
         # Load all raster layers
         self.dlg.input_layer_combobox.clear()
         raster_layers = get_raster_layers()
@@ -108,66 +172,185 @@ class PredictDialogController(object):
             settings.set_use_docker(use_docker)
             docker_image = self.dlg.docker_image_edit.text()
             settings.set_docker_image(docker_image)
-
-            prediction_layer_name = '{}-predictions'.format(layer_name)
-
-            with TemporaryDirectory(dir=settings.get_working_dir()) as tmp_dir:
-                path = os.path.join(tmp_dir, "{}.tif".format(layer_name))
-                export_raster_layer(layer, path)
-                if not os.path.exists(path):
-                    raise Exception("Writing raster to {} failed".format(path))
-                bundle_config_base = 'bundle_config.json'
-                bundle_config_path = os.path.join(tmp_dir, bundle_config_base)
-
-                # Grab the predict package locally
-                pp_local = download_if_needed(predict_package, tmp_dir)
-
-                if use_docker:
-                    pp_dir = os.path.dirname(pp_local)
-                    pp_base = os.path.basename(pp_local)
-                    gt_base = os.path.basename(path)
-                    lb_dir = os.path.dirname(label_store_uri)
-                    lb_base = os.path.basename(label_store_uri)
-
-                    cmd = ['docker', 'run', '--rm',
-                           '-v', '{}/.rastervision:/root/.rastervision'.format(os.environ['HOME']),
-                           '-v', '{}:{}'.format(tmp_dir, '/opt/source'),
-                           '-v', '{}:{}'.format(lb_dir, '/opt/output'),
-                           '-v', '{}:{}'.format(pp_dir, '/opt/predict_package'),
-                           docker_image, 'rastervision', 'predict',
-                           '/opt/predict_package/{}'.format(pp_base),
-                           '/opt/source/{}'.format(gt_base),
-                           '/opt/output/{}'.format(lb_base),
-                           '--export-config',
-                           '/opt/source/{}'.format(bundle_config_base)]
-
-                    if update_stats:
-                        cmd.append('--update-stats')
-
-                    Log.log_info('Running command: {}'.format(' '.join(cmd)))
-                    try:
-                        output = check_output(cmd)
-                        Log.log_info("[PREDICT OUTPUT]: {}".format(output))
-                    except CalledProcessError as e:
-                        Log.log_error("Error running {}: {}".format(
-                            ' '.join(cmd), e.output))
-                        raise e
+            settings.set_docker_persistent(self.dlg.docker_persistent_checkbox.isChecked())
+
+            use_worker_process = self.dlg.worker_process_checkbox.isChecked()
+            settings.set_use_worker_process(use_worker_process)
+
+            predict_area = area_values[self.dlg.predict_area_combobox.currentIndex()]
+            settings.set_predict_area(predict_area)
+
+            use_prediction_cache = self.dlg.prediction_cache_checkbox.isChecked()
+            settings.set_use_prediction_cache(use_prediction_cache)
+
+            raw = self.dlg.export_raw_checkbox.isChecked()
+            settings.set_export_raw(raw)
+            band_order = self.dlg.band_order_edit.text()
+            settings.set_band_order(band_order)
+            try:
+                bands = parse_band_order(band_order)
+            except ValueError:
+                self.push_warning("Invalid band order: {}".format(band_order))
+                return
+
+            tile_size = self.dlg.tile_size_spinbox.value()
+            settings.set_predict_tile_size(tile_size)
+            concurrency = self.dlg.batch_concurrency_spinbox.value()
+            settings.set_predict_concurrency(concurrency)
+
+            batch_index = self.dlg.batch_combobox.currentIndex()
+            if batch_index == BATCH_OFF:
+                layers = [(layer_name, layer)]
+            elif batch_index == BATCH_SELECTED_LAYERS:
+                layers = [(l.name(), l) for l in self.iface.layerTreeView().selectedLayers()
+                          if isinstance(l, QgsRasterLayer)]
+            else:
+                group = groups[batch_index - 2]
+                layers = [(node.layer().name(), node.layer()) for node in group.findLayers()
+                          if isinstance(node.layer(), QgsRasterLayer)]
+            if not layers:
+                self.push_warning("No raster layers to predict.")
+                return
+
+            windows = {}
+            for name, l in layers:
+                windows[name] = None
+                if predict_area != 'layer':
+                    windows[name] = self.get_predict_window(l, predict_area)
+                    if windows[name] is None:
+                        self.push_warning("Nothing to predict: the {} does not overlap {}.".format(
+                            'visible extent' if predict_area == 'canvas' else 'selection', name))
+            layers = [(name, l) for name, l in layers
+                      if predict_area == 'layer' or windows[name] is not None]
+            if not layers:
+                return
+
+            working_dir = settings.get_working_dir()
+            cache = PredictionCache(working_dir) if use_prediction_cache else None
+
+            tmp_dir = mkdtemp(dir=working_dir)
+            worker = PredictWorkerInstance.get(settings)
+
+            # The package is fetched, and the inputs exported, by the task.
+            self.run_batch(worker, layers, windows, predict_package, label_store_uri,
+                           update_stats, tmp_dir, style_profile, tile_size, concurrency,
+                           batch_index != BATCH_OFF, cache, raw, bands)
+
+    def run_batch(self, worker, layers, windows, package_uri, label_store_uri, update_stats,
+                  tmp_dir, style_profile, tile_size, concurrency, is_batch, cache=None,
+                  raw=False, bands=None):
+        """Predicts one or several layers, whole or tile by tile, in a BatchPredictTask,
+        loading each prediction as soon as it is written. The tiles of a layer are
+        added to a layer group named after its prediction."""
+        root = QgsProject.instance().layerTreeRoot()
+        items = []
+        item_groups = []
+        for name, layer in layers:
+            label_uri = get_batch_label_uri(label_store_uri, name) if is_batch \
+                        else label_store_uri
+            tiles = [windows[name]]
+            if tile_size:
+                tiles = get_tile_windows(layer, tile_size, windows[name])
+
+            group = None
+            if len(tiles) > 1:
+                group_name = '{}-predictions'.format(name)
+                group = root.findGroup(group_name)
+                if group is None:
+                    group = root.insertGroup(0, group_name)
                 else:
-                    predictor = Predictor(pp_local, tmp_dir, update_stats=update_stats)
-                    predictor.predict(path, label_store_uri, bundle_config_path)
-
-                msg = load_json_config(bundle_config_path, CommandConfigMsg())
-                bundle_config = msg.bundle_config
-                task_config = rv.TaskConfig.from_proto(bundle_config.task)
-
-                scene_config = rv.SceneConfig.from_proto(bundle_config.scene)
-                label_store_config = scene_config.label_store.for_prediction(label_store_uri)
-
-            # Load prediction
-            config = label_store_config
-            loader = RegistryInstance.get().get_label_store_loader(config.store_type)
-            ctx = LoadContext(task_config, self.iface, style_profile, None)
-            style_file = None
-            if ctx.style_profile:
-                style_file = ctx.style_profile.prediction_style_file
-            loader.load(config, prediction_layer_name, ctx, style_file)
+                    group.removeAllChildren()
+
+            input_version = get_input_version(layer, raw, bands) if cache is not None else None
+
+            for index, window in enumerate(tiles):
+                item_name = name
+                item_uri = label_uri
+                if len(tiles) > 1:
+                    item_name = '{}-tile-{}'.format(name, index)
+                    item_uri = PredictItem.get_tile_uri(label_uri, index)
+                item_dir = os.path.join(tmp_dir, str(len(items)))
+                items.append(PredictItem(item_name, layer, item_uri, item_dir, window,
+                                         input_version))
+                item_groups.append(group)
+
+        def on_item(index):
+            try:
+                self.load_prediction(task.jobs[index],
+                                     '{}-predictions'.format(items[index].name),
+                                     style_profile, item_groups[index])
+            except Exception as e:
+                Log.log_exception(e)
+
+        def on_finished(task, result):
+            self.tasks.remove(task)
+            if (not result and not task.isCanceled()) or \
+               (len(items) == 1 and task.failures):
+                self.push_failure(', '.join(name for name, _ in layers))
+            elif task.failures:
+                self.push_warning("{} of {} predictions failed: {}. Check Logs for details.".format(
+                    len(task.failures), len(items), ', '.join(n for n, _ in task.failures)))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if is_batch:
+            description = 'Raster Vision prediction of {} layers'.format(len(layers))
+        elif len(items) > 1:
+            description = 'Raster Vision tiled prediction of {}'.format(layers[0][0])
+        else:
+            description = 'Raster Vision prediction of {}'.format(layers[0][0])
+        task = BatchPredictTask(description, worker, items, package_uri, update_stats,
+                                Settings().get_working_dir(), on_finished, concurrency,
+                                cache, raw, bands)
+        task.itemFinished.connect(on_item)
+        self.tasks.append(task)
+        PredictTaskQueue.add(task)
+
+    def push_warning(self, msg):
+        widget = self.iface.messageBar().createMessage("Raster Vision", msg)
+        self.iface.messageBar().pushWidget(widget, Qgis.Warning)
+
+    def push_failure(self, layer_name):
+        self.push_warning("Prediction of {} failed. Check Logs for details.".format(layer_name))
+
+    def get_predict_window(self, layer, predict_area):
+        """Returns the window of the layer to predict for 'canvas' (the visible map
+        extent) or 'selection' (the bounding box of the features selected in the
+        active layer), or None if it doesn't overlap the layer."""
+        if predict_area == 'canvas':
+            canvas = self.iface.mapCanvas()
+            return get_layer_window(layer, canvas.extent(),
+                                    canvas.mapSettings().destinationCrs())
+
+        selection_layer = self.iface.activeLayer()
+        if selection_layer is None or \
+           not hasattr(selection_layer, 'selectedFeatureCount') or \
+           selection_layer.selectedFeatureCount() == 0:
+            return None
+        return get_layer_window(layer, selection_layer.boundingBoxOfSelected(),
+                                selection_layer.crs())
+
+    def load_prediction(self, job, prediction_layer_name, style_profile, group=None):
+        msg = load_json_config(job.bundle_config_path, CommandConfigMsg())
+        bundle_config = msg.bundle_config
+        task_config = rv.TaskConfig.from_proto(bundle_config.task)
+
+        scene_config = rv.SceneConfig.from_proto(bundle_config.scene)
+        label_store_config = scene_config.label_store.for_prediction(job.label_store_uri)
+
+        # Load prediction
+        settings = Settings()
+        config = label_store_config
+        loader = RegistryInstance.get().get_label_store_loader(config.store_type)
+        ctx = LoadContext(task_config, self.iface, style_profile, settings.get_working_dir(),
+                          vector_cache_format=settings.get_vector_cache_format())
+        style_file = None
+        if ctx.style_profile:
+            style_file = ctx.style_profile.prediction_style_file
+        loader.load(config, prediction_layer_name, ctx, style_file)
+        layers = ctx.take_layers()
+        # Keep the label caches of the prediction layers from being evicted.
+        index = CacheIndexInstance.get(ctx.working_dir)
+        for layer in layers:
+            index.acquire(ctx.cache_keys)
+            self.layer_cache_keys[layer.id()] = (ctx.working_dir, ctx.cache_keys)
+        ExperimentLoader.add_layers(layers, group)
@@ -0,0 +1,100 @@
+import os
+import shutil
+import hashlib
+import threading
+import zipfile
+
+from .cache_index import CacheIndexInstance
+from .predict_server import UNPACKED_PACKAGE
+from .utils import (get_local_path, get_source_version)
+from .log import Log
+
+PREDICT_PACKAGE_DIR = 'predict-packages'
+
+class CachedPredictPackage:
+    """A predict package kept in the working directory.
+
+    package_path is the local copy of the package zip, and package_dir the bundle
+    unpacked from it. cache_dir is the directory holding the bundle, which also
+    serves as the predictor's temporary directory. unpacked_path is the empty
+    archive given to the predictor in place of the package once it is unpacked
+    (see predict_server.create_predictor). index_key is the package's key in the
+    cache index.
+    """
+    def __init__(self, uri, key, cache_dir, package_path):
+        self.uri = uri
+        self.key = key
+        self.cache_dir = cache_dir
+        self.package_path = package_path
+        self.package_dir = os.path.join(cache_dir, 'package')
+        self.unpacked_path = os.path.join(cache_dir, UNPACKED_PACKAGE)
+        self.index_key = '{}://{}'.format(PREDICT_PACKAGE_DIR, key)
+
+
+class PredictPackageCache:
+    """Caches predict packages, unpacked, under the working directory.
+
+    Packages are keyed by their URI and version (the ETag or last modified time of
+    the remote package, or the modification time of a local one), so a package that
+    is overwritten in place is fetched again. Each package directory is tracked in
+    the cache index, so that it counts towards the cache budget and is evicted
+    like any download.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.root_dir = os.path.join(working_dir, PREDICT_PACKAGE_DIR)
+        self.index = CacheIndexInstance.get(working_dir)
+
+    @staticmethod
+    def get_size(path):
+        size = 0
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                size += os.path.getsize(os.path.join(dir_path, file_name))
+        return size
+
+    def get(self, uri):
+        """Returns the CachedPredictPackage for the URI, fetching and unpacking it if needed."""
+        local_path = get_local_path(uri, self.working_dir)
+        version = get_source_version(uri, local_path, self.working_dir)
+        key = hashlib.sha1('{}|{}'.format(uri, version).encode()).hexdigest()
+        package = CachedPredictPackage(uri, key, os.path.join(self.root_dir, key), local_path)
+
+        with PredictPackageCache.lock:
+            if not os.path.isfile(package.unpacked_path):
+                Log.log_info('Unpacking predict package {}'.format(uri))
+                os.makedirs(package.cache_dir, exist_ok=True)
+                tmp_dir = '{}.part'.format(package.package_dir)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                with zipfile.ZipFile(package.package_path, 'r') as package_zip:
+                    package_zip.extractall(path=tmp_dir)
+                shutil.rmtree(package.package_dir, ignore_errors=True)
+                os.replace(tmp_dir, package.package_dir)
+                # Written last, as the mark that the bundle is complete.
+                zipfile.ZipFile(package.unpacked_path, 'w').close()
+
+            if self.index.get(package.index_key) is None:
+                self.index.put(package.index_key, package.cache_dir, key,
+                               PredictPackageCache.get_size(package.cache_dir))
+                self.index.save()
+            else:
+                self.index.touch(package.index_key)
+        return package
+
+    def list(self):
+        """Returns (key, size in bytes) for every cached package."""
+        if not os.path.exists(self.root_dir):
+            return []
+        return [(key, PredictPackageCache.get_size(os.path.join(self.root_dir, key)))
+                for key in sorted(os.listdir(self.root_dir))]
+
+    def clear(self):
+        prefix = '{}://'.format(PREDICT_PACKAGE_DIR)
+        with PredictPackageCache.lock:
+            for uri, _ in self.index.items():
+                if uri.startswith(prefix):
+                    self.index.remove(uri)
+            self.index.save()
+            shutil.rmtree(self.root_dir, ignore_errors=True)
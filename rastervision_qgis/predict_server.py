@@ -0,0 +1,99 @@
+"""
+Prediction server, run in its own process by SubprocessPredictWorker.
+
+It reads one JSON job per line from stdin, and writes one JSON message per line
+to stdout for each job: optional "progress" messages followed by "done" or
+"error". Predictors are kept loaded between jobs, so a model is only loaded once
+per package for the life of the process.
+
+This script does not depend on QGIS or on the plugin package, so that it can run
+under any Python interpreter that has rastervision installed, including inside
+a Docker container.
+"""
+
+import os
+import sys
+import json
+import argparse
+import traceback
+from collections import OrderedDict
+
+# Empty archive that PredictPackageCache leaves next to an unpacked bundle.
+UNPACKED_PACKAGE = 'unpacked.zip'
+
+
+def create_predictor(package_path, cache_dir, update_stats):
+    """Returns a Predictor for a predict package, using cache_dir as its temporary
+    directory. Predictor extracts the package into cache_dir/package whenever it is
+    created. If PredictPackageCache has already unpacked the bundle there, Predictor
+    is given the empty archive left next to it instead, so that it reads the bundle
+    as it is rather than extracting the whole package again."""
+    from rastervision.predictor import Predictor
+
+    unpacked_path = os.path.join(cache_dir, UNPACKED_PACKAGE)
+    if os.path.isfile(unpacked_path):
+        package_path = unpacked_path
+    return Predictor(package_path, cache_dir, update_stats=update_stats)
+
+
+class PredictServer:
+    def __init__(self, out, max_predictors=2):
+        self.out = out
+        self.max_predictors = max_predictors
+        self.predictors = OrderedDict()
+
+    def send(self, msg):
+        self.out.write(json.dumps(msg) + '\n')
+        self.out.flush()
+
+    def get_predictor(self, job):
+        key = (job['package_key'], bool(job['update_stats']))
+        if key in self.predictors:
+            self.predictors.move_to_end(key)
+            return self.predictors[key]
+
+        self.send({'id': job['id'], 'status': 'progress', 'message': 'Loading model'})
+        predictor = create_predictor(job['package_path'], job['package_cache_dir'],
+                                     job['update_stats'])
+        self.predictors[key] = predictor
+        while len(self.predictors) > self.max_predictors:
+            self.predictors.popitem(last=False)
+        return predictor
+
+    def handle(self, job):
+        if job.get('command') == 'ping':
+            self.send({'id': job['id'], 'status': 'done'})
+            return
+        try:
+            predictor = self.get_predictor(job)
+            self.send({'id': job['id'], 'status': 'progress', 'message': 'Predicting'})
+            predictor.predict(job['image_path'], job['label_uri'], job['config_uri'])
+            self.send({'id': job['id'], 'status': 'done'})
+        except Exception:
+            self.send({'id': job['id'], 'status': 'error', 'error': traceback.format_exc()})
+
+    def serve(self, lines):
+        for line in lines:
+            line = line.strip()
+            if line:
+                self.handle(json.loads(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Raster Vision QGIS prediction server')
+    parser.add_argument('--max-predictors', type=int, default=2)
+    args = parser.parse_args()
+
+    # Keep stdout for the protocol, on a duplicate of its descriptor. Anything else
+    # written to stdout while predicting, by Python or by native libraries writing
+    # to the descriptor directly, goes to stderr.
+    sys.stdout.flush()
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    PredictServer(out, args.max_predictors).serve(sys.stdin)
+
+
+if __name__ == '__main__':
+    main()
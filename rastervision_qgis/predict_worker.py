@@ -0,0 +1,556 @@
+import os
+import json
+import queue
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import (Popen, PIPE, STDOUT, check_output, CalledProcessError)
+
+from PyQt5.QtCore import pyqtSignal
+from qgis.core import (QgsApplication, QgsTask)
+
+from .predictor_pool import PredictorPoolInstance
+from .predict_package_cache import PredictPackageCache
+from .prediction_cache import PredictionCache
+from .cache_index import CacheIndexInstance
+from .raster_util import (get_exported_raster_path, get_source_paths)
+from .log import Log
+
+class PredictError(Exception):
+    pass
+
+
+class PredictJob:
+    """A prediction of one raster with a cached predict package.
+
+    The predictor writes the labels to label_store_uri and the bundle config
+    of the prediction to bundle_config_path, in the job's temporary directory.
+    """
+    def __init__(self, package, image_path, label_store_uri, update_stats, tmp_dir):
+        self.package = package
+        self.image_path = image_path
+        self.label_store_uri = label_store_uri
+        self.update_stats = update_stats
+        self.tmp_dir = tmp_dir
+        self.bundle_config_path = os.path.join(tmp_dir, 'bundle_config.json')
+
+    def to_json(self):
+        return {'command': 'predict',
+                'package_key': self.package.key,
+                'package_path': self.package.package_path,
+                'package_cache_dir': self.package.cache_dir,
+                'image_path': self.image_path,
+                'label_uri': self.label_store_uri,
+                'config_uri': self.bundle_config_path,
+                'update_stats': bool(self.update_stats)}
+
+
+class InProcessPredictWorker:
+    """Runs predictions in the QGIS process, with predictors from the PredictorPool."""
+    lock = threading.Lock()
+
+    def run(self, job, task):
+        with InProcessPredictWorker.lock:
+            predictor = PredictorPoolInstance.get().get(job.package, job.update_stats)
+            predictor.predict(job.image_path, job.label_store_uri, job.bundle_config_path)
+
+    def stop(self):
+        pass
+
+
+class DockerPredictWorker:
+    """Runs each prediction with `rastervision predict` in a new Docker container."""
+    def __init__(self, docker_image, docker='docker'):
+        self.docker_image = docker_image
+        self.docker = docker
+
+    def run(self, job, task):
+        pp_dir = os.path.dirname(job.package.package_path)
+        pp_base = os.path.basename(job.package.package_path)
+        input_dir = os.path.dirname(os.path.abspath(job.image_path))
+        input_base = os.path.basename(job.image_path)
+        lb_dir = os.path.dirname(job.label_store_uri)
+        lb_base = os.path.basename(job.label_store_uri)
+        bundle_config_base = os.path.basename(job.bundle_config_path)
+
+        cmd = [self.docker, 'run', '--rm',
+               '-v', '{}/.rastervision:/root/.rastervision'.format(os.environ['HOME']),
+               '-v', '{}:{}'.format(job.tmp_dir, '/opt/source'),
+               '-v', '{}:{}'.format(input_dir, '/opt/input'),
+               '-v', '{}:{}'.format(lb_dir, '/opt/output'),
+               '-v', '{}:{}'.format(pp_dir, '/opt/predict_package')]
+        # A VRT input reads its sources at their host paths, so mount them there.
+        source_dirs = set(os.path.dirname(p) for p in get_source_paths(job.image_path)[1:])
+        for source_dir in sorted(source_dirs):
+            cmd.extend(['-v', '{0}:{0}:ro'.format(source_dir)])
+        cmd += [self.docker_image, 'rastervision', 'predict',
+                '/opt/predict_package/{}'.format(pp_base),
+                '/opt/input/{}'.format(input_base),
+                '/opt/output/{}'.format(lb_base),
+                '--export-config',
+                '/opt/source/{}'.format(bundle_config_base)]
+
+        if job.update_stats:
+            cmd.append('--update-stats')
+
+        Log.log_info('Running command: {}'.format(' '.join(cmd)))
+        try:
+            output = check_output(cmd)
+            Log.log_info("[PREDICT OUTPUT]: {}".format(output))
+        except CalledProcessError as e:
+            Log.log_error("Error running {}: {}".format(
+                ' '.join(cmd), e.output))
+            raise e
+
+    def stop(self):
+        pass
+
+
+class SubprocessPredictWorker:
+    """Runs predictions in a persistent predict_server process, started on first use.
+
+    Jobs are sent to the server as JSON lines over its stdin, and it answers with
+    progress and completion messages on its stdout. Jobs are run one at a time, by
+    one task at a time (see PredictTaskQueue). If the server dies, it is started
+    again for the next job.
+    """
+    SERVER_SCRIPT = os.path.join(os.path.dirname(__file__), 'predict_server.py')
+
+    def __init__(self, command, max_predictors=2):
+        self.command = command
+        self.max_predictors = max_predictors
+        self.process = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    @staticmethod
+    def python_command(python):
+        return [python, SubprocessPredictWorker.SERVER_SCRIPT]
+
+    def _log_stderr(self, stream):
+        for line in stream:
+            Log.log_info('[PREDICT WORKER]: {}'.format(line.rstrip()))
+
+    def _start(self):
+        cmd = self.command + ['--max-predictors', str(self.max_predictors)]
+        Log.log_info('Starting prediction worker: {}'.format(' '.join(cmd)))
+        self.process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                             universal_newlines=True, bufsize=1)
+        threading.Thread(target=self._log_stderr, args=(self.process.stderr,),
+                         daemon=True).start()
+
+    def run(self, job, task):
+        with self.lock:
+            msg = self.prepare(job)
+            msg['id'] = next(self.ids)
+
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+
+            try:
+                self.process.stdin.write(json.dumps(msg) + '\n')
+                self.process.stdin.flush()
+            except OSError as e:
+                self.process = None
+                raise PredictError('Prediction worker is not running: {}'.format(e))
+
+            for line in self.process.stdout:
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    # Output of the model that didn't go through the server.
+                    Log.log_info('[PREDICT WORKER]: {}'.format(line.rstrip()))
+                    continue
+                if not isinstance(response, dict) or response.get('id') != msg['id']:
+                    continue
+                status = response['status']
+                if status == 'progress':
+                    Log.log_info('[PREDICT WORKER]: {}'.format(response['message']))
+                elif status == 'done':
+                    return
+                else:
+                    raise PredictError(response.get('error'))
+
+            self.process = None
+            raise PredictError('Prediction worker exited while predicting.')
+
+    def prepare(self, job):
+        """Returns the message sent to the server for the job. Called before the
+        server is started, if it is not running."""
+        return job.to_json()
+
+    def _stop_process(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+        self.process = None
+
+    def stop(self):
+        with self.lock:
+            self._stop_process()
+
+
+class DockerContainerPredictWorker(SubprocessPredictWorker):
+    """Runs predictions in a predict_server inside one long-running Docker container.
+
+    The container is started on first use and kept running, and the server is
+    run in it with `docker exec`, so container start up, importing rastervision
+    and loading the model are paid once per session instead of once per prediction.
+
+    Host directories are mounted at the same path in the container, so job paths
+    don't need translating. If a job needs a directory that is not mounted yet,
+    the container is restarted with the additional mount.
+    """
+    CONTAINER_PLUGIN_DIR = '/opt/rastervision_qgis'
+
+    def __init__(self, docker_image, working_dir, docker='docker', max_predictors=2):
+        self.docker = docker
+        self.docker_image = docker_image
+        self.container = 'rastervision-qgis-{}'.format(os.getpid())
+        self.mounts = set([os.path.abspath(working_dir)])
+        self.container_running = False
+        server_script = '{}/{}'.format(DockerContainerPredictWorker.CONTAINER_PLUGIN_DIR,
+                                       os.path.basename(SubprocessPredictWorker.SERVER_SCRIPT))
+        super().__init__([docker, 'exec', '-i', self.container, 'python', server_script],
+                         max_predictors)
+
+    def is_mounted(self, path):
+        return any(path == m or path.startswith(os.path.join(m, '')) for m in self.mounts)
+
+    def _remove_container(self):
+        try:
+            check_output([self.docker, 'rm', '-f', self.container], stderr=STDOUT)
+        except CalledProcessError:
+            # The container is not running.
+            pass
+        self.container_running = False
+
+    def _container_is_running(self):
+        try:
+            output = check_output([self.docker, 'inspect', '-f', '{{.State.Running}}',
+                                   self.container], stderr=STDOUT, universal_newlines=True)
+            return output.strip() == 'true'
+        except CalledProcessError:
+            return False
+
+    def _start_container(self):
+        self._remove_container()
+        cmd = [self.docker, 'run', '-d', '--rm', '--name', self.container,
+               '-v', '{}/.rastervision:/root/.rastervision'.format(os.environ['HOME']),
+               '-v', '{}:{}:ro'.format(os.path.dirname(SubprocessPredictWorker.SERVER_SCRIPT),
+                                       DockerContainerPredictWorker.CONTAINER_PLUGIN_DIR)]
+        for mount in sorted(self.mounts):
+            cmd.extend(['-v', '{}:{}'.format(mount, mount)])
+        cmd.extend([self.docker_image, 'sleep', 'infinity'])
+
+        Log.log_info('Starting prediction container: {}'.format(' '.join(cmd)))
+        try:
+            check_output(cmd, stderr=STDOUT)
+        except CalledProcessError as e:
+            raise PredictError('Unable to start prediction container: {}'.format(e.output))
+        self.container_running = True
+
+    def prepare(self, job):
+        dirs = [job.tmp_dir,
+                job.package.cache_dir,
+                os.path.dirname(os.path.abspath(job.package.package_path)),
+                os.path.dirname(os.path.abspath(job.image_path))]
+        # A VRT input reads its sources at their host paths.
+        dirs += [os.path.dirname(p) for p in get_source_paths(job.image_path)[1:]]
+        if '://' not in job.label_store_uri:
+            label_dir = os.path.dirname(os.path.abspath(job.label_store_uri))
+            os.makedirs(label_dir, exist_ok=True)
+            dirs.append(label_dir)
+
+        missing = [d for d in dirs if not self.is_mounted(d)]
+        if self.container_running and (self.process is None or self.process.poll() is not None):
+            # The server is not running; check the container is still there to run it in.
+            self.container_running = self._container_is_running()
+        if missing or not self.container_running:
+            # Restarting the container also ends the server running in it.
+            self._stop_process()
+            self.mounts.update(missing)
+            self._start_container()
+        return job.to_json()
+
+    def stop(self):
+        super().stop()
+        if self.container_running:
+            self._remove_container()
+
+
+class PredictWorkerInstance:
+    """Holds the prediction worker selected by the settings, reusing it while
+    the selection doesn't change."""
+    worker = None
+    worker_key = None
+
+    @staticmethod
+    def get(settings):
+        if settings.get_use_docker() and settings.get_docker_persistent():
+            key = ('docker-container', settings.get_docker_image(), settings.get_working_dir(),
+                   settings.get_docker_executable(), settings.get_predictor_pool_size())
+        elif settings.get_use_docker():
+            key = ('docker', settings.get_docker_image(), settings.get_docker_executable())
+        elif settings.get_use_worker_process():
+            key = ('process', settings.get_worker_python(), settings.get_predictor_pool_size())
+        else:
+            key = ('in-process',)
+
+        if PredictWorkerInstance.worker_key != key:
+            PredictWorkerInstance.stop()
+            if key[0] == 'docker-container':
+                worker = DockerContainerPredictWorker(key[1], key[2], key[3], key[4])
+            elif key[0] == 'docker':
+                worker = DockerPredictWorker(key[1], key[2])
+            elif key[0] == 'process':
+                worker = SubprocessPredictWorker(SubprocessPredictWorker.python_command(key[1]),
+                                                 key[2])
+            else:
+                worker = InProcessPredictWorker()
+            PredictWorkerInstance.worker = worker
+            PredictWorkerInstance.worker_key = key
+        return PredictWorkerInstance.worker
+
+    @staticmethod
+    def stop():
+        if PredictWorkerInstance.worker is not None:
+            PredictWorkerInstance.worker.stop()
+        PredictWorkerInstance.worker = None
+        PredictWorkerInstance.worker_key = None
+
+
+class PredictItem:
+    """One raster, or window of a raster, to predict in a BatchPredictTask.
+
+    layer is the layer to predict, which the task reads through LayerClones.
+    input_version is the version of the input (see get_input_version), if its
+    prediction should be cached.
+    """
+    def __init__(self, name, layer, label_store_uri, tmp_dir, window=None,
+                 input_version=None):
+        self.name = name
+        self.layer = layer
+        self.label_store_uri = label_store_uri
+        self.tmp_dir = tmp_dir
+        self.window = window
+        self.input_version = input_version
+
+    @staticmethod
+    def get_tile_uri(uri, index):
+        root, ext = os.path.splitext(uri)
+        return '{}-tile-{}{}'.format(root, index, ext)
+
+
+class LayerClones:
+    """Copies of a layer for the threads of a BatchPredictTask, as a layer's provider
+    must not be read from several threads at once. Each export takes a clone and
+    gives it back when it is done. The clones are made on the main thread.
+    """
+    def __init__(self, layer, count):
+        self.clones = queue.Queue()
+        for _ in range(count):
+            self.clones.put(layer.clone())
+
+    @contextmanager
+    def get(self):
+        clone = self.clones.get()
+        try:
+            yield clone
+        finally:
+            self.clones.put(clone)
+
+
+class BatchPredictTask(QgsTask):
+    """Predicts a list of PredictItems, such as a layer, the tiles of a large layer
+    or the layers of a batch, with one predict package on one worker, then calls
+    on_finished(task, result) on the main thread.
+
+    The predict package is fetched from the PredictPackageCache at the start of
+    the task, so that downloading and unpacking it doesn't block the interface,
+    and is held in the cache index until the task ends.
+
+    Inputs are exported (or windowed through a VRT for file-backed layers) on up to
+    `concurrency` threads, each with its own clone of the layer (see LayerClones),
+    a few items ahead of the prediction, while predictions run one at a time on
+    the worker so that they share one loaded model. Memory and temporary disk use
+    are bounded by the item size and the concurrency.
+
+    itemFinished(index) is emitted as each item's prediction is written, with its
+    PredictJob in self.jobs[index], so that results can be loaded while the rest
+    is still being predicted. Items that fail are logged and recorded in
+    self.failures, and the batch carries on. Cancelling stops after the item
+    being predicted.
+
+    Items with a prediction in the PredictionCache are restored from it instead of
+    being exported and predicted. raw and bands are passed on to
+    get_exported_raster_path.
+    """
+    itemFinished = pyqtSignal(int)
+
+    def __init__(self, description, worker, items, package_uri, update_stats,
+                 working_dir, on_finished, concurrency=1, cache=None, raw=False, bands=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.worker = worker
+        self.items = items
+        self.package_uri = package_uri
+        self.package = None
+        self.update_stats = update_stats
+        self.working_dir = working_dir
+        self.on_finished = on_finished
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.raw = raw
+        self.bands = bands
+        self.jobs = {}
+        self.failures = []
+        self.exception = None
+
+        # Made here, on the main thread: at most one clone per export thread.
+        counts = {}
+        for item in items:
+            counts[item.layer.id()] = counts.get(item.layer.id(), 0) + 1
+        clones = {}
+        for item in items:
+            if item.layer.id() not in clones:
+                clones[item.layer.id()] = LayerClones(
+                    item.layer, min(self.concurrency, counts[item.layer.id()]))
+        self.item_clones = [clones[item.layer.id()] for item in items]
+
+    def get_cache_key(self, item):
+        if self.cache is None or item.input_version is None:
+            return None
+        return PredictionCache.get_key(self.package, item.input_version, item.window,
+                                       self.update_stats)
+
+    def run(self):
+        cache_index = CacheIndexInstance.get(self.working_dir)
+        try:
+            self.package = PredictPackageCache(self.working_dir).get(self.package_uri)
+        except Exception as e:
+            self.exception = e
+            return False
+        # Keep the package from being evicted while it is used.
+        package_keys = [self.package.uri, self.package.index_key]
+        cache_index.acquire(package_keys)
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        exports = {}
+        cache_keys = [self.get_cache_key(item) for item in self.items]
+
+        def export_item(index):
+            item = self.items[index]
+            # Hold the export in the cache index until it has been predicted.
+            keys = set()
+            with self.item_clones[index].get() as layer:
+                path = get_exported_raster_path(layer, self.working_dir, item.window,
+                                                self.raw, self.bands, keys)
+            cache_index.acquire(keys)
+            return path, keys
+
+        def is_cached(index):
+            return cache_keys[index] is not None and \
+                self.cache.contains(cache_keys[index], self.items[index].label_store_uri)
+
+        def export(index, force=False):
+            if index < len(self.items) and index not in exports and \
+               (force or not is_cached(index)):
+                exports[index] = executor.submit(export_item, index)
+
+        try:
+            for index, item in enumerate(self.items):
+                # Keep the next items exporting while this one is predicted.
+                for ahead in range(index, index + self.concurrency + 1):
+                    export(ahead)
+                if self.isCanceled():
+                    return False
+                try:
+                    os.makedirs(item.tmp_dir, exist_ok=True)
+                    job = PredictJob(self.package, None, item.label_store_uri,
+                                     self.update_stats, item.tmp_dir)
+                    restored = index not in exports and is_cached(index) and \
+                        self.cache.restore(cache_keys[index], job)
+                    if not restored:
+                        export(index, force=True)
+                        job.image_path, export_keys = exports.pop(index).result()
+                        try:
+                            self.worker.run(job, self)
+                        finally:
+                            cache_index.release(export_keys)
+                        if cache_keys[index] is not None:
+                            self.cache.put(cache_keys[index], job)
+                    self.jobs[index] = job
+                    self.itemFinished.emit(index)
+                except Exception as e:
+                    Log.log_warning('Prediction of {} failed: {}'.format(item.name, e))
+                    self.failures.append((item.name, str(e)))
+                self.setProgress(100.0 * (index + 1) / len(self.items))
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            for future in exports.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            for future in exports.values():
+                if not future.cancelled() and future.exception() is None:
+                    cache_index.release(future.result()[1])
+            cache_index.release(package_keys)
+
+    def finished(self, result):
+        self.item_clones = []
+        if self.exception:
+            Log.log_exception(self.exception)
+        self.on_finished(self, result)
+
+
+class PredictTaskQueue:
+    """Schedules BatchPredictTasks so that at most one task per worker is in the task
+    manager at a time.
+
+    A worker predicts one job at a time, so a second task handed to the task manager
+    would only wait on the worker while holding one of the threads QGIS also uses
+    for rendering and other tasks. Tasks wait in this queue instead, and the next
+    task for a worker is started when the current one completes or is terminated.
+    """
+    pending = deque()
+    tasks = []
+
+    @staticmethod
+    def add(task):
+        PredictTaskQueue.pending.append(task)
+        PredictTaskQueue.start_next()
+
+    @staticmethod
+    def task_done(task):
+        if task in PredictTaskQueue.tasks:
+            PredictTaskQueue.tasks.remove(task)
+        PredictTaskQueue.start_next()
+
+    @staticmethod
+    def start_next():
+        busy = [task.worker for task in PredictTaskQueue.tasks]
+        for task in list(PredictTaskQueue.pending):
+            if any(task.worker is worker for worker in busy):
+                continue
+            PredictTaskQueue.pending.remove(task)
+            # Keep a reference to the task, otherwise it will be garbage collected.
+            PredictTaskQueue.tasks.append(task)
+            busy.append(task.worker)
+            task.taskCompleted.connect(lambda t=task: PredictTaskQueue.task_done(t))
+            task.taskTerminated.connect(lambda t=task: PredictTaskQueue.task_done(t))
+            QgsApplication.taskManager().addTask(task)
+
+    @staticmethod
+    def clear():
+        """Cancels the tasks that haven't started, e.g. when the plugin unloads."""
+        while PredictTaskQueue.pending:
+            task = PredictTaskQueue.pending.popleft()
+            task.cancel()
+            task.finished(False)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import hashlib
+
+from .cache_index import CacheIndexInstance
+from .log import Log
+
+PREDICTION_CACHE_DIR = 'prediction-cache'
+
+class PredictionCache:
+    """Keeps the outputs of predictions in the working directory, so that predicting
+    the same input again with the same predict package loads the earlier result
+    instead of running inference.
+
+    Predictions are keyed by the predict package (its URI and version), the version
+    of the input raster (see get_input_version), the window predicted and whether
+    stats were updated. The label store file is kept with the prediction's bundle
+    config as a sidecar, and both are tracked in the cache index so that they are
+    evicted along with downloads. Only predictions written to a local file are cached.
+    """
+
+    def __init__(self, working_dir):
+        self.index = CacheIndexInstance.get(working_dir)
+        self.cache_dir = os.path.join(working_dir, PREDICTION_CACHE_DIR)
+
+    @staticmethod
+    def get_key(package, input_version, window, update_stats):
+        parts = [package.key,
+                 input_version,
+                 window.toString(16) if window is not None else '',
+                 str(bool(update_stats))]
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    @staticmethod
+    def is_cacheable(label_store_uri):
+        return '://' not in label_store_uri
+
+    def _get_paths(self, key, label_store_uri):
+        ext = os.path.splitext(label_store_uri)[1]
+        labels_path = os.path.join(self.cache_dir, key + ext)
+        return labels_path, labels_path + '.bundle_config.json'
+
+    def contains(self, key, label_store_uri):
+        if not PredictionCache.is_cacheable(label_store_uri):
+            return False
+        labels_path, config_path = self._get_paths(key, label_store_uri)
+        return self.index.is_cached('{}://{}'.format(PREDICTION_CACHE_DIR, key), labels_path) \
+            and os.path.exists(config_path)
+
+    def restore(self, key, job):
+        """Copies the cached prediction for key to the job's label store and bundle
+        config paths. Returns False if there is no cached prediction."""
+        if not self.contains(key, job.label_store_uri):
+            return False
+        cache_key = '{}://{}'.format(PREDICTION_CACHE_DIR, key)
+        labels_path, config_path = self._get_paths(key, job.label_store_uri)
+
+        label_dir = os.path.dirname(os.path.abspath(job.label_store_uri))
+        os.makedirs(label_dir, exist_ok=True)
+        shutil.copyfile(labels_path, job.label_store_uri)
+        shutil.copyfile(config_path, job.bundle_config_path)
+        self.index.touch(cache_key)
+        Log.log_info('Using cached prediction for {}'.format(job.label_store_uri))
+        return True
+
+    def put(self, key, job):
+        """Stores the output of a finished job under key."""
+        if not PredictionCache.is_cacheable(job.label_store_uri) or \
+           not os.path.isfile(job.label_store_uri):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        labels_path, config_path = self._get_paths(key, job.label_store_uri)
+        shutil.copyfile(job.bundle_config_path, config_path)
+        tmp_path = '{}.part'.format(labels_path)
+        shutil.copyfile(job.label_store_uri, tmp_path)
+        os.replace(tmp_path, labels_path)
+        self.index.put('{}://{}'.format(PREDICTION_CACHE_DIR, key), labels_path,
+                       key, os.path.getsize(labels_path))
+        self.index.save()
+
+    def count(self):
+        prefix = '{}://'.format(PREDICTION_CACHE_DIR)
+        return len([uri for uri, _ in self.index.items() if uri.startswith(prefix)])
+
+    def clear(self):
+        """Removes every cached prediction."""
+        prefix = '{}://'.format(PREDICTION_CACHE_DIR)
+        for uri, _ in self.index.items():
+            if uri.startswith(prefix):
+                self.index.remove(uri)
+        self.index.save()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
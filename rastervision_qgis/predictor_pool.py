@@ -0,0 +1,74 @@
+import threading
+import zipfile
+from collections import OrderedDict
+
+from .predict_server import create_predictor
+from .settings import Settings
+from .log import Log
+
+MB = 1024 * 1024
+
+def get_package_size(package):
+    """Returns the uncompressed size of a predict package, read from its zip
+    directory, used as an estimate of the memory its loaded model takes."""
+    with zipfile.ZipFile(package.package_path, 'r') as package_zip:
+        return sum(info.file_size for info in package_zip.infolist())
+
+
+class PredictorPool:
+    """Keeps the Predictors of recently used predict packages loaded, so that
+    predicting again with the same package skips unpacking and loading the model.
+
+    Holds at most max_predictors, and evicts the least recently used ones while
+    the estimated memory of the loaded models is over max_memory_mb. The most
+    recently used predictor is always kept.
+    """
+
+    def __init__(self, max_predictors=2, max_memory_mb=4096):
+        self.max_predictors = max_predictors
+        self.max_memory = max_memory_mb * MB
+        self.predictors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, package, update_stats=False):
+        """Returns a Predictor for a CachedPredictPackage, creating it if needed."""
+        key = (package.key, bool(update_stats))
+        with self.lock:
+            if key in self.predictors:
+                self.predictors.move_to_end(key)
+                return self.predictors[key][0]
+
+        Log.log_info('Loading predictor for {}'.format(package.uri))
+        predictor = create_predictor(package.package_path, package.cache_dir, update_stats)
+        with self.lock:
+            self.predictors[key] = (predictor, get_package_size(package))
+            self.predictors.move_to_end(key)
+            self._evict()
+        return predictor
+
+    def _evict(self):
+        def memory():
+            return sum(size for _, size in self.predictors.values())
+
+        while len(self.predictors) > 1 and \
+              (len(self.predictors) > self.max_predictors or memory() > self.max_memory):
+            key, _ = self.predictors.popitem(last=False)
+            Log.log_info('Unloading predictor for package {}'.format(key[0]))
+
+    def clear(self):
+        with self.lock:
+            self.predictors.clear()
+
+
+class PredictorPoolInstance:
+    pool = None
+
+    @staticmethod
+    def get():
+        settings = Settings()
+        if PredictorPoolInstance.pool is None:
+            PredictorPoolInstance.pool = PredictorPool()
+        pool = PredictorPoolInstance.pool
+        pool.max_predictors = settings.get_predictor_pool_size()
+        pool.max_memory = settings.get_predictor_memory_limit() * MB
+        return pool
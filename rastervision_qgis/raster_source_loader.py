@@ -1,26 +1,79 @@
-from .utils import get_local_path
+from contextlib import nullcontext
 
+from qgis.core import QgsRasterLayer
+
+from .utils import (streaming_options, get_vsi_path)
+from .vrt_cache import get_mosaic_vrt_path
+from .style_cache import StyleCacheInstance
 from .log import Log
 
 class RasterSourceLoader:
     @staticmethod
-    def load(uri, layer_name, ctx, style_file=None):
-        path = get_local_path(uri, ctx.working_dir)
-        layer = ctx.iface.addRasterLayer(path, layer_name)
+    def get_stream_path(uri, ctx):
+        """Returns the GDAL path to stream the URI from, if streaming is enabled
+        and possible for this URI, otherwise None."""
+        if ctx.stream_rasters:
+            return get_vsi_path(uri)
+        return None
+
+    @staticmethod
+    def get_uris(uris, ctx):
+        """Returns the URIs that need to be downloaded to load the given raster URIs."""
+        return [uri for uri in uris if not RasterSourceLoader.get_stream_path(uri, ctx)]
+
+    @staticmethod
+    def get_path(uri, ctx):
+        """Returns the path GDAL should read the URI from: a virtual file system
+        path if it can be streamed, otherwise the path of a local copy."""
+        stream_path = RasterSourceLoader.get_stream_path(uri, ctx)
+        if stream_path:
+            return stream_path
+        return ctx.get_local_path(uri)
+
+    @staticmethod
+    def open_options(paths):
+        """Returns a context manager to open the rasters at paths in, which applies
+        the streaming configuration if any of them is streamed."""
+        if any(path.startswith('/vsi') for path in paths):
+            return streaming_options()
+        return nullcontext()
+
+    @staticmethod
+    def add_layer(layer, ctx, style_file=None):
+        ctx.add_layer(layer)
         if style_file:
-            if style_file.endswith('.sld'):
-                layer.loadSldStyle(style_file)
-            else:
-                layer.loadNamedStyle(style_file)
+            StyleCacheInstance.get().apply(layer, style_file)
+        return layer
 
+    @staticmethod
+    def load(uri, layer_name, ctx, style_file=None):
+        path = RasterSourceLoader.get_path(uri, ctx)
+        with RasterSourceLoader.open_options([path]):
+            layer = QgsRasterLayer(path, layer_name)
+        if path.startswith('/vsi') and not layer.isValid():
+            Log.log_warning('Unable to stream {}, downloading it instead.'.format(uri))
+            layer = QgsRasterLayer(ctx.get_local_path(uri), layer_name)
+        return RasterSourceLoader.add_layer(layer, ctx, style_file)
 
 
 class GeoTiffSourceLoader:
+    @staticmethod
+    def get_uris(config, ctx):
+        return RasterSourceLoader.get_uris(config.uris, ctx)
+
     @staticmethod
     def load(config, layer_name, ctx, style_file=None):
         uris = config.uris
         if len(uris) == 1:
             RasterSourceLoader.load(uris[0], layer_name, ctx, style_file)
+        elif ctx.mosaic_rasters:
+            paths = [RasterSourceLoader.get_path(uri, ctx) for uri in uris]
+            with RasterSourceLoader.open_options(paths):
+                vrt_path = get_mosaic_vrt_path(uris, paths, ctx.working_dir, ctx.cache_keys)
+                layer = QgsRasterLayer(vrt_path, layer_name) if vrt_path else None
+            if layer is None:
+                raise Exception('Unable to build a mosaic for {}'.format(layer_name))
+            RasterSourceLoader.add_layer(layer, ctx, style_file)
         else:
             for i, uri in enumerate(uris):
                 name = "{}_{}".format(layer_name, i)
@@ -29,6 +82,10 @@ class GeoTiffSourceLoader:
 
 
 class ImageSourceLoader:
+    @staticmethod
+    def get_uris(config, ctx):
+        return RasterSourceLoader.get_uris([config.uris], ctx)
+
     @staticmethod
     def load(config, layer_name, ctx, style_file=None):
         uri = config.uris
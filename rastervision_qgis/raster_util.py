@@ -1,23 +1,257 @@
-from qgis.core import (QgsProject,
+import os
+import math
+import hashlib
+import xml.etree.ElementTree as ET
+
+from PyQt5.QtXml import QDomDocument
+from qgis.core import (QgsCoordinateTransform,
+                       QgsProject,
                        QgsRasterFileWriter,
                        QgsRasterLayer,
-                       QgsRasterPipe)
+                       QgsRasterPipe,
+                       QgsRectangle)
+
+from .cache_index import CacheIndexInstance
+from .settings import Settings
+
+EXPORT_CACHE_DIR = 'export-cache'
+
+EXPORT_COMPRESSIONS = ['NONE', 'LZW', 'DEFLATE', 'ZSTD']
+
+def get_export_create_options(compression='NONE', tiled=True, block_size=512, threads=0):
+    """Returns GeoTIFF creation options for exports. Tiled exports are read back in
+    blocks by the predictor. Exports are only read once, locally, so they are not
+    compressed by default: compression saves disk at several times the write time
+    (see scripts/benchmark_export.py), and NUM_THREADS spreads it over several threads.
+    GeoTIFF block sizes must be multiples of 16, so block_size is rounded down to one."""
+    options = []
+    if tiled:
+        block_size = max(16, block_size // 16 * 16)
+        options += ['TILED=YES',
+                    'BLOCKXSIZE={}'.format(block_size),
+                    'BLOCKYSIZE={}'.format(block_size)]
+    if compression and compression != 'NONE':
+        options.append('COMPRESS={}'.format(compression))
+        options.append('NUM_THREADS={}'.format(threads or 'ALL_CPUS'))
+    return options
+
+def get_default_export_create_options():
+    """Returns the export creation options set in the config dialog."""
+    settings = Settings()
+    return get_export_create_options(settings.get_export_compression(),
+                                     settings.get_export_tiled(),
+                                     settings.get_export_block_size(),
+                                     settings.get_export_threads())
+
+def get_layer_window(layer, extent, extent_crs):
+    """
+    Returns the part of the layer covered by extent (a QgsRectangle in extent_crs),
+    as a QgsRectangle in the layer's CRS snapped outwards to the layer's pixel grid.
+    Returns None if the extent doesn't overlap the layer.
+    """
+    transform = QgsCoordinateTransform(extent_crs, layer.crs(), QgsProject.instance())
+    layer_extent = layer.extent()
+    window = transform.transformBoundingBox(extent).intersect(layer_extent)
+    if window.isEmpty():
+        return None
+
+    res_x = layer.rasterUnitsPerPixelX()
+    res_y = layer.rasterUnitsPerPixelY()
+    x_min = layer_extent.xMinimum() + \
+            math.floor((window.xMinimum() - layer_extent.xMinimum()) / res_x) * res_x
+    x_max = layer_extent.xMinimum() + \
+            math.ceil((window.xMaximum() - layer_extent.xMinimum()) / res_x) * res_x
+    y_max = layer_extent.yMaximum() - \
+            math.floor((layer_extent.yMaximum() - window.yMaximum()) / res_y) * res_y
+    y_min = layer_extent.yMaximum() - \
+            math.ceil((layer_extent.yMaximum() - window.yMinimum()) / res_y) * res_y
+    return QgsRectangle(x_min, y_min, x_max, y_max)
+
+def get_tile_windows(layer, tile_size, window=None):
+    """
+    Splits window, or the whole layer if there is none, into windows of at most
+    tile_size by tile_size pixels, in row major order.
+    """
+    if window is None:
+        window = layer.extent()
+    res_x = layer.rasterUnitsPerPixelX()
+    res_y = layer.rasterUnitsPerPixelY()
+    cols = int(round(window.width() / res_x))
+    rows = int(round(window.height() / res_y))
+
+    windows = []
+    for row in range(0, rows, tile_size):
+        for col in range(0, cols, tile_size):
+            x_min = window.xMinimum() + col * res_x
+            y_max = window.yMaximum() - row * res_y
+            x_max = window.xMinimum() + min(col + tile_size, cols) * res_x
+            y_min = window.yMaximum() - min(row + tile_size, rows) * res_y
+            windows.append(QgsRectangle(x_min, y_min, x_max, y_max))
+    return windows
+
+def parse_band_order(text):
+    """Parses a band order such as "3,2,1" into a list of 1-based band numbers.
+    Returns None for an empty string, and raises ValueError if it is invalid."""
+    if not text.strip():
+        return None
+    bands = [int(b) for b in text.replace(' ', '').split(',')]
+    if any(b < 1 for b in bands):
+        raise ValueError('Band numbers start at 1: {}'.format(text))
+    return bands
+
+def export_raster_layer(layer, path, window=None, create_options=None, raw=False):
+    """Writes the layer, or only the part within window (a QgsRectangle in the
+    layer's CRS, see get_layer_window), to a GeoTIFF at path with the given
+    creation options (see get_export_create_options).
 
-def export_raster_layer(layer, path):
+    By default the layer is written as rendered with its style. If raw is True,
+    the provider's bands are written as they are, in their native data type,
+    which also skips rendering every pixel.
+    """
     provider = layer.dataProvider()
-    renderer = layer.renderer()
     pipe = QgsRasterPipe()
     pipe.set(provider.clone())
-    pipe.set(renderer.clone())
+    if not raw:
+        pipe.set(layer.renderer().clone())
+
+    if window is None:
+        width, height, extent = provider.xSize(), provider.ySize(), provider.extent()
+    else:
+        width = int(round(window.width() / layer.rasterUnitsPerPixelX()))
+        height = int(round(window.height() / layer.rasterUnitsPerPixelY()))
+        extent = window
 
     file_writer = QgsRasterFileWriter(path)
+    if create_options:
+        file_writer.setCreateOptions(create_options)
     file_writer.writeRaster(
         pipe,
-        provider.xSize(),
-        provider.ySize(),
-        provider.extent(),
+        width,
+        height,
+        extent,
         provider.crs())
 
+def get_layer_file_path(layer):
+    """Returns the path of the file behind a GDAL raster layer, or None if
+    the layer is not read from a local file."""
+    if layer.providerType() != 'gdal':
+        return None
+    path = layer.source().split('|')[0]
+    if os.path.isfile(path):
+        return path
+    return None
+
+def get_source_paths(path, remote=False):
+    """Returns the local files read for the raster at path: the file itself and, for
+    a VRT, the files behind its sources, recursively. VRTs reference their sources
+    by absolute path, so a process reading one needs access to all of these.
+    Paths on GDAL virtual file systems are left out, unless remote is True."""
+    paths = []
+    pending = [os.path.abspath(path)]
+    while pending:
+        path = pending.pop()
+        if path in paths:
+            continue
+        paths.append(path)
+        if not path.lower().endswith('.vrt'):
+            continue
+        try:
+            root = ET.parse(path).getroot()
+        except (OSError, ET.ParseError):
+            continue
+        for element in root.iter('SourceFilename'):
+            source = (element.text or '').strip()
+            if source.startswith('/vsi'):
+                if remote:
+                    paths.append(source)
+            elif source:
+                if element.get('relativeToVRT') == '1':
+                    source = os.path.join(os.path.dirname(path), source)
+                pending.append(os.path.abspath(source))
+    return paths
+
+def get_export_cache_key(layer, window=None, raw=False, bands=None):
+    """Returns a key identifying what get_exported_raster_path would write for the
+    layer: its source, extent, size, CRS and style (including the renderer, unless
+    exporting raw bands), and the window and band order if there are any."""
+    provider = layer.dataProvider()
+    parts = [layer.source(),
+             provider.extent().toString(),
+             str(provider.xSize()),
+             str(provider.ySize()),
+             provider.crs().authid()]
+    if raw:
+        parts.append('raw')
+    else:
+        style = QDomDocument()
+        layer.exportNamedStyle(style)
+        parts.append(style.toString())
+    if window is not None:
+        parts.append(window.toString(16))
+    if bands:
+        parts.append(','.join(map(str, bands)))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+def get_input_version(layer, raw=False, bands=None):
+    """Returns a string that changes when the pixels given to the predictor for the
+    layer change: the path, size and modification time of a file-backed layer, or
+    the export cache key of other layers, along with the band order."""
+    path = get_layer_file_path(layer)
+    if path:
+        stat = os.stat(path)
+        version = '{}|{}|{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if bands:
+            version += '|' + ','.join(map(str, bands))
+        return version
+    return get_export_cache_key(layer, raw=raw, bands=bands)
+
+def get_exported_raster_path(layer, working_dir, window=None, raw=False, bands=None,
+                             cache_keys=None):
+    """
+    Returns the path of a GeoTIFF of the layer, or of the part of it within window,
+    that can be given to the predictor, with its bands in the given order (a list
+    of 1-based band numbers) if there is one.
+
+    Layers that are read from a local file are used as is, through a VRT if there
+    is a window or band order; their bands are always passed raw. Other layers are
+    exported with export_raster_layer into the working directory, rendered or raw,
+    and the export is reused for as long as the layer's source, extent, renderer,
+    window and band order don't change. The cache index key of the VRT or export
+    is added to cache_keys, if given, so the caller can hold it while predicting.
+    """
+    path = get_layer_file_path(layer)
+    if path and window is None and not bands:
+        return path
+
+    key = get_export_cache_key(layer, window, raw or bool(path), bands)
+    cache_key = '{}://{}'.format(EXPORT_CACHE_DIR, key)
+    extension = '.vrt' if path else '.tif'
+    cache_path = os.path.join(working_dir, EXPORT_CACHE_DIR, key + extension)
+
+    def build(tmp_path):
+        if path:
+            from osgeo import gdal
+            options = {'format': 'VRT', 'bandList': bands}
+            if window is not None:
+                options['projWin'] = [window.xMinimum(), window.yMaximum(),
+                                      window.xMaximum(), window.yMinimum()]
+            gdal.Translate(tmp_path, path, **options)
+        else:
+            create_options = get_default_export_create_options()
+            export_raster_layer(layer, tmp_path, window, create_options, raw)
+            if bands and os.path.exists(tmp_path):
+                from osgeo import gdal
+                ordered_path = '{}.bands.tif'.format(tmp_path)
+                gdal.Translate(ordered_path, tmp_path, format='GTiff', bandList=bands,
+                               creationOptions=create_options)
+                os.replace(ordered_path, tmp_path)
+        if not os.path.exists(tmp_path):
+            raise Exception("Writing raster to {} failed".format(tmp_path))
+        return True
+
+    index = CacheIndexInstance.get(working_dir)
+    return index.get_or_build(cache_key, cache_path, key, build, cache_keys)
+
 def get_raster_layers():
     project = QgsProject.instance()
     raster_layers = { }
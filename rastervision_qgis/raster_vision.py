@@ -29,6 +29,8 @@ from .experiment_dialog import ExperimentDialogController
 from .predict_dialog import PredictDialogController
 from .profiles_dialog import ProfilesDialogController
 from .config_dialog import ConfigDialogController
+from .predict_worker import PredictWorkerInstance
+from .cache_index import CacheIndexInstance
 
 class RasterVisionPlugin:
     """Main entry point for the Raster Vision QGIS Plugin."""
@@ -203,6 +205,14 @@ class RasterVisionPlugin:
             self.iface.removeToolBarIcon(action)
         # remove the toolbar
         del self.toolbar
+        # stop following the map canvas for lazily loaded scenes
+        self.experiment_controller.stop()
+        # cancel queued predictions and release the label caches of loaded ones
+        self.predict_controller.stop()
+        # stop any prediction worker process
+        PredictWorkerInstance.stop()
+        # write the download cache indexes, which are saved at most every few seconds
+        CacheIndexInstance.reset()
 
     def run_load_experiment(self):
         self.experiment_controller.run()
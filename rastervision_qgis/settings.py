@@ -1,5 +1,7 @@
 import os
+import sys
 import json
+import shutil
 
 from PyQt5.QtCore import QSettings
 
@@ -77,6 +79,34 @@ class Settings(object):
     def set_experiment_profile(self, v):
         self.settings.setValue('experiment/profile', v)
 
+    # Stream remote rasters instead of downloading them
+    def get_stream_rasters(self):
+        return self.settings.value('experiment/stream_rasters', False, bool)
+
+    def set_stream_rasters(self, v):
+        self.settings.setValue('experiment/stream_rasters', v)
+
+    # Load multi-file raster sources as a single VRT mosaic
+    def get_mosaic_rasters(self):
+        return self.settings.value('experiment/mosaic_rasters', False, bool)
+
+    def set_mosaic_rasters(self, v):
+        self.settings.setValue('experiment/mosaic_rasters', v)
+
+    # Load only the scenes that the map canvas reaches
+    def get_lazy_load(self):
+        return self.settings.value('experiment/lazy_load', False, bool)
+
+    def set_lazy_load(self, v):
+        self.settings.setValue('experiment/lazy_load', v)
+
+    # Maximum number of scenes kept loaded when loading lazily
+    def get_lazy_scene_budget(self):
+        return self.settings.value('experiment/lazy_scene_budget', 20, int)
+
+    def set_lazy_scene_budget(self, v):
+        self.settings.setValue('experiment/lazy_scene_budget', v)
+
     # Experiment load options
     def get_experiment_load_options(self):
         s = self.settings.value("experiment/experiment_load_options")
@@ -104,6 +134,48 @@ class Settings(object):
     def set_predict_profile(self, v):
         self.settings.setValue('predict/profile', v)
 
+    # Area to predict: 'layer', 'canvas' or 'selection'
+    def get_predict_area(self):
+        return self.settings.value('predict/predict_area', 'layer')
+
+    def set_predict_area(self, v):
+        self.settings.setValue('predict/predict_area', v)
+
+    # Size in pixels of the tiles to predict, 0 to predict the whole area at once
+    def get_predict_tile_size(self):
+        return self.settings.value('predict/tile_size', 0, int)
+
+    def set_predict_tile_size(self, v):
+        self.settings.setValue('predict/tile_size', v)
+
+    # Number of batch or tile inputs exported in parallel with the prediction
+    def get_predict_concurrency(self):
+        return self.settings.value('predict/concurrency', 2, int)
+
+    def set_predict_concurrency(self, v):
+        self.settings.setValue('predict/concurrency', v)
+
+    # Whether to load cached predictions instead of predicting again
+    def get_use_prediction_cache(self):
+        return self.settings.value('predict/use_prediction_cache', True, bool)
+
+    def set_use_prediction_cache(self, v):
+        self.settings.setValue('predict/use_prediction_cache', v)
+
+    # Predict on the raw bands of layers instead of their rendered style
+    def get_export_raw(self):
+        return self.settings.value('predict/export_raw', False, bool)
+
+    def set_export_raw(self, v):
+        self.settings.setValue('predict/export_raw', v)
+
+    # Bands given to the predictor, e.g. "3,2,1"; empty for all bands in order
+    def get_band_order(self):
+        return self.settings.value('predict/band_order', '')
+
+    def set_band_order(self, v):
+        self.settings.setValue('predict/band_order', v)
+
     # Label Store URI
     def get_label_store_uri(self):
         return self.settings.value('predict/label_store_uri', '')
@@ -132,6 +204,49 @@ class Settings(object):
     def set_docker_image(self, v):
         self.settings.setValue('predict/docker_image', v)
 
+    # Keep one prediction container running instead of one container per prediction
+    def get_docker_persistent(self):
+        return self.settings.value('predict/docker_persistent', False, bool)
+
+    def set_docker_persistent(self, v):
+        self.settings.setValue('predict/docker_persistent', v)
+
+    # Docker executable
+    def get_docker_executable(self):
+        return self.settings.value('predict/docker_executable', 'docker')
+
+    def set_docker_executable(self, v):
+        self.settings.setValue('predict/docker_executable', v)
+
+    # Predict in a separate worker process
+    def get_use_worker_process(self):
+        return self.settings.value('predict/use_worker_process', False, bool)
+
+    def set_use_worker_process(self, v):
+        self.settings.setValue('predict/use_worker_process', v)
+
+    # Python interpreter that runs the prediction worker process
+    def get_worker_python(self):
+        default = shutil.which('python3') or sys.executable
+        return self.settings.value('predict/worker_python', default)
+
+    def set_worker_python(self, v):
+        self.settings.setValue('predict/worker_python', v)
+
+    # Number of predictors kept loaded between predictions
+    def get_predictor_pool_size(self):
+        return self.settings.value('predict/predictor_pool_size', 2, int)
+
+    def set_predictor_pool_size(self, v):
+        self.settings.setValue('predict/predictor_pool_size', v)
+
+    # Memory budget in MB of the predictors kept loaded
+    def get_predictor_memory_limit(self):
+        return self.settings.value('predict/predictor_memory_limit', 4096, int)
+
+    def set_predictor_memory_limit(self, v):
+        self.settings.setValue('predict/predictor_memory_limit', v)
+
     ### Style Profiles
 
     # Style profiles
@@ -156,3 +271,81 @@ class Settings(object):
 
     def set_working_dir(self, v):
         self.settings.setValue("config/working_dir", v)
+
+    # Number of concurrent downloads
+    def get_download_threads(self):
+        return self.settings.value("config/download_threads", 4, int)
+
+    def set_download_threads(self, v):
+        self.settings.setValue("config/download_threads", v)
+
+    # Download cache revalidation policy: 'always', 'ttl' or 'offline'
+    def get_cache_revalidation(self):
+        return self.settings.value("config/cache_revalidation", "ttl")
+
+    def set_cache_revalidation(self, v):
+        self.settings.setValue("config/cache_revalidation", v)
+
+    # Seconds a cached download is trusted without revalidation, for the 'ttl' policy
+    def get_cache_ttl(self):
+        return self.settings.value("config/cache_ttl", 3600, int)
+
+    def set_cache_ttl(self, v):
+        self.settings.setValue("config/cache_ttl", v)
+
+    # Disk budget of the download cache in MB. 0 means unbounded.
+    def get_cache_size_limit(self):
+        return self.settings.value("config/cache_size_limit", 10240, int)
+
+    def set_cache_size_limit(self, v):
+        self.settings.setValue("config/cache_size_limit", v)
+
+    # Format vector labels are transcoded to for faster rendering; empty to disable
+    def get_vector_cache_format(self):
+        return self.settings.value("config/vector_cache_format", "")
+
+    def set_vector_cache_format(self, v):
+        self.settings.setValue("config/vector_cache_format", v)
+
+    # Build overviews for loaded rasters that have none
+    def get_build_overviews(self):
+        return self.settings.value("config/build_overviews", True, bool)
+
+    def set_build_overviews(self, v):
+        self.settings.setValue("config/build_overviews", v)
+
+    # Maximum number of concurrent overview builds
+    def get_overview_processes(self):
+        default = max(1, (os.cpu_count() or 2) // 2)
+        return self.settings.value("config/overview_processes", default, int)
+
+    def set_overview_processes(self, v):
+        self.settings.setValue("config/overview_processes", v)
+
+    # Compression of exported prediction inputs: 'NONE', 'LZW', 'DEFLATE' or 'ZSTD'
+    def get_export_compression(self):
+        return self.settings.value("config/export_compression", "NONE")
+
+    def set_export_compression(self, v):
+        self.settings.setValue("config/export_compression", v)
+
+    # Write exported prediction inputs as tiled GeoTIFFs
+    def get_export_tiled(self):
+        return self.settings.value("config/export_tiled", True, bool)
+
+    def set_export_tiled(self, v):
+        self.settings.setValue("config/export_tiled", v)
+
+    # Block size in pixels of tiled exports
+    def get_export_block_size(self):
+        return self.settings.value("config/export_block_size", 512, int)
+
+    def set_export_block_size(self, v):
+        self.settings.setValue("config/export_block_size", v)
+
+    # Threads used to compress exports. 0 means all CPUs.
+    def get_export_threads(self):
+        return self.settings.value("config/export_threads", 0, int)
+
+    def set_export_threads(self, v):
+        self.settings.setValue("config/export_threads", v)
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+
+from PyQt5.QtXml import QDomDocument
+
+from .log import Log
+
+class StyleCache:
+    """Keeps the parsed documents of the style files of style profiles, so that a
+    style applied to many layers is read and parsed once per session rather than
+    once per layer. A file is parsed again when its modification time or size changes.
+
+    The time spent parsing each file is recorded, and every reuse of a parsed
+    document adds it to saved_time.
+    """
+
+    def __init__(self):
+        # path -> (mtime, size, QDomDocument, parse time in seconds)
+        self.documents = {}
+        self.hits = 0
+        self.saved_time = 0.0
+        # QDomDocument is not thread safe and layers are styled from load tasks.
+        self.lock = threading.Lock()
+
+    def _get_document(self, path):
+        stat = os.stat(path)
+        entry = self.documents.get(path)
+        if entry is not None and entry[:2] == (stat.st_mtime, stat.st_size):
+            self.hits += 1
+            self.saved_time += entry[3]
+            return entry[2]
+
+        start = time.time()
+        with open(path, 'rb') as f:
+            content = f.read()
+        doc = QDomDocument()
+        # SLD elements are namespaced, as QgsMapLayer.loadSldStyle reads them.
+        ok, msg, line, _ = doc.setContent(content, path.endswith('.sld'))
+        if not ok:
+            raise ValueError('Unable to parse style file {} at line {}: {}'.format(
+                path, line, msg))
+        self.documents[path] = (stat.st_mtime, stat.st_size, doc, time.time() - start)
+        return doc
+
+    def apply(self, layer, style_file):
+        """Applies the QML or SLD style file to the layer. Returns True on success."""
+        with self.lock:
+            try:
+                doc = self._get_document(style_file)
+            except (OSError, ValueError) as e:
+                Log.log_warning('Unable to load style {}: {}'.format(style_file, e))
+                return False
+
+            if style_file.endswith('.sld'):
+                named_layer = doc.documentElement().firstChildElement('NamedLayer')
+                ok = not named_layer.isNull() and layer.readSld(named_layer, '')
+                msg = ''
+            else:
+                ok, msg = layer.importNamedStyle(doc)
+
+        if not ok:
+            Log.log_warning('Unable to apply style {} to {}: {}'.format(
+                style_file, layer.name(), msg))
+        return ok
+
+    def get_stats(self):
+        """Returns (number of reuses, seconds of parsing saved) so far."""
+        with self.lock:
+            return self.hits, self.saved_time
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+class StyleCacheInstance:
+    cache = None
+
+    @staticmethod
+    def get():
+        if StyleCacheInstance.cache is None:
+            StyleCacheInstance.cache = StyleCache()
+        return StyleCacheInstance.cache
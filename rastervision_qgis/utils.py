@@ -1,43 +1,191 @@
 import os
 import json
 from datetime import datetime, timezone
+from contextlib import contextmanager
+from urllib.parse import urlparse
 
 from rastervision.filesystem import (FileSystem, LocalFileSystem)
+from rastervision.filesystem.s3_filesystem import S3FileSystem
 from rastervision.utils.files import make_dir
 
+from .cache_index import CacheIndexInstance
 from .log import Log
 
+# Extensions of raster files that can be read with range requests.
+STREAMABLE_EXTENSIONS = ['.tif', '.tiff']
+
+# Prefixes of the GDAL virtual file system paths that remote rasters are streamed from.
+STREAMING_PATH_PREFIXES = ['/vsis3/', '/vsicurl/']
+
+# GDAL configuration for reading remote rasters. Blocks that have been read are kept
+# in GDAL's in-memory VSI cache, so that panning back over an area doesn't fetch them again.
+# These options must not apply to local files: with GDAL_DISABLE_READDIR_ON_OPEN set,
+# GDAL doesn't find sidecar files such as overviews, masks and .aux.xml.
+STREAMING_CONFIG = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': ','.join(STREAMABLE_EXTENSIONS + ['.ovr', '.vrt']),
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': str(64 * 1024 * 1024),
+    'CPL_VSIL_CURL_CACHE_SIZE': str(256 * 1024 * 1024),
+    'GDAL_HTTP_MULTIRANGE': 'YES',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    # Fetch enough of the file on open for a GeoTIFF header to take one request.
+    'GDAL_INGESTED_BYTES_AT_OPEN': str(32 * 1024)
+}
+
+_streaming_configured = False
+
+def configure_streaming():
+    """Sets STREAMING_CONFIG for the streaming path prefixes only, on GDAL versions
+    that support path specific options (3.6+). Options set by the user in the
+    environment are not overridden."""
+    global _streaming_configured
+    if not _streaming_configured:
+        from osgeo import gdal
+        if hasattr(gdal, 'SetPathSpecificOption'):
+            for prefix in STREAMING_PATH_PREFIXES:
+                for key, value in STREAMING_CONFIG.items():
+                    if not gdal.GetConfigOption(key):
+                        gdal.SetPathSpecificOption(prefix, key, value)
+        _streaming_configured = True
+
+@contextmanager
+def streaming_options():
+    """
+    Context manager that applies STREAMING_CONFIG to the current thread while remote
+    rasters are opened, for GDAL versions without path specific options, and for
+    the options GDAL only reads from the global configuration. Only remote paths
+    should be opened within it.
+    """
+    from osgeo import gdal
+
+    configure_streaming()
+    previous = {}
+    for key, value in STREAMING_CONFIG.items():
+        if not gdal.GetConfigOption(key):
+            previous[key] = gdal.GetThreadLocalConfigOption(key)
+            gdal.SetThreadLocalConfigOption(key, value)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            gdal.SetThreadLocalConfigOption(key, value)
+
+def get_vsi_path(uri):
+    """
+    Returns the GDAL virtual file system path to read a remote raster in place,
+    or None if the URI can't be streamed.
+    """
+    parsed_uri = urlparse(uri)
+    extension = os.path.splitext(parsed_uri.path)[1].lower()
+    if extension not in STREAMABLE_EXTENSIONS:
+        return None
+    if parsed_uri.scheme == 's3':
+        return '/vsis3/{}{}'.format(parsed_uri.netloc, parsed_uri.path)
+    if parsed_uri.scheme in ['http', 'https']:
+        return '/vsicurl/{}'.format(uri)
+    return None
+
+def get_remote_version(fs, uri):
+    """
+    Returns (version, last_modified) for a remote URI. The version is the ETag
+    for S3 objects, and the last modified time for other file systems. Both are
+    None if the file system can't tell.
+    """
+    if fs is S3FileSystem:
+        # boto3's default session is not thread safe, and this runs on pool threads.
+        parsed_uri = urlparse(uri)
+        s3 = S3FileSystem.get_session().client('s3')
+        head = s3.head_object(Bucket=parsed_uri.netloc, Key=parsed_uri.path[1:])
+        return head['ETag'], head['LastModified']
+
+    last_modified = fs.last_modified(uri)
+    if last_modified:
+        return last_modified.isoformat(), last_modified
+    return None, None
+
+def get_source_version(uri, path, working_dir):
+    """
+    Returns a version string for a file: the version recorded in the cache
+    index if it was downloaded, otherwise its modification time and size.
+    """
+    entry = CacheIndexInstance.get(working_dir).get(uri)
+    if entry and entry['version']:
+        return entry['version']
+    stat = os.stat(path)
+    return '{}-{}'.format(stat.st_mtime, stat.st_size)
+
+def is_newer(local_path, last_modified):
+    """Returns True if the local file was modified after last_modified."""
+    local_last_modified = datetime.utcfromtimestamp(os.path.getmtime(local_path))
+    return local_last_modified.replace(tzinfo=timezone.utc) > last_modified
+
 def get_local_path(uri, working_dir):
     """
     This method will simply pass along the URI if it is local.
     If the URI is on S3, it will download the data to the working directory,
     in a structure that matches s3, and return the local path.
-    If the local path already exists, and the timestamp of the S3 object is at or before
-    the local path, the download will be skipped
+
+    Downloads are recorded in the working directory's CacheIndex. A cached copy is
+    used without contacting the remote file system if the revalidation policy allows
+    it; otherwise it is used if its recorded version matches the remote version.
+    Files downloaded before the index existed are kept if the timestamp of the S3
+    object is at or before the local path. A file that isn't there at all is
+    downloaded without asking for its version first; the version is recorded when
+    the copy is first revalidated.
     """
 
     fs = FileSystem.get_file_system(uri)
     if fs is LocalFileSystem:
         return uri
 
-
     local_path = fs.local_path(uri, working_dir)
-    do_copy = True
-    if os.path.exists(local_path):
-        last_modified = fs.last_modified(uri)
+    index = CacheIndexInstance.get(working_dir)
+
+    version = None
+    if index.is_cached(uri, local_path):
+        if not index.needs_revalidation(uri):
+            index.touch(uri)
+            index.record_hit()
+            return local_path
+        recorded_version = index.get(uri)['version']
+        version, last_modified = get_remote_version(fs, uri)
+        if version is None or version == recorded_version:
+            index.mark_validated(uri)
+            index.record_hit()
+            return local_path
+        # Copies downloaded without a version are kept if they are newer.
+        do_copy = (recorded_version is not None or not last_modified or
+                   not is_newer(local_path, last_modified))
+    elif os.path.exists(local_path):
+        version, last_modified = get_remote_version(fs, uri)
         if last_modified:
             # If thel local file is older than the remote file, download it.
-            local_last_modified = datetime.utcfromtimestamp(os.path.getmtime(local_path))
-            if local_last_modified.replace(tzinfo=timezone.utc) > last_modified:
-                do_copy = False
+            do_copy = not is_newer(local_path, last_modified)
         else:
             # This FileSystem doesn't support last modified.
             # By default, don't download a new version.
             do_copy = False
+    else:
+        do_copy = True
 
     if do_copy:
+        index.record_miss()
         dir_name = os.path.dirname(local_path)
         make_dir(dir_name)
-        fs.copy_from(uri, local_path)
+        # Download next to the destination and move it into place, so that an
+        # interrupted download never leaves a partial file at the local path.
+        tmp_path = '{}.part'.format(local_path)
+        try:
+            fs.copy_from(uri, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            # Nothing is left behind if the copy failed.
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    else:
+        index.record_hit()
+
+    index.put(uri, local_path, version, os.path.getsize(local_path))
 
     return local_path
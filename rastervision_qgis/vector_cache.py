@@ -0,0 +1,42 @@
+import os
+import hashlib
+
+from .cache_index import CacheIndexInstance
+from .utils import get_source_version
+from .log import Log
+
+# Formats GeoJSON labels can be transcoded to, with their file extensions.
+VECTOR_CACHE_FORMATS = {'GPKG': '.gpkg', 'FlatGeobuf': '.fgb'}
+
+VECTOR_CACHE_DIR = 'vector-cache'
+
+def get_indexed_vector_path(uri, path, working_dir, fmt, cache_keys=None):
+    """
+    Returns the path of a copy of the vector file at path, transcoded to fmt
+    (GPKG or FlatGeobuf) with a spatial index, so that QGIS does not have to scan
+    every feature on each redraw. The copy is kept in the working directory keyed
+    by the source URI and its version, and tracked in the cache index so it is
+    evicted like any download; its index key goes into cache_keys, if given.
+    Returns None if the file can't be transcoded.
+    """
+    version = get_source_version(uri, path, working_dir)
+    key = hashlib.sha1('{}|{}|{}'.format(uri, version, fmt).encode()).hexdigest()
+    cache_key = '{}://{}'.format(VECTOR_CACHE_DIR, key)
+    cache_path = os.path.join(working_dir, VECTOR_CACHE_DIR, key + VECTOR_CACHE_FORMATS[fmt])
+
+    def build(tmp_path):
+        from osgeo import gdal
+
+        Log.log_info('Building {} label cache for {}'.format(fmt, uri))
+        ds = gdal.VectorTranslate(tmp_path, path, format=fmt,
+                                  layerCreationOptions=['SPATIAL_INDEX=YES'])
+        if ds is None:
+            Log.log_warning('Unable to transcode {} to {}: {}'.format(
+                path, fmt, gdal.GetLastErrorMsg()))
+            return False
+        # Closing the dataset flushes it to disk.
+        ds = None
+        return True
+
+    index = CacheIndexInstance.get(working_dir)
+    return index.get_or_build(cache_key, cache_path, version, build, cache_keys)
@@ -0,0 +1,46 @@
+import os
+import hashlib
+
+from .cache_index import CacheIndexInstance
+from .utils import get_source_version
+from .log import Log
+
+VRT_CACHE_DIR = 'vrt-cache'
+
+def get_mosaic_vrt_path(uris, paths, working_dir, cache_keys=None):
+    """
+    Returns the path of a GDAL VRT mosaicking the rasters at paths (local files or
+    GDAL virtual file system paths) for the given URIs, so that a scene made of many
+    files can be loaded as one layer. The VRT is kept in the working directory keyed
+    by the URIs and the versions of their local copies, and tracked in the cache index
+    under a key that is added to cache_keys, if given. Returns None if the VRT can't
+    be built.
+    """
+    versions = []
+    for uri, path in zip(uris, paths):
+        if path.startswith('/vsi'):
+            versions.append(path)
+        else:
+            versions.append(get_source_version(uri, path, working_dir))
+    key = hashlib.sha1('|'.join(list(uris) + versions).encode()).hexdigest()
+    cache_key = '{}://{}'.format(VRT_CACHE_DIR, key)
+    cache_path = os.path.join(working_dir, VRT_CACHE_DIR, key + '.vrt')
+
+    index = CacheIndexInstance.get(working_dir)
+    # The VRT only references the rasters, which may have been evicted since.
+    if not all(path.startswith('/vsi') or os.path.exists(path) for path in paths):
+        index.remove(cache_key)
+
+    def build(tmp_path):
+        from osgeo import gdal
+
+        ds = gdal.BuildVRT(tmp_path, list(paths))
+        if ds is None:
+            Log.log_warning('Unable to build a VRT mosaic of {}: {}'.format(
+                ', '.join(uris), gdal.GetLastErrorMsg()))
+            return False
+        # Closing the dataset writes the VRT.
+        ds = None
+        return True
+
+    return index.get_or_build(cache_key, cache_path, key, build, cache_keys)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmarks GeoTIFF creation options for the rasters exported for prediction.
+
+For each set of options this copies an input raster (or a generated one) to a
+new GeoTIFF with GDAL, the library QgsRasterFileWriter writes through, and
+reports the write time, the file size and the time to read the result back in
+blocks, as the predictor does.
+
+    python scripts/benchmark_export.py [--input image.tif] [--size 8192] [--bands 3]
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from osgeo import gdal
+
+# Keep in sync with raster_util.get_export_create_options.
+OPTION_SETS = [
+    ('striped, uncompressed (old default)', []),
+    ('tiled 512 (default)', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512']),
+    ('tiled 512, LZW', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                        'COMPRESS=LZW', 'NUM_THREADS=ALL_CPUS']),
+    ('tiled 512, DEFLATE, 1 thread', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                                      'COMPRESS=DEFLATE', 'NUM_THREADS=1']),
+    ('tiled 512, DEFLATE', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                            'COMPRESS=DEFLATE', 'NUM_THREADS=ALL_CPUS']),
+    ('tiled 512, DEFLATE, PREDICTOR=2', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                                         'COMPRESS=DEFLATE', 'PREDICTOR=2',
+                                         'NUM_THREADS=ALL_CPUS']),
+    ('tiled 512, ZSTD', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                         'COMPRESS=ZSTD', 'NUM_THREADS=ALL_CPUS']),
+    ('tiled 512, ZSTD, PREDICTOR=2', ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                                      'COMPRESS=ZSTD', 'PREDICTOR=2', 'NUM_THREADS=ALL_CPUS']),
+]
+
+
+def make_input(path, size, bands):
+    """Writes a smooth, imagery-like uint8 raster to path."""
+    ds = gdal.GetDriverByName('GTiff').Create(path, size, size, bands, gdal.GDT_Byte,
+                                              ['TILED=YES'])
+    ds.SetGeoTransform([0, 1, 0, 0, 0, -1])
+    rows = 512
+    x = np.linspace(0, 8 * np.pi, size)
+    for band in range(1, bands + 1):
+        for row in range(0, size, rows):
+            y = np.arange(row, min(row + rows, size))[:, None] / size * 8 * np.pi
+            block = 127 + 100 * np.sin(x[None, :] * band + y) + \
+                np.random.randint(0, 20, (len(y), size))
+            ds.GetRasterBand(band).WriteArray(block.clip(0, 255).astype(np.uint8), 0, row)
+    ds = None
+
+
+def read_back(path):
+    ds = gdal.Open(path)
+    block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+    block_y = max(block_y, 256)
+    for row in range(0, ds.RasterYSize, block_y):
+        ds.ReadAsArray(0, row, ds.RasterXSize, min(block_y, ds.RasterYSize - row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GeoTIFF export options')
+    parser.add_argument('--input', help='Raster to export. Generated if not given.')
+    parser.add_argument('--size', type=int, default=8192,
+                        help='Width and height of the generated raster')
+    parser.add_argument('--bands', type=int, default=3,
+                        help='Number of bands of the generated raster')
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        input_path = args.input
+        if not input_path:
+            input_path = os.path.join(tmp_dir, 'input.tif')
+            make_input(input_path, args.size, args.bands)
+
+        print('{:<36} {:>10} {:>12} {:>10}'.format('Options', 'Write (s)', 'Size (MB)',
+                                                  'Read (s)'))
+        for name, options in OPTION_SETS:
+            path = os.path.join(tmp_dir, 'export.tif')
+            start = time.time()
+            gdal.Translate(path, input_path, format='GTiff', creationOptions=options)
+            write_time = time.time() - start
+
+            size = os.path.getsize(path) / (1024 * 1024)
+
+            # Read from disk rather than from GDAL's block cache.
+            gdal.SetCacheMax(0)
+            start = time.time()
+            read_back(path)
+            read_time = time.time() - start
+            gdal.SetCacheMax(64 * 1024 * 1024)
+
+            print('{:<36} {:>10.2f} {:>12.1f} {:>10.2f}'.format(name, write_time, size,
+                                                                read_time))
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# coding=utf-8
+"""Tests for predicting a batch of items in a BatchPredictTask.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rastervision_qgis.predict_worker import (PredictItem, BatchPredictTask)
+
+
+class FakeLayer:
+    def __init__(self, layer_id, clones=None):
+        self.layer_id = layer_id
+        self.clones = clones if clones is not None else []
+        self.readers = 0
+
+    def id(self):
+        return self.layer_id
+
+    def clone(self):
+        clone = FakeLayer(self.layer_id, self.clones)
+        self.clones.append(clone)
+        return clone
+
+
+class FakeWorker:
+    def __init__(self):
+        self.images = []
+
+    def run(self, job, task):
+        self.images.append(job.image_path)
+        if 'fail' in job.image_path:
+            raise ValueError('bad input')
+
+
+class BatchPredictTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.lock = threading.Lock()
+        package = SimpleNamespace(uri='package.zip', index_key='predict-packages://key')
+        patcher = mock.patch('rastervision_qgis.predict_worker.PredictPackageCache')
+        patcher.start().return_value.get.return_value = package
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def export(self, layer, working_dir, window, raw, bands, keys):
+        """Exports slowly, checking that no clone is read by two threads at once."""
+        with self.lock:
+            layer.readers += 1
+            self.assertEqual(layer.readers, 1)
+            self.assertIsNot(layer, self.layers[layer.id()])
+        time.sleep(0.01)
+        with self.lock:
+            layer.readers -= 1
+        return '{}-{}.tif'.format(layer.id(), window)
+
+    def make_items(self, layer, count):
+        return [PredictItem('{}-{}'.format(layer.id(), i), layer,
+                            os.path.join(self.working_dir, '{}-{}.json'.format(layer.id(), i)),
+                            os.path.join(self.working_dir, layer.id(), str(i)), window=i)
+                for i in range(count)]
+
+    def run_task(self, items, concurrency):
+        worker = FakeWorker()
+        task = BatchPredictTask('test', worker, items, 'package.zip', False,
+                                self.working_dir, mock.Mock(), concurrency)
+        with mock.patch('rastervision_qgis.predict_worker.get_exported_raster_path',
+                        self.export):
+            self.assertTrue(task.run())
+        return task, worker
+
+    def test_one_clone_per_export_thread(self):
+        clones = []
+        self.layers = {'big': FakeLayer('big', clones), 'small': FakeLayer('small', clones)}
+        items = self.make_items(self.layers['big'], 20) + \
+            self.make_items(self.layers['small'], 1)
+
+        task, worker = self.run_task(items, concurrency=3)
+        self.assertEqual(len([c for c in clones if c.id() == 'big']), 3)
+        self.assertEqual(len([c for c in clones if c.id() == 'small']), 1)
+        self.assertEqual(worker.images, ['big-{}.tif'.format(i) for i in range(20)] +
+                         ['small-0.tif'])
+        self.assertEqual(sorted(task.jobs), list(range(21)))
+
+    def test_failures_are_recorded(self):
+        self.layers = {'fail': FakeLayer('fail'), 'ok': FakeLayer('ok')}
+        items = self.make_items(self.layers['fail'], 1) + self.make_items(self.layers['ok'], 1)
+
+        task, _ = self.run_task(items, concurrency=2)
+        self.assertEqual(list(task.jobs), [1])
+        self.assertEqual([name for name, _ in task.failures], ['fail-0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+# coding=utf-8
+"""Tests for the download cache index and its use by get_local_path.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from rastervision_qgis.cache_index import (CacheIndex, REVALIDATE_ALWAYS, REVALIDATE_TTL,
+                                           REVALIDATE_OFFLINE)
+from rastervision_qgis import utils
+
+
+class CacheIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def write_file(self, name, size):
+        path = os.path.join(self.working_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_revalidation_policies(self):
+        uri = 's3://bucket/image.tif'
+        path = self.write_file('image.tif', 10)
+
+        always = CacheIndex(self.working_dir, REVALIDATE_ALWAYS)
+        always.put(uri, path, 'etag', 10)
+        self.assertTrue(always.needs_revalidation(uri))
+
+        offline = CacheIndex(self.working_dir, REVALIDATE_OFFLINE)
+        self.assertFalse(offline.needs_revalidation(uri))
+
+        ttl = CacheIndex(self.working_dir, REVALIDATE_TTL, ttl=3600)
+        self.assertTrue(ttl.needs_revalidation('s3://bucket/other.tif'))
+        ttl.put(uri, path, 'etag', 10)
+        self.assertFalse(ttl.needs_revalidation(uri))
+        ttl.entries[uri]['validated'] -= 3601
+        self.assertTrue(ttl.needs_revalidation(uri))
+        ttl.mark_validated(uri)
+        self.assertFalse(ttl.needs_revalidation(uri))
+
+    def test_is_cached(self):
+        uri = 's3://bucket/image.tif'
+        path = self.write_file('image.tif', 10)
+        index = CacheIndex(self.working_dir)
+        self.assertFalse(index.is_cached(uri, path))
+
+        index.put(uri, path, 'etag', 10)
+        self.assertTrue(index.is_cached(uri, path))
+        self.assertFalse(index.is_cached(uri, path + '.other'))
+
+        # A partial or replaced file doesn't match the recorded size.
+        self.write_file('image.tif', 5)
+        self.assertFalse(index.is_cached(uri, path))
+
+    def test_save_and_read(self):
+        uri = 's3://bucket/image.tif'
+        path = self.write_file('image.tif', 10)
+        index = CacheIndex(self.working_dir)
+        index.put(uri, path, 'etag', 10)
+        index.save()
+
+        index = CacheIndex(self.working_dir)
+        self.assertEqual(index.get(uri)['version'], 'etag')
+        self.assertTrue(index.is_cached(uri, path))
+
+    def test_unreadable_index_is_ignored(self):
+        with open(os.path.join(self.working_dir, CacheIndex.FILE_NAME), 'w') as f:
+            f.write('{not json')
+        index = CacheIndex(self.working_dir)
+        self.assertEqual(index.items(), [])
+
+
+class GetOrBuildTest(unittest.TestCase):
+    cache_key = 'vrt-cache://key'
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.working_dir, 'vrt-cache', 'key.vrt')
+        self.index = CacheIndex(self.working_dir)
+        self.built = []
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def build(self, tmp_path):
+        self.built.append(tmp_path)
+        with open(tmp_path, 'w') as f:
+            f.write('<VRTDataset/>')
+        return True
+
+    def fail(self, tmp_path):
+        with open(tmp_path, 'w') as f:
+            f.write('<VRTData')
+        with open(tmp_path + '.aux.xml', 'w') as f:
+            f.write('<PAMDataset/>')
+        return False
+
+    def test_builds_once(self):
+        keys = set()
+        for _ in range(2):
+            self.assertEqual(self.index.get_or_build(self.cache_key, self.cache_path, 'v1',
+                                                     self.build, keys),
+                             self.cache_path)
+        self.assertEqual(len(self.built), 1)
+        self.assertNotEqual(self.built[0], self.cache_path)
+        self.assertEqual(keys, set([self.cache_key]))
+        self.assertEqual(self.index.get(self.cache_key)['version'], 'v1')
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), ['key.vrt'])
+
+        # A removed file is built again.
+        os.remove(self.cache_path)
+        self.index.get_or_build(self.cache_key, self.cache_path, 'v1', self.build)
+        self.assertEqual(len(self.built), 2)
+
+    def test_failed_build_leaves_nothing(self):
+        self.assertIsNone(self.index.get_or_build(self.cache_key, self.cache_path, 'v1',
+                                                  self.fail))
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), [])
+        self.assertIsNone(self.index.get(self.cache_key))
+
+    def test_build_errors_are_raised(self):
+        def fail(tmp_path):
+            self.fail(tmp_path)
+            raise RuntimeError('GDAL error')
+
+        with self.assertRaises(RuntimeError):
+            self.index.get_or_build(self.cache_key, self.cache_path, 'v1', fail)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), [])
+
+
+class GetLocalPathTest(unittest.TestCase):
+    uri = 's3://bucket/image.tif'
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.working_dir, 's3', 'bucket', 'image.tif')
+        self.index = None
+
+        self.fs = mock.Mock()
+        self.fs.local_path.return_value = self.local_path
+        self.fs.copy_from.side_effect = self.copy_from
+        self.remote_version = mock.Mock(return_value=('etag', self.remote_time(-60)))
+
+        for target, new in [('FileSystem.get_file_system', mock.Mock(return_value=self.fs)),
+                            ('get_remote_version', self.remote_version),
+                            ('CacheIndexInstance.get', lambda working_dir: self.index)]:
+            patcher = mock.patch('rastervision_qgis.utils.' + target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    @staticmethod
+    def remote_time(seconds):
+        return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+    @staticmethod
+    def copy_from(uri, path):
+        with open(path, 'w') as f:
+            f.write('pixels')
+
+    def get_local_path(self, policy):
+        self.index = CacheIndex(self.working_dir, policy, ttl=3600)
+        return utils.get_local_path(self.uri, self.working_dir)
+
+    def download(self, policy):
+        """Downloads the URI into the index, and forgets the calls made for it."""
+        self.get_local_path(policy)
+        self.index.put(self.uri, self.local_path, 'etag', os.path.getsize(self.local_path))
+        self.index.save()
+        self.fs.reset_mock()
+        self.remote_version.reset_mock()
+
+    def test_cold_miss_downloads_without_asking_for_the_version(self):
+        self.assertEqual(self.get_local_path(REVALIDATE_TTL), self.local_path)
+        self.fs.copy_from.assert_called_once_with(self.uri, self.local_path + '.part')
+        self.remote_version.assert_not_called()
+        self.assertTrue(self.index.is_cached(self.uri, self.local_path))
+        self.assertEqual(self.index.misses, 1)
+
+    def test_warm_hit_makes_no_remote_call(self):
+        for policy in [REVALIDATE_OFFLINE, REVALIDATE_TTL]:
+            self.download(policy)
+            self.assertEqual(self.get_local_path(policy), self.local_path)
+            self.fs.copy_from.assert_not_called()
+            self.remote_version.assert_not_called()
+            self.assertEqual(self.index.hits, 1)
+
+    def test_revalidation(self):
+        self.download(REVALIDATE_ALWAYS)
+        self.get_local_path(REVALIDATE_ALWAYS)
+        self.remote_version.assert_called_once_with(self.fs, self.uri)
+        self.fs.copy_from.assert_not_called()
+
+        self.remote_version.return_value = ('new-etag', self.remote_time(60))
+        self.get_local_path(REVALIDATE_ALWAYS)
+        self.fs.copy_from.assert_called_once_with(self.uri, self.local_path + '.part')
+        self.assertEqual(self.index.get(self.uri)['version'], 'new-etag')
+
+    def test_version_is_recorded_on_first_revalidation(self):
+        self.get_local_path(REVALIDATE_ALWAYS)
+        self.fs.reset_mock()
+
+        # The copy was made after the remote file was last modified.
+        self.get_local_path(REVALIDATE_ALWAYS)
+        self.fs.copy_from.assert_not_called()
+        self.assertEqual(self.index.get(self.uri)['version'], 'etag')
+
+    def test_failed_copy_leaves_no_partial_file(self):
+        def fail(uri, path):
+            self.copy_from(uri, path)
+            raise OSError('connection reset')
+        self.fs.copy_from.side_effect = fail
+
+        with self.assertRaises(OSError):
+            self.get_local_path(REVALIDATE_TTL)
+        self.assertEqual(os.listdir(os.path.dirname(self.local_path)), [])
+        self.assertIsNone(self.index.get(self.uri))
+
+
+if __name__ == '__main__':
+    unittest.main()
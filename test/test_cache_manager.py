@@ -0,0 +1,97 @@
+# coding=utf-8
+"""Tests for the LRU eviction of the working directory.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rastervision_qgis.cache_manager import (CacheManager, MB)
+
+
+class CacheManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.cache = CacheManager(self.working_dir, max_size_mb=2)
+        self.index = self.cache.index
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def put(self, name, accessed):
+        """Indexes a file as taking 1 MB, last accessed at the given time."""
+        path = os.path.join(self.working_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+        with open(path + '.aux.xml', 'w') as f:
+            f.write('<PAMDataset/>')
+        uri = 's3://bucket/{}'.format(name)
+        self.index.put(uri, path, 'etag', MB)
+        self.index.entries[uri]['accessed'] = accessed
+        return uri, path
+
+    def test_evicts_least_recently_accessed(self):
+        old_uri, old_path = self.put('old.tif', 1)
+        mid_uri, _ = self.put('mid.tif', 2)
+        new_uri, _ = self.put('new.tif', 3)
+
+        self.assertEqual(self.cache.evict(), MB)
+        self.assertIsNone(self.index.get(old_uri))
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(old_path + '.aux.xml'))
+        self.assertIsNotNone(self.index.get(mid_uri))
+        self.assertIsNotNone(self.index.get(new_uri))
+
+    def test_keeps_pinned_files(self):
+        pinned_uri, _ = self.put('pinned.tif', 1)
+        other_uri, _ = self.put('other.tif', 2)
+        newest_uri, _ = self.put('newest.tif', 3)
+
+        self.cache.pin([pinned_uri])
+        self.assertEqual(self.cache.evict(), MB)
+        self.assertIsNotNone(self.index.get(pinned_uri))
+        self.assertIsNone(self.index.get(other_uri))
+        self.assertIsNotNone(self.index.get(newest_uri))
+
+    def test_keeps_acquired_files_until_released(self):
+        acquired_uri, _ = self.put('acquired.tif', 1)
+        other_uri, _ = self.put('other.tif', 2)
+        self.put('newest.tif', 3)
+
+        # Acquired by two predictions.
+        self.index.acquire([acquired_uri])
+        self.index.acquire([acquired_uri])
+        self.assertEqual(self.cache.evict(), MB)
+        self.assertIsNotNone(self.index.get(acquired_uri))
+        self.assertIsNone(self.index.get(other_uri))
+
+        self.index.release([acquired_uri])
+        self.put('other.tif', 4)
+        self.cache.evict()
+        self.assertIsNotNone(self.index.get(acquired_uri))
+
+        self.index.release([acquired_uri])
+        self.put('another.tif', 5)
+        self.assertEqual(self.cache.evict(), MB)
+        self.assertIsNone(self.index.get(acquired_uri))
+
+    def test_unbounded(self):
+        cache = CacheManager(self.working_dir, max_size_mb=0)
+        self.put('a.tif', 1)
+        self.put('b.tif', 2)
+        self.put('c.tif', 3)
+        self.assertEqual(cache.evict(), 0)
+        self.assertEqual(len(self.index.items()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Tests for the de-duplicating download pool.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from rastervision_qgis.download_manager import DownloadManager
+
+
+class DownloadManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+        def get_local_path(uri, working_dir):
+            self.calls.append(uri)
+            self.started.set()
+            self.release.wait(5)
+            return '/local/{}'.format(uri.split('/')[-1])
+
+        patcher = mock.patch('rastervision_qgis.download_manager.get_local_path',
+                             get_local_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_fetches_each_uri_once(self):
+        manager = DownloadManager(self.working_dir, num_threads=4)
+        try:
+            uris = ['s3://bucket/aoi.json', 's3://bucket/a.tif', 's3://bucket/aoi.json']
+            futures = manager.fetch_all(uris)
+            self.assertIs(futures[0], futures[2])
+            self.assertIs(manager.fetch('s3://bucket/a.tif'), futures[1])
+
+            self.release.set()
+            self.assertEqual(manager.get_local_path('s3://bucket/aoi.json'), '/local/aoi.json')
+            self.assertEqual([f.result() for f in futures],
+                             ['/local/aoi.json', '/local/a.tif', '/local/aoi.json'])
+            self.assertEqual(sorted(self.calls), ['s3://bucket/a.tif', 's3://bucket/aoi.json'])
+        finally:
+            manager.shutdown()
+
+    def test_cancel_drops_queued_downloads(self):
+        manager = DownloadManager(self.working_dir, num_threads=1)
+        running = manager.fetch('s3://bucket/a.tif')
+        self.started.wait(5)
+        queued = manager.fetch('s3://bucket/b.tif')
+        manager.shutdown(cancel=True)
+        self.release.set()
+        self.assertTrue(queued.cancelled())
+        self.assertEqual(running.result(), '/local/a.tif')
+        self.assertEqual(self.calls, ['s3://bucket/a.tif'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Tests for reconciling the plugin's layers in the project with the load options.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rastervision_qgis.experiment_loader import (ExperimentLoader, ExperimentLoadOptions,
+                                                 SceneLoadOptions, IMAGE_LAYER,
+                                                 GROUND_TRUTH_LAYER, PREDICTIONS_LAYER,
+                                                 AOI_LAYER, FOOTPRINTS_LAYER)
+
+
+def make_scene(scene_id):
+    return SimpleNamespace(id=scene_id, label_source=object(), label_store=object(),
+                           aoi_uri=None)
+
+
+class ReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.scenes = [make_scene('a'), make_scene('b')]
+        self.experiment = SimpleNamespace(
+            id='exp', dataset=SimpleNamespace(train_scenes=self.scenes[:1],
+                                              validation_scenes=self.scenes[1:],
+                                              test_scenes=[]))
+        self.owned = {}
+        patcher = mock.patch.object(ExperimentLoader, 'get_owned_layers',
+                                    lambda: self.owned)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def own(self, split, scene_id, kind, experiment_id='exp'):
+        layer = mock.Mock(name='{}-{}-{}'.format(split, scene_id, kind))
+        self.owned.setdefault((experiment_id, split, scene_id, kind), []).append(layer)
+        return layer
+
+    def reconcile(self, train=(), validation=()):
+        options = ExperimentLoadOptions(train_scenes=list(train),
+                                        validation_scenes=list(validation))
+        scenes, layers = ExperimentLoader.reconcile(self.experiment, options)
+        return [(prefix, scene.id, opts) for prefix, scene, opts in scenes], layers
+
+    def test_empty_project_loads_everything(self):
+        scenes, layers = self.reconcile(train=[SceneLoadOptions('a')],
+                                        validation=[SceneLoadOptions('b', load_image=False)])
+        self.assertEqual([(prefix, scene_id) for prefix, scene_id, _ in scenes],
+                         [('train-', 'a'), ('val-', 'b')])
+        train_opts, val_opts = scenes[0][2], scenes[1][2]
+        self.assertTrue(train_opts.load_image and train_opts.load_ground_truth and
+                        train_opts.load_predictions)
+        # The scene has no AOI to load.
+        self.assertFalse(train_opts.load_aoi)
+        self.assertFalse(val_opts.load_image)
+        self.assertEqual(layers, [])
+
+    def test_only_missing_layers_are_loaded(self):
+        self.own('train', 'a', IMAGE_LAYER)
+        self.own('train', 'a', GROUND_TRUTH_LAYER)
+        scenes, layers = self.reconcile(train=[SceneLoadOptions('a')])
+        self.assertEqual(len(scenes), 1)
+        opts = scenes[0][2]
+        self.assertFalse(opts.load_image)
+        self.assertFalse(opts.load_ground_truth)
+        self.assertTrue(opts.load_predictions)
+        self.assertEqual(layers, [])
+
+        self.own('train', 'a', PREDICTIONS_LAYER)
+        self.assertEqual(self.reconcile(train=[SceneLoadOptions('a')]), ([], []))
+
+    def test_unwanted_layers_are_removed(self):
+        kept = self.own('train', 'a', IMAGE_LAYER)
+        predictions = self.own('train', 'a', PREDICTIONS_LAYER)
+        other_scene = self.own('val', 'b', IMAGE_LAYER)
+        other_experiment = self.own('train', 'a', IMAGE_LAYER, experiment_id='other')
+        footprints = self.own('', '', FOOTPRINTS_LAYER)
+        aoi = self.own('train', 'a', AOI_LAYER)
+
+        scenes, layers = self.reconcile(train=[SceneLoadOptions('a', load_ground_truth=False,
+                                                                load_predictions=False)])
+        self.assertEqual(scenes, [])
+        self.assertCountEqual(layers, [predictions, other_scene, other_experiment, aoi])
+        self.assertNotIn(kept, layers)
+        self.assertNotIn(footprints, layers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# coding=utf-8
+"""Tests for reading and caching scene footprints.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rastervision_qgis.footprints import (FootprintCache, get_rasters_footprint,
+                                          merge_footprints)
+
+
+class MergeFootprintsTest(unittest.TestCase):
+    def test_merge(self):
+        a = (0, 0, 10, 10, 'crs-a')
+        b = (5, -5, 20, 8, 'crs-b')
+        self.assertEqual(merge_footprints(a, b), (0, -5, 20, 10, 'crs-a'))
+        self.assertEqual(merge_footprints(None, b), b)
+
+
+class FootprintCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_save_and_read(self):
+        cache = FootprintCache(self.working_dir)
+        cache.put('s3://bucket/a.tif', (0, 0, 10, 10, 'crs'))
+        cache.save()
+        self.assertEqual(FootprintCache(self.working_dir).get('s3://bucket/a.tif'),
+                         (0, 0, 10, 10, 'crs'))
+
+    def test_cached_footprints_are_not_read(self):
+        cache = FootprintCache(self.working_dir)
+        cache.put('s3://bucket/a.tif', (0, 0, 10, 10, 'crs'))
+        cache.put('s3://bucket/b.tif', (5, 5, 20, 20, 'crs'))
+        with mock.patch('rastervision_qgis.footprints.get_raster_footprint') as read:
+            self.assertEqual(get_rasters_footprint(['s3://bucket/a.tif', 's3://bucket/b.tif'],
+                                                   self.working_dir, cache),
+                             (0, 0, 20, 20, 'crs'))
+        read.assert_not_called()
+
+    def test_remote_rasters_that_cant_be_streamed(self):
+        with mock.patch('rastervision_qgis.footprints.get_local_path') as get_local_path:
+            self.assertIsNone(get_rasters_footprint(['s3://bucket/a.jp2'], self.working_dir,
+                                                    download=False))
+        get_local_path.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""Tests for choosing the rasters to build overviews for.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rastervision_qgis.overviews import is_streamed
+
+VRT = '''<VRTDataset rasterXSize="10" rasterYSize="10">
+  <VRTRasterBand dataType="Byte" band="1">
+    <SimpleSource>
+      <SourceFilename relativeToVRT="0">{}</SourceFilename>
+      <SourceBand>1</SourceBand>
+    </SimpleSource>
+  </VRTRasterBand>
+</VRTDataset>
+'''
+
+
+class IsStreamedTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_vrt(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(VRT.format(source))
+        return path
+
+    def test_local_files(self):
+        self.assertFalse(is_streamed(os.path.join(self.dir, 'image.tif')))
+        self.assertFalse(is_streamed(self.write_vrt('local.vrt', '/data/image.tif')))
+
+    def test_streamed_sources(self):
+        mosaic = self.write_vrt('mosaic.vrt', '/vsis3/bucket/image.tif')
+        self.assertTrue(is_streamed(mosaic))
+        self.assertTrue(is_streamed(self.write_vrt('window.vrt', mosaic)))
+        self.assertTrue(is_streamed(
+            self.write_vrt('curl.vrt', '/vsicurl/https://example.com/image.tif')))
+
+
+if __name__ == '__main__':
+    unittest.main()
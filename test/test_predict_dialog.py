@@ -0,0 +1,79 @@
+# coding=utf-8
+"""Tests for the label URIs of batch predictions and the loading of predictions.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rastervision_qgis.cache_index import CacheIndexInstance
+from rastervision_qgis.predict_dialog import (PredictDialogController, get_batch_label_uri)
+
+
+class BatchLabelUriTest(unittest.TestCase):
+    def test_template(self):
+        self.assertEqual(get_batch_label_uri('/out/{layer}/labels.json', 'scene-1'),
+                         '/out/scene-1/labels.json')
+
+    def test_name_added_before_extension(self):
+        self.assertEqual(get_batch_label_uri('/out/labels.json', 'scene-1'),
+                         '/out/labels-scene-1.json')
+        self.assertEqual(get_batch_label_uri('/out/labels', 'scene-1'),
+                         '/out/labels-scene-1')
+
+
+class LoadPredictionTest(unittest.TestCase):
+    cache_key = 'vector-cache://key'
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.index = CacheIndexInstance.get(self.working_dir)
+        # Dropped without saving, as the working directory is removed.
+        self.addCleanup(CacheIndexInstance.indexes.pop, self.working_dir, None)
+
+        layers = [SimpleNamespace(id=lambda: 'prediction')]
+        self.ctx = SimpleNamespace(working_dir=self.working_dir, style_profile=None,
+                                   cache_keys=set([self.cache_key]),
+                                   take_layers=lambda: layers)
+        for target, new in [('PredictDialog', mock.Mock()),
+                            ('load_json_config', mock.Mock()),
+                            ('rv', mock.Mock()),
+                            ('RegistryInstance', mock.Mock()),
+                            ('Settings', mock.Mock()),
+                            ('LoadContext', mock.Mock(return_value=self.ctx)),
+                            ('ExperimentLoader', mock.Mock())]:
+            patcher = mock.patch('rastervision_qgis.predict_dialog.' + target, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.controller = PredictDialogController(mock.Mock())
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_label_caches_are_held_until_the_layer_is_removed(self):
+        self.controller.load_prediction(mock.Mock(), 'prediction', None)
+        self.assertTrue(self.index.is_pinned(self.cache_key))
+
+        self.controller.layer_removed('other')
+        self.assertTrue(self.index.is_pinned(self.cache_key))
+        self.controller.layer_removed('prediction')
+        self.assertFalse(self.index.is_pinned(self.cache_key))
+
+    def test_stop_releases_label_caches(self):
+        self.controller.load_prediction(mock.Mock(), 'prediction', None)
+        self.controller.stop()
+        self.assertFalse(self.index.is_pinned(self.cache_key))
+
+
+if __name__ == '__main__':
+    unittest.main()
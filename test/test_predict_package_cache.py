@@ -0,0 +1,88 @@
+# coding=utf-8
+"""Tests for the cache of unpacked predict packages.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from rastervision_qgis.cache_manager import CacheManager
+from rastervision_qgis.predict_package_cache import PredictPackageCache
+from rastervision_qgis.predict_server import create_predictor
+
+
+class PredictPackageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        self.package_uri = os.path.join(self.working_dir, 'package.zip')
+        with zipfile.ZipFile(self.package_uri, 'w') as package_zip:
+            package_zip.writestr('bundle_config.json', '{}')
+            package_zip.writestr('model', 'weights')
+        self.cache = PredictPackageCache(self.working_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def test_unpacks_once(self):
+        package = self.cache.get(self.package_uri)
+        self.assertEqual(sorted(os.listdir(package.package_dir)),
+                         ['bundle_config.json', 'model'])
+        self.assertTrue(os.path.isfile(package.unpacked_path))
+
+        with mock.patch('zipfile.ZipFile.extractall') as extractall:
+            self.assertEqual(self.cache.get(self.package_uri).cache_dir, package.cache_dir)
+        extractall.assert_not_called()
+        self.assertEqual(self.cache.list(),
+                         [(package.key, PredictPackageCache.get_size(package.cache_dir))])
+
+    def test_tracked_and_evicted_with_the_cache(self):
+        package = self.cache.get(self.package_uri)
+        entry = self.cache.index.get(package.index_key)
+        self.assertEqual(entry['local_path'], package.cache_dir)
+        self.assertEqual(entry['size'], PredictPackageCache.get_size(package.cache_dir))
+
+        self.cache.index.entries[package.index_key]['size'] = 2 * 1024 * 1024
+        self.cache.index.acquire([package.index_key])
+        CacheManager(self.working_dir, max_size_mb=1).evict()
+        self.assertTrue(os.path.isdir(package.cache_dir))
+
+        self.cache.index.release([package.index_key])
+        CacheManager(self.working_dir, max_size_mb=1).evict()
+        self.assertFalse(os.path.exists(package.cache_dir))
+        self.assertIsNone(self.cache.index.get(package.index_key))
+
+        # An evicted package is unpacked again.
+        package = self.cache.get(self.package_uri)
+        self.assertTrue(os.path.isfile(os.path.join(package.package_dir, 'model')))
+
+    def test_clear(self):
+        package = self.cache.get(self.package_uri)
+        self.cache.clear()
+        self.assertEqual(self.cache.list(), [])
+        self.assertIsNone(self.cache.index.get(package.index_key))
+
+    def test_predictor_reads_the_unpacked_bundle(self):
+        with mock.patch('rastervision.predictor.Predictor') as Predictor:
+            create_predictor(self.package_uri, os.path.join(self.working_dir, 'new'), True)
+            Predictor.assert_called_with(self.package_uri, os.path.join(self.working_dir, 'new'),
+                                         update_stats=True)
+
+            package = self.cache.get(self.package_uri)
+            create_predictor(package.package_path, package.cache_dir, False)
+            Predictor.assert_called_with(package.unpacked_path, package.cache_dir,
+                                         update_stats=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
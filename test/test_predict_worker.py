@@ -0,0 +1,273 @@
+# coding=utf-8
+"""Tests for the prediction server protocol, the persistent prediction workers and
+the queue of prediction tasks.
+
+The Docker worker is driven through a fake docker executable, which records its
+commands and runs a fake prediction server for `docker exec`.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import io
+import os
+import sys
+import json
+import stat
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from qgis.core import QgsTask
+
+from rastervision_qgis.predict_server import PredictServer
+from rastervision_qgis.predict_worker import (PredictJob, PredictError,
+                                              SubprocessPredictWorker, PredictTaskQueue,
+                                              DockerContainerPredictWorker)
+
+# Answers jobs like predict_server.py, writing the labels and bundle config, with
+# output that is not part of the protocol mixed in, as native code may write it.
+FAKE_SERVER = '''
+import sys, json
+for line in sys.stdin:
+    job = json.loads(line)
+    print('noise from native code', flush=True)
+    if job.get('fail'):
+        print(json.dumps({'id': job['id'], 'status': 'error', 'error': 'bad job'}), flush=True)
+        continue
+    print(json.dumps({'id': job['id'] - 1, 'status': 'done'}), flush=True)
+    for path in [job['label_uri'], job['config_uri']]:
+        with open(path, 'w') as f:
+            f.write('{}')
+    print(json.dumps({'id': job['id'], 'status': 'progress', 'message': 'Predicting'}),
+          flush=True)
+    print(json.dumps({'id': job['id'], 'status': 'done'}), flush=True)
+'''
+
+# Records its arguments, and keeps the state of one container in a file.
+FAKE_DOCKER = '''#!{python}
+import os, sys, json
+state_dir = os.path.dirname(os.path.abspath(__file__))
+running = os.path.join(state_dir, 'running')
+with open(os.path.join(state_dir, 'docker.log'), 'a') as f:
+    f.write(json.dumps(sys.argv[1:]) + '\\n')
+command = sys.argv[1]
+if command == 'run':
+    open(running, 'w').close()
+    print('container-id')
+elif command == 'rm':
+    if os.path.exists(running):
+        os.remove(running)
+elif command == 'inspect':
+    print('true' if os.path.exists(running) else 'false')
+elif command == 'exec':
+    if not os.path.exists(running):
+        sys.exit(1)
+    os.execv(sys.executable, [sys.executable, os.path.join(state_dir, 'fake_server.py')])
+'''
+
+
+class PredictServerTest(unittest.TestCase):
+    def serve(self, server, jobs):
+        server.serve([json.dumps(job) + '\n' for job in jobs])
+        return [json.loads(line) for line in server.out.getvalue().splitlines()]
+
+    def test_ping(self):
+        server = PredictServer(io.StringIO())
+        self.assertEqual(self.serve(server, [{'id': 1, 'command': 'ping'}]),
+                         [{'id': 1, 'status': 'done'}])
+
+    def test_predict_reuses_predictors(self):
+        job = {'id': 1, 'command': 'predict', 'package_key': 'a', 'package_path': 'a.zip',
+               'package_cache_dir': '/tmp/a', 'image_path': 'image.tif',
+               'label_uri': 'labels.json', 'config_uri': 'config.json',
+               'update_stats': False}
+        other = dict(job, id=3, package_key='b')
+
+        server = PredictServer(io.StringIO(), max_predictors=1)
+        with mock.patch('rastervision.predictor.Predictor') as Predictor:
+            messages = self.serve(server, [job, dict(job, id=2), other, dict(job, id=4)])
+
+        self.assertEqual([m['status'] for m in messages if m['id'] == 2],
+                         ['progress', 'done'])
+        self.assertEqual([m['message'] for m in messages if m['status'] == 'progress'],
+                         ['Loading model', 'Predicting', 'Predicting',
+                          'Loading model', 'Predicting', 'Loading model', 'Predicting'])
+        self.assertEqual(Predictor.call_count, 3)
+        Predictor.return_value.predict.assert_called_with(
+            'image.tif', 'labels.json', 'config.json')
+        self.assertEqual(list(server.predictors), [('a', False)])
+
+    def test_errors_are_reported(self):
+        server = PredictServer(io.StringIO())
+        with mock.patch.object(server, 'get_predictor', side_effect=ValueError('no model')):
+            messages = self.serve(server, [{'id': 1, 'command': 'predict'}])
+        self.assertEqual(messages[-1]['status'], 'error')
+        self.assertIn('no model', messages[-1]['error'])
+
+
+class WorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.working_dir = os.path.join(self.dir, 'working')
+        os.makedirs(self.working_dir)
+        with open(os.path.join(self.dir, 'fake_server.py'), 'w') as f:
+            f.write(FAKE_SERVER)
+        self.package = SimpleNamespace(key='key', uri='s3://bucket/package.zip',
+                                       package_path=os.path.join(self.working_dir,
+                                                                 'package.zip'),
+                                       cache_dir=os.path.join(self.working_dir, 'key'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_job(self, label_dir):
+        tmp_dir = tempfile.mkdtemp(dir=self.working_dir)
+        return PredictJob(self.package, os.path.join(self.working_dir, 'image.tif'),
+                          os.path.join(label_dir, 'labels.json'), False, tmp_dir)
+
+
+class SubprocessPredictWorkerTest(WorkerTestCase):
+    def test_run_skips_other_output(self):
+        worker = SubprocessPredictWorker([sys.executable,
+                                          os.path.join(self.dir, 'fake_server.py')])
+        try:
+            for _ in range(2):
+                job = self.make_job(self.working_dir)
+                worker.run(job, None)
+                self.assertTrue(os.path.exists(job.label_store_uri))
+                self.assertTrue(os.path.exists(job.bundle_config_path))
+            process = worker.process
+            self.assertIsNone(process.poll())
+        finally:
+            worker.stop()
+        self.assertIsNone(worker.process)
+        self.assertIsNotNone(process.poll())
+
+    def test_errors_are_raised(self):
+        worker = SubprocessPredictWorker([sys.executable,
+                                          os.path.join(self.dir, 'fake_server.py')])
+        job = self.make_job(self.working_dir)
+        original_prepare = worker.prepare
+        worker.prepare = lambda job: dict(original_prepare(job), fail=True)
+        try:
+            with self.assertRaises(PredictError):
+                worker.run(job, None)
+        finally:
+            worker.stop()
+
+
+class DockerContainerPredictWorkerTest(WorkerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.docker = os.path.join(self.dir, 'docker')
+        with open(self.docker, 'w') as f:
+            f.write(FAKE_DOCKER.format(python=sys.executable))
+        os.chmod(self.docker, os.stat(self.docker).st_mode | stat.S_IEXEC)
+
+    def docker_commands(self):
+        with open(os.path.join(self.dir, 'docker.log')) as f:
+            return [json.loads(line) for line in f]
+
+    def test_run_and_stop(self):
+        worker = DockerContainerPredictWorker('image', self.working_dir, docker=self.docker)
+        try:
+            # Two jobs in the working directory share one container and server.
+            for _ in range(2):
+                job = self.make_job(self.working_dir)
+                worker.run(job, None)
+                self.assertTrue(os.path.exists(job.label_store_uri))
+            runs = [c for c in self.docker_commands() if c[0] == 'run']
+            self.assertEqual(len(runs), 1)
+            self.assertIn('{0}:{0}'.format(os.path.abspath(self.working_dir)), runs[0])
+            self.assertEqual(len([c for c in self.docker_commands() if c[0] == 'exec']), 1)
+
+            # Labels outside of the mounts restart the container with another mount.
+            label_dir = os.path.join(self.dir, 'labels')
+            job = self.make_job(label_dir)
+            worker.run(job, None)
+            self.assertTrue(os.path.exists(job.label_store_uri))
+            runs = [c for c in self.docker_commands() if c[0] == 'run']
+            self.assertEqual(len(runs), 2)
+            self.assertIn('{0}:{0}'.format(label_dir), runs[1])
+        finally:
+            worker.stop()
+
+        self.assertEqual(self.docker_commands()[-1][:2], ['rm', '-f'])
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'running')))
+        self.assertFalse(worker.container_running)
+        self.assertIsNone(worker.process)
+
+    def test_restarts_a_stopped_container(self):
+        worker = DockerContainerPredictWorker('image', self.working_dir, docker=self.docker)
+        try:
+            worker.run(self.make_job(self.working_dir), None)
+            # The container goes away, taking the server with it.
+            worker._stop_process()
+            os.remove(os.path.join(self.dir, 'running'))
+
+            job = self.make_job(self.working_dir)
+            worker.run(job, None)
+            self.assertTrue(os.path.exists(job.label_store_uri))
+            self.assertEqual(len([c for c in self.docker_commands() if c[0] == 'run']), 2)
+        finally:
+            worker.stop()
+
+
+class FakeTask(QgsTask):
+    def __init__(self, worker):
+        super().__init__('prediction')
+        self.worker = worker
+        self.results = []
+
+    def finished(self, result):
+        self.results.append(result)
+
+
+class PredictTaskQueueTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch('rastervision_qgis.predict_worker.QgsApplication')
+        self.task_manager = patcher.start().taskManager.return_value
+        self.addCleanup(patcher.stop)
+        self.addCleanup(PredictTaskQueue.pending.clear)
+        self.addCleanup(PredictTaskQueue.tasks.clear)
+
+    def started(self):
+        return [args[0] for args, _ in self.task_manager.addTask.call_args_list]
+
+    def test_one_task_per_worker(self):
+        worker, other_worker = object(), object()
+        tasks = [FakeTask(worker), FakeTask(worker), FakeTask(other_worker), FakeTask(worker)]
+        for task in tasks:
+            PredictTaskQueue.add(task)
+        self.assertEqual(self.started(), [tasks[0], tasks[2]])
+
+        tasks[0].taskCompleted.emit()
+        self.assertEqual(self.started(), [tasks[0], tasks[2], tasks[1]])
+        tasks[1].taskTerminated.emit()
+        self.assertEqual(self.started(), [tasks[0], tasks[2], tasks[1], tasks[3]])
+        self.assertEqual(PredictTaskQueue.tasks, [tasks[2], tasks[3]])
+
+    def test_clear_cancels_waiting_tasks(self):
+        worker = object()
+        tasks = [FakeTask(worker), FakeTask(worker)]
+        for task in tasks:
+            PredictTaskQueue.add(task)
+        PredictTaskQueue.clear()
+
+        self.assertFalse(tasks[0].isCanceled())
+        self.assertTrue(tasks[1].isCanceled())
+        self.assertEqual(tasks[1].results, [False])
+        tasks[0].taskCompleted.emit()
+        self.assertEqual(self.started(), [tasks[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Tests for the cache of prediction outputs.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rastervision_qgis.cache_index import CacheIndexInstance
+from rastervision_qgis.prediction_cache import PredictionCache
+from rastervision_qgis.predict_worker import PredictJob
+
+
+class PredictionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        # Dropped without saving, as the working directory is removed.
+        self.addCleanup(CacheIndexInstance.indexes.pop, self.working_dir, None)
+        self.cache = PredictionCache(self.working_dir)
+        self.package = SimpleNamespace(key='package')
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+
+    def make_job(self, name, label_store_uri=None):
+        tmp_dir = os.path.join(self.working_dir, name)
+        os.makedirs(tmp_dir)
+        if label_store_uri is None:
+            label_store_uri = os.path.join(self.working_dir, 'out', name, 'labels.json')
+        return PredictJob(self.package, 'image.tif', label_store_uri, False, tmp_dir)
+
+    def predict(self, job):
+        os.makedirs(os.path.dirname(job.label_store_uri), exist_ok=True)
+        with open(job.label_store_uri, 'w') as f:
+            f.write('{"features": []}')
+        with open(job.bundle_config_path, 'w') as f:
+            f.write('{"bundle": true}')
+
+    def test_put_and_restore(self):
+        key = PredictionCache.get_key(self.package, 'input-v1', None, False)
+        job = self.make_job('first')
+        self.assertFalse(self.cache.contains(key, job.label_store_uri))
+        self.assertFalse(self.cache.restore(key, job))
+
+        self.predict(job)
+        self.cache.put(key, job)
+        self.assertEqual(self.cache.count(), 1)
+
+        other_job = self.make_job('second')
+        self.assertTrue(self.cache.contains(key, other_job.label_store_uri))
+        self.assertTrue(self.cache.restore(key, other_job))
+        with open(other_job.label_store_uri) as f:
+            self.assertEqual(f.read(), '{"features": []}')
+        with open(other_job.bundle_config_path) as f:
+            self.assertEqual(f.read(), '{"bundle": true}')
+
+        self.cache.clear()
+        self.assertEqual(self.cache.count(), 0)
+        self.assertFalse(self.cache.contains(key, other_job.label_store_uri))
+
+    def test_keys(self):
+        window = mock.Mock()
+        window.toString.return_value = '0,0 : 10,10'
+        keys = [PredictionCache.get_key(self.package, 'input-v1', None, False),
+                PredictionCache.get_key(self.package, 'input-v2', None, False),
+                PredictionCache.get_key(self.package, 'input-v1', window, False),
+                PredictionCache.get_key(self.package, 'input-v1', None, True),
+                PredictionCache.get_key(SimpleNamespace(key='other'), 'input-v1', None, False)]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(keys[0], PredictionCache.get_key(self.package, 'input-v1', None, False))
+
+    def test_remote_label_stores_are_not_cached(self):
+        key = PredictionCache.get_key(self.package, 'input-v1', None, False)
+        job = self.make_job('remote', 's3://bucket/labels.json')
+        with open(job.bundle_config_path, 'w') as f:
+            f.write('{}')
+        self.cache.put(key, job)
+        self.assertEqual(self.cache.count(), 0)
+        self.assertFalse(self.cache.contains(key, job.label_store_uri))
+
+    def test_missing_files_are_not_restored(self):
+        key = PredictionCache.get_key(self.package, 'input-v1', None, False)
+        job = self.make_job('first')
+        self.predict(job)
+        self.cache.put(key, job)
+
+        # The bundle config sidecar was removed, e.g. by hand.
+        os.remove(self.cache._get_paths(key, job.label_store_uri)[1])
+        self.assertFalse(self.cache.restore(key, self.make_job('second')))
+
+
+if __name__ == '__main__':
+    unittest.main()
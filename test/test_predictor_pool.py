@@ -0,0 +1,79 @@
+# coding=utf-8
+"""Tests for keeping loaded predictors across predictions.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from rastervision_qgis.predictor_pool import (PredictorPool, MB)
+
+
+class PredictorPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.sizes = {}
+        patcher = mock.patch('rastervision_qgis.predictor_pool.create_predictor',
+                             side_effect=self.create_predictor)
+        self.create = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('rastervision_qgis.predictor_pool.get_package_size',
+                             lambda package: self.sizes[package.key])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def create_predictor(package_path, cache_dir, update_stats):
+        return SimpleNamespace(package_path=package_path, update_stats=update_stats)
+
+    def package(self, key, size_mb=1):
+        self.sizes[key] = size_mb * MB
+        return SimpleNamespace(key=key, uri='s3://bucket/{}.zip'.format(key),
+                               package_path='/tmp/{}.zip'.format(key),
+                               cache_dir='/tmp/{}'.format(key))
+
+    def test_predictors_are_reused(self):
+        pool = PredictorPool()
+        a = self.package('a')
+        predictor = pool.get(a)
+        self.assertIs(pool.get(a), predictor)
+        self.assertIsNot(pool.get(a, update_stats=True), predictor)
+        self.assertEqual(self.create.call_count, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        pool = PredictorPool(max_predictors=2)
+        a, b, c = self.package('a'), self.package('b'), self.package('c')
+        pool.get(a)
+        pool.get(b)
+        # a is used again, so b is the least recently used.
+        pool.get(a)
+        pool.get(c)
+        self.assertEqual(list(pool.predictors), [('a', False), ('c', False)])
+
+        pool.get(b)
+        self.assertEqual(self.create.call_count, 4)
+
+    def test_memory_limit(self):
+        pool = PredictorPool(max_predictors=3, max_memory_mb=100)
+        pool.get(self.package('a', 40))
+        pool.get(self.package('b', 40))
+        pool.get(self.package('c', 40))
+        self.assertEqual(list(pool.predictors), [('b', False), ('c', False)])
+
+        # The most recently used predictor is kept, even if it is over the limit.
+        pool.get(self.package('big', 200))
+        self.assertEqual(list(pool.predictors), [('big', False)])
+
+        pool.clear()
+        self.assertEqual(len(pool.predictors), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
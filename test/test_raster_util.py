@@ -0,0 +1,106 @@
+# coding=utf-8
+"""Tests for the helpers that prepare rasters for prediction.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rastervision_qgis.raster_util import (get_source_paths, get_export_create_options,
+                                           parse_band_order)
+
+VRT = '''<VRTDataset rasterXSize="10" rasterYSize="10">
+  <VRTRasterBand dataType="Byte" band="1">
+{}
+  </VRTRasterBand>
+</VRTDataset>
+'''
+
+SOURCE = '''    <SimpleSource>
+      <SourceFilename relativeToVRT="{}">{}</SourceFilename>
+      <SourceBand>1</SourceBand>
+    </SimpleSource>'''
+
+
+class SourcePathsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_vrt(self, name, sources):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(VRT.format('\n'.join(SOURCE.format(int(relative), source)
+                                         for relative, source in sources)))
+        return path
+
+    def test_plain_file(self):
+        path = os.path.join(self.dir, 'image.tif')
+        self.assertEqual(get_source_paths(path), [path])
+
+    def test_nested_vrts(self):
+        image = os.path.join(self.dir, 'images', 'a.tif')
+        mosaic = self.write_vrt('vrt-cache/mosaic.vrt',
+                                [(False, image),
+                                 (True, 'b.tif'),
+                                 (False, '/vsis3/bucket/c.tif')])
+        window = self.write_vrt('export-cache/window.vrt', [(False, mosaic)])
+
+        self.assertEqual(sorted(get_source_paths(window)),
+                         sorted([window, mosaic, image,
+                                 os.path.join(self.dir, 'vrt-cache', 'b.tif')]))
+
+    def test_unreadable_vrt(self):
+        path = os.path.join(self.dir, 'broken.vrt')
+        with open(path, 'w') as f:
+            f.write('<VRTDataset')
+        self.assertEqual(get_source_paths(path), [path])
+
+
+class ExportCreateOptionsTest(unittest.TestCase):
+    def test_default(self):
+        self.assertEqual(get_export_create_options(),
+                         ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512'])
+
+    def test_compressed(self):
+        self.assertEqual(get_export_create_options('DEFLATE', threads=4),
+                         ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                          'COMPRESS=DEFLATE', 'NUM_THREADS=4'])
+        self.assertEqual(get_export_create_options('ZSTD', tiled=False),
+                         ['COMPRESS=ZSTD', 'NUM_THREADS=ALL_CPUS'])
+
+    def test_block_size_is_a_multiple_of_16(self):
+        self.assertIn('BLOCKXSIZE=256', get_export_create_options(block_size=260))
+        self.assertIn('BLOCKYSIZE=16', get_export_create_options(block_size=4))
+
+    def test_striped(self):
+        self.assertEqual(get_export_create_options('NONE', tiled=False), [])
+
+
+class BandOrderTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_band_order('3,2,1'), [3, 2, 1])
+        self.assertEqual(parse_band_order(' 4, 1 '), [4, 1])
+        self.assertIsNone(parse_band_order(''))
+        self.assertIsNone(parse_band_order('  '))
+
+    def test_invalid(self):
+        for text in ['0,1', 'a,b', '1,,2', '-1']:
+            with self.assertRaises(ValueError):
+                parse_band_order(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
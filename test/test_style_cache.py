@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Tests for reusing parsed style documents across layers.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__copyright__ = 'Copyright 2018, Azavea'
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from rastervision_qgis.style_cache import StyleCache
+
+QML = '<qgis version="3.4"><renderer-v2 type="{}"/></qgis>'
+
+SLD = '''<StyledLayerDescriptor xmlns="http://www.opengis.net/sld">
+  <NamedLayer><Name>labels</Name></NamedLayer>
+</StyledLayerDescriptor>'''
+
+
+class StyleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = StyleCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content, mtime=1000000):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    @staticmethod
+    def make_layer():
+        layer = mock.Mock()
+        layer.importNamedStyle.return_value = (True, '')
+        layer.readSld.return_value = True
+        return layer
+
+    def applied_renderer(self, layer):
+        doc = layer.importNamedStyle.call_args[0][0]
+        return doc.documentElement().firstChildElement('renderer-v2').attribute('type')
+
+    def test_documents_are_reused(self):
+        path = self.write('style.qml', QML.format('singleSymbol'))
+        layers = [self.make_layer() for _ in range(3)]
+        for layer in layers:
+            self.assertTrue(self.cache.apply(layer, path))
+
+        docs = [layer.importNamedStyle.call_args[0][0] for layer in layers]
+        self.assertIs(docs[0], docs[1])
+        self.assertIs(docs[0], docs[2])
+        self.assertEqual(self.cache.get_stats()[0], 2)
+
+    def test_changed_files_are_parsed_again(self):
+        path = self.write('style.qml', QML.format('singleSymbol'))
+        layer = self.make_layer()
+        self.cache.apply(layer, path)
+
+        # Same size, later modification time.
+        self.write('style.qml', QML.format('categorized '), mtime=2000000)
+        self.cache.apply(layer, path)
+        self.assertEqual(self.applied_renderer(layer), 'categorized ')
+
+        # Same modification time, different size.
+        self.write('style.qml', QML.format('graduated'), mtime=2000000)
+        self.cache.apply(layer, path)
+        self.assertEqual(self.applied_renderer(layer), 'graduated')
+        self.assertEqual(self.cache.get_stats()[0], 0)
+
+    def test_sld(self):
+        path = self.write('style.sld', SLD)
+        layer = self.make_layer()
+        self.assertTrue(self.cache.apply(layer, path))
+        element = layer.readSld.call_args[0][0]
+        self.assertEqual(element.tagName(), 'NamedLayer')
+
+    def test_unreadable_styles(self):
+        layer = self.make_layer()
+        self.assertFalse(self.cache.apply(layer, self.write('broken.qml', '<qgis')))
+        self.assertFalse(self.cache.apply(layer, os.path.join(self.dir, 'missing.qml')))
+        layer.importNamedStyle.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()